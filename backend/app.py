@@ -1,5 +1,6 @@
 import os
 import io
+import json
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -10,6 +11,10 @@ from routes.collections import collection_bp
 from routes.visualisation import visualisation_bp
 from routes.converter import converter_bp
 from utils.r2 import fetch_upload_from_r2
+from utils.sharding import configure_sharding
+from utils.cache import configure_cache
+from utils.references import init_reference_registry
+from utils.alignment import configure_alignment
 
 # ----------------- Load environment variables -----------------
 load_dotenv()  # For local dev only; Render uses env vars in dashboard
@@ -28,6 +33,55 @@ TMP_UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/tmp/uploads')
 os.makedirs(TMP_UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = TMP_UPLOAD_FOLDER
 
+# ----------------- Cache Folder -----------------
+# Rendered graphs and precomputed results, keyed by upload version
+app.config['CACHE_FOLDER'] = os.getenv('CACHE_FOLDER', '/tmp/cache')
+os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
+# Least recently used entries are evicted past this size (0 = unbounded)
+app.config['CACHE_MAX_MB'] = int(os.getenv('CACHE_MAX_MB', 2048))
+configure_cache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_MB'])
+
+# ----------------- Memory Ceiling -----------------
+# Uploads estimated to exceed this are aggregated out-of-core in chunks
+app.config['MEMORY_CEILING_MB'] = int(os.getenv('MEMORY_CEILING_MB', 512))
+
+# ----------------- Workspace Cohorts -----------------
+# Member uploads read concurrently when a workspace's aggregates are first merged
+app.config['WORKSPACE_LOAD_WORKERS'] = int(os.getenv('WORKSPACE_LOAD_WORKERS', 4))
+
+# ----------------- Sharded Processing -----------------
+# Large tables are split by sample_id / pep_id across a process pool
+app.config['SHARD_WORKERS'] = int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))
+app.config['SHARD_MIN_ROWS'] = int(os.getenv('SHARD_MIN_ROWS', 2_000_000))
+configure_sharding(app.config['SHARD_WORKERS'], app.config['SHARD_MIN_ROWS'])
+
+# ----------------- Reference Registry -----------------
+# Reference proteomes and domain tables under data/, parsed once at startup
+app.config['DEFAULT_REFERENCE'] = os.getenv('DEFAULT_REFERENCE', 'coxsackievirusB1_P08291')
+# Extra taxon_species -> reference id matches for multi-species antigen maps, beyond the
+# FASTA organism names (e.g. REFERENCE_SPECIES='{"Enterovirus B": "coxsackievirusB1_P08291"}')
+app.config['REFERENCE_SPECIES'] = json.loads(os.getenv('REFERENCE_SPECIES', '{}'))
+init_reference_registry(app)
+
+# ----------------- Alignment Presets -----------------
+# fast / sensitive / very-sensitive / default, globally or per reference id
+# (e.g. REFERENCE_ALIGNMENT_PRESETS='{"coxsackievirusB1_P08291": "fast"}');
+# DIAMOND_THREADS=0 derives threads from the available cores;
+# KMER_FAST_PATH=0 sends every peptide to DIAMOND instead of placing near-exact ones in-process;
+# ALIGNMENT_BATCH_WINDOW_MS is how long concurrent alignments wait to share one DIAMOND run (0: never);
+# MAX_CONCURRENT_ALIGNMENTS bounds the per-species alignments of a multi-species antigen map job
+app.config['ALIGNMENT_PRESET'] = os.getenv('ALIGNMENT_PRESET', 'default')
+app.config['REFERENCE_ALIGNMENT_PRESETS'] = json.loads(os.getenv('REFERENCE_ALIGNMENT_PRESETS', '{}'))
+app.config['DIAMOND_THREADS'] = int(os.getenv('DIAMOND_THREADS', 0))
+app.config['KMER_FAST_PATH'] = bool(int(os.getenv('KMER_FAST_PATH', 1)))
+app.config['ALIGNMENT_BATCH_WINDOW_MS'] = int(os.getenv('ALIGNMENT_BATCH_WINDOW_MS', 50))
+app.config['MAX_CONCURRENT_ALIGNMENTS'] = int(os.getenv('MAX_CONCURRENT_ALIGNMENTS', 4))
+# DEBUG_ALIGNMENT_FASTA=1 writes the peptides sent to DIAMOND to uploads/cache/debug_upload_<id>.fasta
+app.config['DEBUG_ALIGNMENT_FASTA'] = bool(int(os.getenv('DEBUG_ALIGNMENT_FASTA', 0)))
+configure_alignment(app.config['ALIGNMENT_PRESET'], app.config['REFERENCE_ALIGNMENT_PRESETS'],
+                    app.config['DIAMOND_THREADS'], app.config['KMER_FAST_PATH'],
+                    app.config['ALIGNMENT_BATCH_WINDOW_MS'] / 1000, app.config['MAX_CONCURRENT_ALIGNMENTS'])
+
 # ----------------- R2 Configuration -----------------
 app.config['R2_BUCKET_NAME'] = os.getenv("R2_BUCKET_NAME")
 app.config['R2_ACCESS_KEY_ID'] = os.getenv("R2_ACCESS_KEY_ID")
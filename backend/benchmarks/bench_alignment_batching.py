@@ -0,0 +1,60 @@
+"""
+Throughput of concurrent antigen-map alignments with and without the
+alignment batcher: N threads each align their own synthetic upload against
+the same database. Needs the diamond binary on PATH.
+
+Run from backend/:  python -m benchmarks.bench_alignment_batching --uploads 4 8 16 --window-ms 0 50
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_alignment_presets import synthetic_library
+from benchmarks.synthetic import REFERENCE_FASTA
+from utils.alignment import configure_alignment
+from utils.alignment_batcher import AlignmentBatcher
+from utils.diamond_db import run_makedb
+from utils.viruses.enterovirus import diamond_blast_df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--peptides", type=int, default=5000, help="peptides per upload")
+    parser.add_argument("--window-ms", type=int, nargs="+", default=[0, 50])
+    parser.add_argument("--threads", type=int, default=1, help="DIAMOND threads per run")
+    args = parser.parse_args()
+
+    if shutil.which("diamond") is None:
+        sys.exit("diamond is not on PATH")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "reference.dmnd")
+        run_makedb(REFERENCE_FASTA, db_path)
+        configure_alignment(threads=args.threads)
+
+        print(f"{'uploads':>7} {'window':>7} {'seconds':>8} {'uploads/s':>10} {'diamond runs':>13}")
+        for n_uploads in args.uploads:
+            # Half the uploads share a library, as with repeated runs of one PhIP-Seq design
+            libraries = [synthetic_library(args.peptides, mutation_rate=0.05, seed=i % max(n_uploads // 2, 1))
+                         for i in range(n_uploads)]
+            for window_ms in args.window_ms:
+                configure_alignment(batch_window=window_ms / 1000)
+                runs = []
+
+                def counting_runner(fasta, db, preset):
+                    runs.append(fasta)
+                    return diamond_blast_df(fasta, db, preset)
+
+                batcher = AlignmentBatcher(counting_runner)
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=n_uploads) as pool:
+                    list(pool.map(lambda lib: batcher.align(lib, db_path, "default"), libraries))
+                elapsed = time.perf_counter() - t0
+                print(f"{n_uploads:>7} {window_ms:>5}ms {elapsed:>8.2f} {n_uploads / elapsed:>10.2f} {len(runs):>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Runtime and hit recall of each DIAMOND alignment preset on synthetic PhIP-Seq
+peptide libraries, and whether the antigen map it yields is identical to the
+most sensitive preset's. Needs the diamond binary on PATH.
+
+Run from backend/:  python -m benchmarks.bench_alignment_presets --peptides 2000 10000 --mutation-rate 0 0.05 0.15
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import REFERENCE_FASTA, load_reference_sequence
+from utils.alignment import ALIGNMENT_PRESETS
+from utils.antigen_profile import build_antigen_profile, moving_sum_from_profile
+from utils.diamond_db import run_makedb
+from utils.viruses.enterovirus import generate_temp_fasta_from_peptides, diamond_blast_df
+
+AMINO_ACIDS = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+
+def synthetic_library(n_peptides, pep_len=56, mutation_rate=0.0, seed=0):
+    """Peptides cut from the reference at random offsets, with point substitutions."""
+    rng = np.random.default_rng(seed)
+    reference = load_reference_sequence()
+    starts = rng.integers(0, len(reference) - pep_len, n_peptides)
+    peptides = np.array([list(reference[s:s + pep_len]) for s in starts])
+    mutate = rng.random(peptides.shape) < mutation_rate
+    peptides[mutate] = AMINO_ACIDS[rng.integers(0, len(AMINO_ACIDS), mutate.sum())]
+    return pd.DataFrame({
+        "pep_id": [f"pep_{i:06d}" for i in range(n_peptides)],
+        "pep_aa": ["".join(p) for p in peptides],
+        "true_start": starts + 1,
+    })
+
+def antigen_map(blast_df, values):
+    hits = blast_df.merge(values, left_on="qseqid", right_on="pep_id", how="left")
+    if hits.empty:
+        return pd.DataFrame(columns=["window_start", "window_end", "moving_sum"])
+    return moving_sum_from_profile(build_antigen_profile(hits), 32, 4)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peptides", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--mutation-rate", type=float, nargs="+", default=[0.0, 0.05, 0.15])
+    parser.add_argument("--presets", nargs="+", default=list(ALIGNMENT_PRESETS))
+    args = parser.parse_args()
+
+    if shutil.which("diamond") is None:
+        sys.exit("diamond is not on PATH")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "reference.dmnd")
+        run_makedb(REFERENCE_FASTA, db_path)
+        rng = np.random.default_rng(1)
+
+        print(f"{'peptides':>8} {'mut':>5} {'preset':<15} {'seconds':>8} {'hits':>7} {'recall':>7} {'same map':>9}")
+        for n_peptides in args.peptides:
+            for rate in args.mutation_rate:
+                library = synthetic_library(n_peptides, mutation_rate=rate)
+                values = pd.DataFrame({"pep_id": library["pep_id"],
+                                       "mean_rpk_difference": rng.normal(size=len(library))})
+                fasta = generate_temp_fasta_from_peptides(library)
+                try:
+                    results = {}
+                    for preset in args.presets:
+                        t0 = time.perf_counter()
+                        blast_df = diamond_blast_df(fasta, db_path, preset=preset)
+                        elapsed = time.perf_counter() - t0
+                        first = blast_df.drop_duplicates(subset=["qseqid"]).merge(
+                            library, left_on="qseqid", right_on="pep_id")
+                        recall = (abs(first["sstart"] - first["true_start"]) <= 2).sum() / len(library)
+                        results[preset] = (elapsed, len(blast_df), recall, antigen_map(blast_df, values))
+
+                    # Baseline: the most sensitive preset that was run
+                    baseline = next(p for p in ["very-sensitive", "sensitive", "default", "fast"] if p in results)
+                    for preset, (elapsed, n_hits, recall, ms) in results.items():
+                        same = ms.reset_index(drop=True).equals(results[baseline][3].reset_index(drop=True))
+                        print(f"{n_peptides:>8} {rate:>5.2f} {preset:<15} {elapsed:>8.2f} {n_hits:>7} "
+                              f"{recall:>7.3f} {str(same):>9}")
+                finally:
+                    os.remove(fasta)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Memory and aggregation time of the compact (categorical) long table versus
+plain object columns.
+
+Run from backend/:  python -m benchmarks.bench_compact_dataset --samples 200 --peptides 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_long_table
+from utils.dataset import (
+    read_long_table, compute_rpk, memory_usage_bytes,
+    species_heatmap_matrix, ANTIGEN_MAP_COLUMNS
+)
+from utils.viruses.enterovirus import calculate_mean_rpk_difference
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--peptides", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_long_table(os.path.join(tmp, "upload.csv"),
+                                n_samples=args.samples, n_peptides=args.peptides)
+        columns = ANTIGEN_MAP_COLUMNS + ["taxon_species"]
+
+        print(f"{'mode':<8} {'rows':>10} {'memory MB':>10} {'read s':>8} {'rpk s':>8} {'heatmap s':>10} {'mean diff s':>12}")
+        for compact in (False, True):
+            df, t_read = timed(read_long_table, path, columns=columns, compact=compact)
+            df, t_rpk = timed(compute_rpk, df)
+            _, t_heat = timed(species_heatmap_matrix, df, 20)
+            _, t_diff = timed(calculate_mean_rpk_difference, df)
+            mode = "compact" if compact else "object"
+            print(f"{mode:<8} {len(df):>10} {memory_usage_bytes(df) / 1e6:>10.1f} "
+                  f"{t_read:>8.2f} {t_rpk:>8.2f} {t_heat:>10.2f} {t_diff:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Serialisation time and payload size of the species matrix endpoints for each
+wire format (json / typed / arrow) and content encoding (identity / gzip / br).
+The 'flask json' row is the previous jsonify(values.tolist()) path.
+
+Run from backend/:  python -m benchmarks.bench_matrix_transport --samples 200 2000 5000 --species 20
+"""
+import argparse
+import time
+
+import numpy as np
+from flask import Flask, jsonify
+
+from benchmarks.synthetic import make_long_table
+from utils.dataset import compute_rpk, species_by_sample, top_species_heatmap
+from utils.matrix_transport import (
+    MATRIX_FORMATS, encode_matrix, compress_bytes, decode_typed_matrix, brotli
+)
+
+def timed(fn, *args, repeat=3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return result, best * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, nargs="+", default=[200, 2000, 5000])
+    parser.add_argument("--species", type=int, default=20)
+    parser.add_argument("--peptides", type=int, default=400)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    encodings = [None, "gzip"] + (["br"] if brotli is not None else [])
+
+    for n_samples in args.samples:
+        df = compute_rpk(make_long_table(n_samples=n_samples, n_peptides=args.peptides))
+        heatmap = top_species_heatmap(species_by_sample(df), args.species)
+        print(f"\n{heatmap.shape[0]} species x {heatmap.shape[1]} samples")
+        print(f"{'format':<10} {'encoding':<9} {'encode ms':>10} {'compress ms':>12} {'bytes':>10}")
+
+        with app.app_context():
+            def flask_json():
+                return jsonify({
+                    "species": list(heatmap.index),
+                    "samples": list(heatmap.columns),
+                    "values": heatmap.values.tolist()
+                }).get_data()
+            data, ms = timed(flask_json)
+            print(f"{'flask json':<10} {'identity':<9} {ms:>10.1f} {0:>12.1f} {len(data):>10}")
+
+        for fmt in MATRIX_FORMATS:
+            (data, _), encode_ms = timed(encode_matrix, heatmap, "species", "samples", fmt)
+            if fmt == "typed":
+                _, values = decode_typed_matrix(data)
+                assert np.allclose(values, heatmap.values, rtol=1e-6, equal_nan=True)
+            for encoding in encodings:
+                body, compress_ms = timed(compress_bytes, data, encoding)
+                print(f"{fmt:<10} {encoding or 'identity':<9} {encode_ms:>10.1f} {compress_ms:>12.1f} {len(body):>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Throughput (permutations per second) of the antigen-map permutation test
+with the number of pool workers, and a check that every worker count gives
+identical p-values for the same seed. Peptides are placed with the k-mer
+index, so DIAMOND is not needed.
+
+Run from backend/:  python -m benchmarks.bench_permutation --samples 400 --peptides 20000 --permutations 10000 --workers 1 2 4
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import make_long_table
+from utils.antigen_profile import build_antigen_profile, moving_sum_from_profile
+from utils.dataset import compact_long_df, compute_rpk
+from utils.kmer_index import KmerIndex
+from utils.peptide_matrix import PeptideSampleMatrix
+from utils.permutation import window_design, sample_contrast, permutation_pvalues
+from utils.references import read_fasta_records
+from utils.sharding import configure_sharding, _get_pool
+from benchmarks.synthetic import REFERENCE_FASTA
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=400)
+    parser.add_argument("--peptides", type=int, default=20000)
+    parser.add_argument("--permutations", type=int, default=10000)
+    parser.add_argument("--win-size", type=int, default=32)
+    parser.add_argument("--step-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = compute_rpk(compact_long_df(make_long_table(n_samples=args.samples, n_peptides=args.peptides)))
+    matrix = PeptideSampleMatrix.from_long(df)
+    peptides = df[['pep_id', 'pep_aa']].drop_duplicates(subset=['pep_id']).astype(str)
+    hits, _ = KmerIndex(read_fasta_records(REFERENCE_FASTA)).resolve(peptides)
+    merged = hits.merge(matrix.mean_difference(), left_on='qseqid', right_on='pep_id')
+    moving_sum_df = moving_sum_from_profile(build_antigen_profile(merged), args.win_size, args.step_size)
+
+    t0 = time.perf_counter()
+    design = window_design(hits, matrix, moving_sum_df['window_start'].to_numpy(), args.win_size)
+    contrast = sample_contrast(matrix)
+    print(f"{len(design)} windows x {design.shape[1]} samples, design built in {time.perf_counter() - t0:.3f}s")
+
+    print(f"{'workers':>7} {'seconds':>8} {'perms/s':>10} {'same p':>7}")
+    reference = None
+    for workers in args.workers:
+        configure_sharding(workers=workers)
+        if workers > 1:
+            _get_pool().submit(int).result()  # start the pool outside the timing
+        t0 = time.perf_counter()
+        _, p_values = permutation_pvalues(design, contrast, args.permutations, args.seed)
+        elapsed = time.perf_counter() - t0
+        reference = p_values if reference is None else reference
+        same = bool((p_values == reference).all())
+        print(f"{workers:>7} {elapsed:>8.2f} {args.permutations / elapsed:>10.0f} {str(same):>7}")
+
+if __name__ == "__main__":
+    main()
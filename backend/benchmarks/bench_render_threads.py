@@ -0,0 +1,57 @@
+"""
+Graph throughput of the object-oriented plotting layer when rendering from
+a thread pool, as gunicorn gthread workers do within one process.
+
+Imports utils.visualisation, so DATABASE_URL must be set (no connection is made).
+
+Run from backend/:  python -m benchmarks.bench_render_threads --graphs 24 --threads 1 2 4 8
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_long_table
+from utils.dataset import compute_rpk, species_heatmap_matrix, species_barplot_matrix
+from utils.visualisation import plot_rpk_heatmap, plot_rpk_stacked_barplot
+from utils.viruses.enterovirus import render_antigen_map_png
+
+def synthetic_moving_sum(length=2182, win_size=32, step_size=4, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = np.arange(1, length - win_size, step_size)
+    return pd.DataFrame({
+        "window_start": starts,
+        "window_end": starts + win_size - 1,
+        "moving_sum": np.convolve(rng.normal(size=len(starts)), np.ones(5), mode="same"),
+    })
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graphs", type=int, default=24)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    df = compute_rpk(make_long_table(n_samples=40, n_peptides=2000))
+    heatmap = species_heatmap_matrix(df, 20)
+    barplot = species_barplot_matrix(df, 10)
+    moving_sum = synthetic_moving_sum()
+    renders = [
+        lambda: plot_rpk_heatmap(heatmap, 20),
+        lambda: plot_rpk_stacked_barplot(barplot, 10),
+        lambda: render_antigen_map_png(moving_sum),
+    ]
+    jobs = [renders[i % len(renders)] for i in range(args.graphs)]
+
+    print(f"{'threads':>7} {'seconds':>8} {'graphs/s':>9}")
+    for threads in args.threads:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            images = list(pool.map(lambda fn: fn(), jobs))
+        elapsed = time.perf_counter() - t0
+        assert all(img.startswith(b"\x89PNG") for img in images)
+        print(f"{threads:>7} {elapsed:>8.2f} {len(images) / elapsed:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Scaling of the sharded (process pool + shared memory) aggregation helpers
+with the number of workers.
+
+Run from backend/:  python -m benchmarks.bench_sharding --samples 400 --peptides 10000 --workers 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_long_table
+from utils.dataset import compact_long_df, compute_rpk, species_by_sample
+from utils.sharding import configure_sharding, _get_pool, sharded_group_mean, sharded_moving_sum
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+def synthetic_hits(n_peptides, length=2182, pep_len=56, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(1, length - pep_len, n_peptides)
+    return pd.DataFrame({
+        "qseqid": np.arange(n_peptides),
+        "sstart": starts,
+        "send": starts + pep_len - 1,
+        "mean_rpk_difference": rng.normal(size=n_peptides),
+    })
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=400)
+    parser.add_argument("--peptides", type=int, default=10000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    df = compact_long_df(make_long_table(n_samples=args.samples, n_peptides=args.peptides))
+    hits = synthetic_hits(args.peptides)
+    print(f"{len(df)} rows, {args.peptides} peptides")
+    print(f"{'workers':>7} {'rpk s':>8} {'species s':>10} {'mean diff s':>12} {'moving sum s':>13}")
+
+    for workers in args.workers:
+        configure_sharding(workers=workers, min_rows=0)
+        _get_pool().submit(int).result()  # start the pool outside the timings
+        rpk_df, t_rpk = timed(compute_rpk, df)
+        _, t_species = timed(species_by_sample, rpk_df)
+        _, t_diff = timed(sharded_group_mean, rpk_df, 'pep_id', 'Condition')
+        window_starts = np.arange(hits['sstart'].min(), hits['send'].max() - 30)
+        _, t_moving = timed(sharded_moving_sum, hits['sstart'], hits['send'], hits['mean_rpk_difference'],
+                            window_starts, 32)
+        print(f"{workers:>7} {t_rpk:>8.2f} {t_species:>10.2f} {t_diff:>12.2f} {t_moving:>13.2f}")
+
+if __name__ == "__main__":
+    main()
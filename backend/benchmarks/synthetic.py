@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pandas as pd
+
+REFERENCE_FASTA = os.path.join(os.path.dirname(__file__), "..", "data", "coxsackievirusB1_P08291.fasta")
+
+# -----------------------
+# Helper: read reference sequence used to cut synthetic peptides
+# -----------------------
+def load_reference_sequence(fasta_path=REFERENCE_FASTA):
+    with open(fasta_path) as f:
+        return "".join(line.strip() for line in f if not line.startswith(">"))
+
+# -----------------------
+# Synthetic VirScan-style long table
+# -----------------------
+def make_long_table(n_samples=50, n_peptides=2000, n_species=40, pep_len=56,
+                    zero_fraction=0.8, seed=0):
+    """
+    One row per (sample, peptide) with the columns the app expects:
+    sample_id, pep_id, pep_aa, taxon_species, abundance, Condition.
+    Peptides are cut from the Coxsackievirus B1 reference so they align.
+    """
+    rng = np.random.default_rng(seed)
+    reference = load_reference_sequence()
+
+    pep_ids = np.array([f"pep_{i:06d}" for i in range(n_peptides)])
+    starts = rng.integers(0, len(reference) - pep_len, n_peptides)
+    pep_aa = np.array([reference[s:s + pep_len] for s in starts])
+    species = np.array([f"Synthetic virus {i}" for i in range(n_species)])
+    pep_species = species[rng.integers(0, n_species, n_peptides)]
+
+    sample_ids = np.array([f"S{i:05d}" for i in range(n_samples)])
+    conditions = np.where(np.arange(n_samples) % 2 == 0, "Case", "Control")
+
+    abundance = rng.poisson(5, size=(n_samples, n_peptides))
+    abundance[rng.random((n_samples, n_peptides)) < zero_fraction] = 0
+
+    return pd.DataFrame({
+        "sample_id": np.repeat(sample_ids, n_peptides),
+        "pep_id": np.tile(pep_ids, n_samples),
+        "pep_aa": np.tile(pep_aa, n_samples),
+        "taxon_species": np.tile(pep_species, n_samples),
+        "abundance": abundance.ravel(),
+        "Condition": np.repeat(conditions, n_peptides),
+    })
+
+def write_long_table(path, **kwargs):
+    df = make_long_table(**kwargs)
+    df.to_csv(path, index=False)
+    return path
@@ -1,26 +1,70 @@
 import io
-import os
+import logging
+import numpy as np
 import pandas as pd
 from flask import Blueprint, current_app, jsonify, request, send_file, g
 
 # ----------------------- Imports -----------------------
 from utils.visualisation import (
-    compute_rpk,
-    plot_rpk_stacked_barplot,
-    plot_rpk_heatmap,
+    draw_rpk_stacked_barplot,
+    draw_rpk_heatmap,
     generate_pdf,
-    load_upload_file
+    load_species_matrix,
+    load_antigen_map_inputs,
+    load_peptide_matrix,
+    load_upload_partials,
+    load_sample_metadata
+)
+from utils.dataset import (
+    build_row_filters,
+    top_species_heatmap,
+    top_species_barplot
 )
 from utils.viruses.enterovirus import (
-    prepare_antigen_map_df,
-    plot_antigen_map,
+    prepare_antigen_hits,
+    draw_antigen_map,
+)
+from utils.references import get_reference, get_reference_registry, get_kmer_index
+from utils.alignment import resolve_preset, ALIGNMENT_PRESETS
+from utils.hit_index import HitIndex
+from utils.species_maps import align_species, species_tracks
+from utils.permutation import window_significance, ALTERNATIVES
+from utils.differential import differential_stats, sort_and_page
+from utils.clustering import clustered_order, validate_cluster_options
+from utils.sample_metadata import group_species_matrix, with_sample_groups
+from utils.cohort import load_concurrently, merge_partials, cohort_antigen_profile, DEFAULT_LOAD_WORKERS
+from utils.domain_rollup import assign_domains, domain_condition_rollup, domain_sample_rollup
+from utils.antigen_profile import build_antigen_profile, moving_sum_from_profile, residue_profile, COMMON_WIN_SIZES
+from utils.plotting import render_tier, RENDER_TIERS, DEFAULT_TIER
+from utils.chart_specs import heatmap_spec, stacked_barplot_spec, antigen_map_spec, ev_domain_track
+from utils.matrix_transport import negotiate_matrix_format, encode_matrix, encode_for_request
+from utils.heatmap_tiles import (
+    store_pyramid,
+    load_pyramid_meta,
+    drop_pyramid_meta,
+    load_level,
+    tile_bounds,
+    tile_labels,
+    render_tile_png
+)
+from utils.cache import (
+    get_cache_folder,
+    upload_version,
+    cache_key,
+    cache_get_bytes,
+    cache_put_bytes,
+    cache_get_pickle,
+    cache_put_pickle,
+    single_flight,
+    cached_pickle
 )
 from utils.db import Session
-from models.models import Upload, GraphText
+from models.models import Upload, GraphText, Workspace
 from routes.auth import jwt_required
 from utils.r2 import fetch_upload_from_r2
 
 visualisation_bp = Blueprint('visualisation', __name__)
+logger = logging.getLogger(__name__)
 
 # ---------------- Helper to check upload permissions ----------------
 def get_upload_or_forbidden(session, upload_id, user_id):
@@ -31,30 +75,320 @@ def get_upload_or_forbidden(session, upload_id, user_id):
         return None, jsonify({"error": "Forbidden"}), 403
     return upload, None, None
 
+# ---------------- Helper to check workspace permissions ----------------
+def get_workspace_uploads_or_forbidden(session, workspace_id, user_id):
+    # Base uploads only; metadata files carry no reads
+    workspace = session.get(Workspace, workspace_id)
+    if not workspace:
+        return None, jsonify({"error": "Workspace not found"}), 404
+    if workspace.user_id != user_id:
+        return None, jsonify({"error": "Forbidden"}), 403
+    uploads = session.query(Upload).filter(
+        Upload.workspace_id == workspace_id,
+        Upload.file_type == 'base'
+    ).order_by(Upload.upload_id).all()
+    if not uploads:
+        return None, jsonify({"error": "Workspace has no base uploads"}), 404
+    return uploads, None, None
+
+# ---------------- Helper to pick a metadata upload and column from query args ----------------
+def sample_groups_from_request(session, user_id):
+    # ?metadata=<metadata upload id>&group_by=<column>; (None, None) without ?metadata
+    metadata_id = request.args.get('metadata', type=int)
+    if metadata_id is None:
+        return None, None, None, None
+    metadata_upload, err_resp, status = get_upload_or_forbidden(session, metadata_id, user_id)
+    if err_resp:
+        return None, None, err_resp, status
+    if metadata_upload.file_type != 'metadata':
+        return None, None, jsonify({"error": f"Upload {metadata_id} is not a metadata file"}), 400
+    group_by = request.args.get('group_by')
+    if not group_by:
+        return None, None, jsonify({"error": "group_by is required with metadata"}), 400
+    return metadata_upload, group_by, None, None
+
+# ---------------- Helper to read row filters from query args ----------------
+def row_filters_from_request():
+    # e.g. ?samples=S1&samples=S2&species=...&condition=Case
+    return build_row_filters(
+        samples=request.args.getlist('samples'),
+        species=request.args.getlist('species'),
+        conditions=request.args.getlist('condition')
+    )
+
+# ---------------- Helper to run the antigen map pipeline ----------------
+ALIGNMENT_HIT_COLUMNS = ['qseqid', 'sstart', 'send', 'mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference']
+
+def get_antigen_alignment(upload, filters, reference=None, preset=None):
+    """
+    DIAMOND run once per upload version, filters and reference db version.
+    Moving sums for any window/step, hit queries and domain summaries reuse it.
+    """
+    reference = reference or get_reference()
+    preset = preset or resolve_preset(None, reference.id)
+    kmer_index = get_kmer_index(reference)
+    folder = get_cache_folder(current_app, "antigen_map")
+    key = cache_key(upload_version(upload), filters, reference.id, reference.db_version, preset,
+                    kmer_index is not None, "antigen_alignment")
+
+    def align():
+        peptides_df, mean_diff_df = load_antigen_map_inputs(upload.upload_id, current_app, filters=filters)
+        merged, _ = prepare_antigen_hits(
+            upload.upload_id,
+            peptides_df,
+            reference.diamond_db_path,
+            cache_folder=current_app.config.get("CACHE_FOLDER"),
+            mean_diff_df=mean_diff_df,
+            preset=preset,
+            kmer_index=kmer_index
+        )
+        return {
+            "hits": merged[ALIGNMENT_HIT_COLUMNS],
+            "profile": build_antigen_profile(merged),
+            "index": HitIndex.from_hits(merged),
+        }
+
+    # Concurrent PNG/JSON/spec requests for the same map share one alignment
+    alignment = cached_pickle(folder, key, align)
+    # Domains come from the registry (parsed once at startup), never the cache
+    return dict(alignment, ev_df=reference.ev_df)
+
+def get_antigen_profile(upload, filters, reference=None, preset=None):
+    alignment = get_antigen_alignment(upload, filters, reference, preset)
+    return alignment["profile"], alignment["ev_df"]
+
+def compute_antigen_map(upload, filters, win_size, step_size, reference=None, preset=None):
+    profile, ev_df = get_antigen_profile(upload, filters, reference, preset)
+    return moving_sum_from_profile(profile, win_size, step_size), ev_df
+
+def get_species_alignments(upload, filters, preset=None):
+    """
+    Every species in the upload aligned against its reference in one job
+    (see utils/species_maps.py), cached per upload version, filters, preset
+    and the registry's references and species matches.
+    """
+    registry = get_reference_registry()
+    kmer_indexes = {ref_id: get_kmer_index(registry.get(ref_id)) for ref_id in registry.ids()}
+    folder = get_cache_folder(current_app, "antigen_map")
+    key = cache_key(upload_version(upload), filters, preset,
+                    [(ref_id, registry.get(ref_id).db_version, resolve_preset(preset, ref_id),
+                      kmer_indexes[ref_id] is not None) for ref_id in registry.ids()],
+                    sorted(registry.species_index.items()), "species_alignments")
+
+    def align():
+        peptides_df, mean_diff_df = load_antigen_map_inputs(upload.upload_id, current_app, filters=filters,
+                                                            with_species=True)
+        results, unmatched, failed = align_species(peptides_df, mean_diff_df, registry, preset=preset,
+                                                   kmer_indexes=kmer_indexes)
+        return {"results": results, "unmatched": unmatched, "failed": failed}
+
+    def align_and_store():
+        # Failed references (e.g. a .dmnd still building) are retried on the next request
+        alignments = align()
+        if not alignments["failed"]:
+            cache_put_pickle(folder, key, alignments)
+        return alignments
+
+    alignments, _ = single_flight(folder, key, lambda: cache_get_pickle(folder, key), align_and_store)
+    return alignments
+
+# ---------------- Helper to load the species x sample matrix once per upload version ----------------
+def get_species_matrix(upload, filters):
+    # Shared by the heatmap/barplot PNG, JSON, spec and tile routes
+    folder = get_cache_folder(current_app, "species")
+    key = cache_key(upload_version(upload), filters, "species_matrix")
+    return cached_pickle(folder, key,
+                         lambda: load_species_matrix(upload.upload_id, current_app, filters=filters))
+
+# ---------------- Helpers to load small per-upload tables once per upload version ----------------
+def get_sample_metadata(metadata_upload):
+    folder = get_cache_folder(current_app, "metadata")
+    key = cache_key(upload_version(metadata_upload), "sample_metadata")
+    return cached_pickle(folder, key, lambda: load_sample_metadata(metadata_upload.upload_id, current_app))
+
+def get_peptide_matrix(upload, filters):
+    # Regrouping by another metadata column reuses the matrix instead of re-reading the upload
+    folder = get_cache_folder(current_app, "peptide_matrix")
+    key = cache_key(upload_version(upload), filters, "peptide_matrix")
+    return cached_pickle(folder, key,
+                         lambda: load_peptide_matrix(upload.upload_id, current_app, filters=filters))
+
+# ---------------- Helpers to merge a workspace's uploads once per set of upload versions ----------------
+def workspace_version(uploads):
+    # Changes when any member upload is added, removed or replaced
+    return sorted(upload_version(upload) for upload in uploads)
+
+def get_upload_partials(upload, filters):
+    # Cached per upload, so adding an upload to a workspace only reads the new one
+    folder = get_cache_folder(current_app, "cohort")
+    key = cache_key(upload_version(upload), filters, "upload_partials")
+    return cached_pickle(folder, key,
+                         lambda: load_upload_partials(upload.upload_id, current_app, filters=filters))
+
+def get_workspace_aggregates(uploads, filters):
+    """Species matrix, mean differences and peptides of every upload merged (see utils/cohort.py)."""
+    app = current_app._get_current_object()
+    folder = get_cache_folder(app, "cohort")
+    key = cache_key(workspace_version(uploads), filters, "workspace_aggregates_by_upload")
+
+    def load(upload):
+        with app.app_context():
+            return get_upload_partials(upload, filters)
+
+    def merge():
+        workers = int(app.config.get("WORKSPACE_LOAD_WORKERS") or DEFAULT_LOAD_WORKERS)
+        partials = load_concurrently(load, uploads, workers)
+        return merge_partials({upload.upload_id: p for upload, p in zip(uploads, partials)})
+
+    return cached_pickle(folder, key, merge)
+
+def get_workspace_antigen_profile(uploads, filters, reference, preset):
+    kmer_index = get_kmer_index(reference)
+    folder = get_cache_folder(current_app, "antigen_map")
+    key = cache_key(workspace_version(uploads), filters, reference.id, reference.db_version, preset,
+                    kmer_index is not None, "workspace_antigen_profile")
+    profile = cached_pickle(folder, key, lambda: cohort_antigen_profile(
+        get_workspace_aggregates(uploads, filters), reference.diamond_db_path, preset, kmer_index))
+    return profile, reference.ev_df
+
+# ---------------- Helpers for (optionally clustered) heatmap ordering ----------------
+def cluster_options_from_request():
+    # ?cluster=samples|species|both with ?metric= and ?method=; without it
+    # species stay ranked by total RPK and samples sorted by id
+    axis = request.args.get('cluster') or None
+    if axis is None:
+        return None, None, None
+    options = {
+        "axis": axis,
+        "metric": request.args.get('metric', 'euclidean'),
+        "method": request.args.get('method', 'average'),
+    }
+    try:
+        validate_cluster_options(**options)
+    except ValueError as e:
+        return None, jsonify({"error": str(e)}), 400
+    return options, None, None
+
+def get_heatmap_order(version, filters, heatmap_data, top_n_species, cluster):
+    # Linkage is cached per upload (or workspace) version, so re-rendering a clustered heatmap skips it
+    folder = get_cache_folder(current_app, "clustering")
+    key = cache_key(version, filters, top_n_species, cluster, "heatmap_linkage")
+    return cached_pickle(folder, key, lambda: clustered_order(heatmap_data, **cluster))
+
+def get_heatmap_data(upload, filters, top_n_species, cluster=None):
+    """Top species x samples; `top_n_species=None` keeps every species."""
+    return heatmap_from_matrix(get_species_matrix(upload, filters), upload_version(upload),
+                               filters, top_n_species, cluster)
+
+def heatmap_from_matrix(species_matrix, version, filters, top_n_species, cluster=None):
+    top_n_species = len(species_matrix) if top_n_species is None else top_n_species
+    heatmap_data = top_species_heatmap(species_matrix, top_n_species)
+    if cluster is None:
+        return heatmap_data
+    order = get_heatmap_order(version, filters, heatmap_data, top_n_species, cluster)
+    return heatmap_data.loc[order["species"], order["samples"]]
+
+# ---------------- Helper to pick reference + alignment preset from query args ----------------
+def alignment_options_from_request():
+    # ?reference=<id> (see /references) and ?preset=fast|sensitive|very-sensitive|default;
+    # otherwise the default reference and its configured preset
+    ref_id = request.args.get('reference') or None
+    try:
+        reference = get_reference(ref_id)
+    except KeyError:
+        return None, None, jsonify({"error": f"Unknown reference '{ref_id}'"}), 404
+    try:
+        preset = resolve_preset(request.args.get('preset') or None, reference.id)
+    except ValueError as e:
+        return None, None, jsonify({"error": str(e)}), 400
+    return reference, preset, None, None
+
+# ---------------- Helper to read antigen map window options from query args ----------------
+def window_options_from_request():
+    try:
+        win_size = int(request.args.get('win_size', 32))
+        step_size = int(request.args.get('step_size', 4))
+    except ValueError:
+        return None, None, jsonify({"error": "Invalid window or step size parameter"}), 400
+    if win_size < 1 or step_size < 1:
+        return None, None, jsonify({"error": "win_size and step_size must be positive"}), 400
+    return win_size, step_size, None, None
+
+# ---------------- Helper to send a matrix in the negotiated format ----------------
+def send_matrix(df, row_key, col_key):
+    try:
+        fmt = negotiate_matrix_format(request.args.get('format'), request.headers.get('Accept', ''))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data, mimetype = encode_matrix(df, row_key, col_key, fmt)
+    body, encoding = encode_for_request(data, request.headers.get('Accept-Encoding', ''))
+    response = current_app.response_class(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['X-Matrix-Format'] = fmt
+    return response
+
+# ---------------- Helper to render a graph at a cached tier ----------------
+def send_rendered_graph(version, source, graph, params, draw, download_stem):
+    """
+    Serve `graph` at ?tier=preview (default, low-DPI WebP for dashboards) or
+    ?tier=full (300-dpi PNG for export). Each tier is cached separately per
+    `version` (of an upload or a workspace's uploads); `draw` (data loading +
+    plotting) only runs on a miss. `source` names the file and log line.
+    """
+    tier = request.args.get('tier', DEFAULT_TIER)
+    if tier not in RENDER_TIERS:
+        return jsonify({"error": f"Unknown tier '{tier}'"}), 400
+
+    folder = get_cache_folder(current_app, "renders")
+    key = cache_key(version, graph, params, tier)
+
+    def lookup():
+        img_bytes, stats = cache_get_bytes(folder, key)
+        return (img_bytes, stats) if img_bytes is not None and stats is not None else None
+
+    def render():
+        img_bytes, stats = render_tier(draw(), tier)
+        cache_put_bytes(folder, key, img_bytes, meta=stats)
+        return img_bytes, stats
+
+    (img_bytes, stats), cache_status = single_flight(folder, key, lookup, render)
+    logger.info("render %s source=%s tier=%s cache=%s render_ms=%s bytes=%s",
+                graph, source, tier, cache_status, stats["render_ms"], stats["bytes"])
+
+    response = send_file(io.BytesIO(img_bytes), mimetype=stats["mimetype"], as_attachment=False,
+                         download_name=f"{download_stem}_{source}.{stats['format']}")
+    response.headers["X-Render-Tier"] = tier
+    response.headers["X-Render-Time-Ms"] = str(stats["render_ms"])
+    response.headers["X-Render-Bytes"] = str(stats["bytes"])
+    response.headers["X-Render-Cache"] = cache_status
+    return response
+
 # ---------------- PNG Routes ----------------
 @visualisation_bp.route('/species_counts/png/<int:upload_id>', methods=['GET'])
 @jwt_required
 def species_counts_heatmap(upload_id):
     user_id = g.current_user_id
     top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
 
     with Session() as session:
         upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
         if err_resp:
             return err_resp, status
 
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
-    df = compute_rpk(df)
+    filters = row_filters_from_request()
 
-    grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-    heatmap_data = grouped.pivot(index='taxon_species', columns='sample_id', values='rpk').fillna(0)
-    top_species = heatmap_data.sum(axis=1).nlargest(top_n_species).index
-    heatmap_data = heatmap_data.loc[top_species]
-    heatmap_data = heatmap_data[sorted(heatmap_data.columns)]
+    def draw():
+        heatmap_data = get_heatmap_data(upload, filters, top_n_species, cluster)
+        return draw_rpk_heatmap(heatmap_data, top_n_species=top_n_species)
 
-    img_bytes = plot_rpk_heatmap(heatmap_data, top_n_species=top_n_species, output_path=None)
-    return send_file(io.BytesIO(img_bytes), mimetype="image/png", as_attachment=False,
-                     download_name=f"species_counts_{upload_id}.png")
+    return send_rendered_graph(upload_version(upload), upload.upload_id, "heatmap",
+                               {"top_n_species": top_n_species, "filters": filters, "cluster": cluster},
+                               draw, "species_counts")
 
 @visualisation_bp.route('/species_reactivity_stacked_barplot/png/<int:upload_id>', methods=['GET'])
 @jwt_required
@@ -67,48 +401,43 @@ def species_stacked_barplot(upload_id):
         if err_resp:
             return err_resp, status
 
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
-    df = compute_rpk(df)
+    filters = row_filters_from_request()
 
-    grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-    pivot_df = grouped.pivot(index='sample_id', columns='taxon_species', values='rpk').fillna(0)
-    top_species = pivot_df.sum(axis=0).nlargest(top_n_species).index
-    pivot_df = pivot_df[top_species]
-    pivot_df = pivot_df.sort_index(axis=1)
+    def draw():
+        species_matrix = get_species_matrix(upload, filters)
+        pivot_df = top_species_barplot(species_matrix, top_n_species)
+        return draw_rpk_stacked_barplot(pivot_df, top_n_species=top_n_species)
 
-    img_bytes = plot_rpk_stacked_barplot(pivot_df, top_n_species=top_n_species, output_path=None)
-    return send_file(io.BytesIO(img_bytes), mimetype="image/png", as_attachment=False,
-                     download_name=f"species_reactivity_{upload_id}.png")
+    return send_rendered_graph(upload_version(upload), upload.upload_id, "barplot",
+                               {"top_n_species": top_n_species, "filters": filters},
+                               draw, "species_reactivity")
 
 @visualisation_bp.route('/antigen_map/png/<int:upload_id>', methods=['GET'])
 @jwt_required
 def antigen_map_png(upload_id):
     user_id = g.current_user_id
-    win_size = int(request.args.get('win_size', 32))
-    step_size = int(request.args.get('step_size', 4))
+    win_size, step_size, err_resp, status = window_options_from_request()
+    if err_resp:
+        return err_resp, status
     with Session() as session:
         upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
         if err_resp:
             return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
 
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
-    diamond_db_path = os.path.join(current_app.root_path, "data", "blast_databases", "coxsackievirusB1_P08291_db.dmnd")
-
-    # ---------------- Updated: pass cache folder ----------------
-    cache_folder = current_app.config.get("CACHE_FOLDER")
-    if cache_folder:
-        os.makedirs(cache_folder, exist_ok=True)
-
-    moving_sum_df, ev_df, _ = prepare_antigen_map_df(
-        upload_id,
-        df,
-        diamond_db_path=diamond_db_path,
-        win_size=win_size,
-        step_size=step_size,
-        cache_folder=cache_folder
-    )
+    filters = row_filters_from_request()
+
+    def draw():
+        moving_sum_df, ev_df = compute_antigen_map(upload, filters, win_size, step_size, reference, preset)
+        return draw_antigen_map(moving_sum_df, ev_df=ev_df)
 
-    return plot_antigen_map(moving_sum_df, ev_df=ev_df)
+    return send_rendered_graph(upload_version(upload), upload.upload_id, "antigen_map",
+                               {"win_size": win_size, "step_size": step_size, "filters": filters,
+                                "reference": reference.id, "db_version": reference.db_version,
+                                "preset": preset},
+                               draw, "antigen_map")
 
 # ---------------- JSON Routes ----------------
 @visualisation_bp.route('/species_counts/json/<int:upload_id>', methods=['GET'])
@@ -116,22 +445,15 @@ def antigen_map_png(upload_id):
 def species_counts_json(upload_id):
     user_id = g.current_user_id
     top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
     with Session() as session:
         upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
         if err_resp:
             return err_resp, status
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
-    df = compute_rpk(df)
-    grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-    heatmap_data = grouped.pivot(index='taxon_species', columns='sample_id', values='rpk').fillna(0)
-    top_species = heatmap_data.sum(axis=1).nlargest(top_n_species).index
-    heatmap_data = heatmap_data.loc[top_species]
-    heatmap_data = heatmap_data[sorted(heatmap_data.columns)]
-    return jsonify({
-        "species": list(heatmap_data.index),
-        "samples": list(heatmap_data.columns),
-        "values": heatmap_data.values.tolist()
-    })
+    heatmap_data = get_heatmap_data(upload, row_filters_from_request(), top_n_species, cluster)
+    return send_matrix(heatmap_data, "species", "samples")
 
 @visualisation_bp.route('/species_reactivity_stacked_barplot/json/<int:upload_id>', methods=['GET'])
 @jwt_required
@@ -142,17 +464,9 @@ def species_stacked_barplot_json(upload_id):
         upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
         if err_resp:
             return err_resp, status
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
-    df = compute_rpk(df)
-    grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-    pivot_df = grouped.pivot(index='sample_id', columns='taxon_species', values='rpk').fillna(0)
-    top_species = pivot_df.sum(axis=0).nlargest(top_n_species).index
-    pivot_df = pivot_df[top_species]
-    return jsonify({
-        "samples": list(pivot_df.index),
-        "species": list(pivot_df.columns),
-        "values": pivot_df.values.tolist()
-    })
+    species_matrix = get_species_matrix(upload, row_filters_from_request())
+    pivot_df = top_species_barplot(species_matrix, top_n_species, sort_species=False)
+    return send_matrix(pivot_df, "samples", "species")
 
 @visualisation_bp.route('/antigen_map/json/<int:upload_id>', methods=['GET'])
 @jwt_required
@@ -174,30 +488,19 @@ def antigen_map_json(upload_id):
                 "moving_sum": [], "window_start": [], "window_end": [], "ev_domains": [],
                 "error": "Upload not found" if status == 404 else "Forbidden"
             }), status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
 
-    df = pd.read_csv(load_upload_file(upload_id, current_app), sep=None, engine="python")
     try:
-        diamond_db_path = os.path.join(current_app.root_path, "data", "blast_databases", "coxsackievirusB1_P08291_db.dmnd")
-
-        # ---------------- Updated: pass cache folder ----------------
-        cache_folder = current_app.config.get("CACHE_FOLDER")
-        if cache_folder:
-            os.makedirs(cache_folder, exist_ok=True)
-
-        moving_sum_df, ev_df, _ = prepare_antigen_map_df(
-            upload_id,
-            df,
-            diamond_db_path=diamond_db_path,
-            win_size=win_size,
-            step_size=step_size,
-            cache_folder=cache_folder
-        )
+        moving_sum_df, ev_df = compute_antigen_map(upload, row_filters_from_request(), win_size, step_size, reference, preset)
 
         json_data = {
             "moving_sum": moving_sum_df['moving_sum'].tolist() if not moving_sum_df.empty else [],
             "window_start": moving_sum_df['window_start'].tolist() if not moving_sum_df.empty else [],
             "window_end": moving_sum_df['window_end'].tolist() if not moving_sum_df.empty else [],
-            "ev_domains": ev_df[['start', 'end', 'ev_proteins']].to_dict(orient='records') if not ev_df.empty else []
+            "ev_domains": ev_df[['start', 'end', 'ev_proteins']].to_dict(orient='records') if not ev_df.empty else [],
+            "ev_protein_colours": ev_domain_track(ev_df)[1]
         }
         return jsonify(json_data)
     except Exception as e:
@@ -206,6 +509,684 @@ def antigen_map_json(upload_id):
             "error": f"Antigen map generation failed: {str(e)}"
         }), 500
 
+@visualisation_bp.route('/antigen_map/profile/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_profile_json(upload_id):
+    # Per-residue coverage-weighted RPK difference, for client-side windowing
+    user_id = g.current_user_id
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+    try:
+        profile, ev_df = get_antigen_profile(upload, row_filters_from_request(), reference, preset)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+    residues = residue_profile(profile)
+    return jsonify({
+        "position": residues['position'].tolist(),
+        "rpk_difference": residues['rpk_difference'].tolist(),
+        "coverage": residues['coverage'].tolist(),
+        "precomputed_win_sizes": list(COMMON_WIN_SIZES),
+        "ev_domains": ev_df[['start', 'end', 'ev_proteins']].to_dict(orient='records') if not ev_df.empty else []
+    })
+
+MAX_HIT_RANGE = 100_000  # residues; longer than any reference proteome
+
+@visualisation_bp.route('/antigen_map/hits/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_hits_json(upload_id):
+    # Peptides at a residue (?position=) or range (?start=&end=), e.g. for hover tooltips;
+    # ?mode=cover keeps only hits spanning the whole range
+    user_id = g.current_user_id
+    try:
+        if 'position' in request.args:
+            start = end = int(request.args['position'])
+        else:
+            start, end = int(request.args['start']), int(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Provide an integer position, or start and end"}), 400
+    if start > end:
+        return jsonify({"error": "start must not be greater than end"}), 400
+    if end - start + 1 > MAX_HIT_RANGE:
+        return jsonify({"error": f"Ranges are limited to {MAX_HIT_RANGE} residues"}), 400
+    mode = request.args.get('mode', 'overlap')
+    if mode not in ('overlap', 'cover'):
+        return jsonify({"error": f"Unknown mode '{mode}'"}), 400
+
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+    try:
+        index = get_antigen_alignment(upload, row_filters_from_request(), reference, preset)["index"]
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+
+    hits = index.query(start, end, mode=mode)
+    hits['value'] = hits['value'].astype(object).where(hits['value'].notna(), None)
+    # Depth only exists over the aligned span; depth_start is its first residue in the range
+    coverage = index.coverage(start, end)
+    return jsonify({
+        "start": start,
+        "end": end,
+        "mode": mode,
+        "count": len(hits),
+        "depth_start": int(coverage['position'].iloc[0]) if not coverage.empty else None,
+        "depth": coverage['depth'].tolist(),
+        "hits": hits.rename(columns={'value': 'mean_rpk_difference'}).to_dict(orient='records')
+    })
+
+MAX_PERMUTATIONS = 100_000
+
+@visualisation_bp.route('/antigen_map/significance/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_significance_json(upload_id):
+    # Per-window empirical p-values (Condition labels shuffled across samples) and BH FDR
+    user_id = g.current_user_id
+    try:
+        win_size = int(request.args.get('win_size', 32))
+        step_size = int(request.args.get('step_size', 4))
+        n_permutations = int(request.args.get('n_permutations', 1000))
+        seed = int(request.args.get('seed', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid window, step, permutation or seed parameter"}), 400
+    alternative = request.args.get('alternative', 'two-sided')
+    if alternative not in ALTERNATIVES:
+        return jsonify({"error": f"alternative must be one of {', '.join(ALTERNATIVES)}"}), 400
+    if not 1 <= n_permutations <= MAX_PERMUTATIONS:
+        return jsonify({"error": f"n_permutations must be between 1 and {MAX_PERMUTATIONS}"}), 400
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+
+    filters = row_filters_from_request()
+    try:
+        alignment = get_antigen_alignment(upload, filters, reference, preset)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+
+    def run_permutations():
+        moving_sum_df = moving_sum_from_profile(alignment["profile"], win_size, step_size)
+        matrix = get_peptide_matrix(upload, filters)
+        return window_significance(moving_sum_df, alignment["hits"], matrix, win_size,
+                                   n_permutations=n_permutations, seed=seed, alternative=alternative)
+
+    folder = get_cache_folder(current_app, "antigen_map")
+    key = cache_key(upload_version(upload), filters, reference.id, reference.db_version, preset,
+                    get_kmer_index(reference) is not None,
+                    win_size, step_size, n_permutations, seed, alternative, "significance")
+    try:
+        result = cached_pickle(folder, key, run_permutations)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "window_start": result['window_start'].tolist(),
+        "window_end": result['window_end'].tolist(),
+        "moving_sum": result['moving_sum'].tolist(),
+        "statistic": result['statistic'].tolist(),
+        "p_value": result['p_value'].tolist(),
+        "q_value": result['q_value'].tolist(),
+        "n_permutations": n_permutations,
+        "seed": seed,
+        "alternative": alternative
+    })
+
+@visualisation_bp.route('/antigen_map/domains/summary/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_domain_summary_json(upload_id):
+    user_id = g.current_user_id
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+    try:
+        alignment = get_antigen_alignment(upload, row_filters_from_request(), reference, preset)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+    summary = alignment["index"].domain_summary(alignment["ev_df"])
+    return jsonify({"domains": summary.to_dict(orient='records')})
+
+@visualisation_bp.route('/antigen_map/domains/rollup/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_domain_rollup_json(upload_id):
+    # Per-domain Case/Control means and difference, plus per-sample domain means
+    user_id = g.current_user_id
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+
+    filters = row_filters_from_request()
+    folder = get_cache_folder(current_app, "antigen_map")
+    key = cache_key(upload_version(upload), filters, reference.id, reference.db_version, preset,
+                    get_kmer_index(reference) is not None, "domain_rollup")
+
+    def rollup_domains():
+        alignment = get_antigen_alignment(upload, filters, reference, preset)
+        assignments = assign_domains(alignment["hits"], alignment["ev_df"])
+        return {
+            "domains": domain_condition_rollup(assignments, alignment["hits"]),
+            "samples": domain_sample_rollup(assignments, get_peptide_matrix(upload, filters)),
+        }
+
+    try:
+        rollup = cached_pickle(folder, key, rollup_domains)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+
+    domains = rollup["domains"].astype(object).where(rollup["domains"].notna(), None)
+    samples = rollup["samples"].astype(object).where(rollup["samples"].notna(), None)
+    return jsonify({
+        "domains": domains.to_dict(orient='records'),
+        "samples": samples.to_dict(orient='records')
+    })
+
+@visualisation_bp.route('/peptides/top/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def top_peptides_json(upload_id):
+    user_id = g.current_user_id
+    top_n = int(request.args.get('top_n', 20))
+    ascending = request.args.get('order', 'desc') == 'asc'
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+
+    try:
+        matrix = get_peptide_matrix(upload, row_filters_from_request())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    top = matrix.top_peptides(top_n, ascending=ascending)
+    values = matrix.sample_values(top['pep_id'])
+    return jsonify({
+        "peptides": [str(p) for p in top['pep_id']],
+        "mean_rpk_case": top['mean_rpk_case'].tolist(),
+        "mean_rpk_control": top['mean_rpk_control'].tolist(),
+        "mean_rpk_difference": top['mean_rpk_difference'].tolist(),
+        "samples": [str(s) for s in values.columns],
+        "values": values.values.tolist()
+    })
+
+MAX_PAGE_SIZE = 1000
+
+@visualisation_bp.route('/peptides/differential/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def differential_peptides_json(upload_id):
+    # Welch t, Mann-Whitney U, log2 fold change and BH q-values for every peptide,
+    # computed once per upload version and filters, then sorted and paged.
+    # ?metadata=&group_by=&case=&control= compares groups of a metadata column
+    # instead of the base file's Condition
+    user_id = g.current_user_id
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 100))
+    except ValueError:
+        return jsonify({"error": "Invalid page or page_size parameter"}), 400
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"page must be >= 1 and page_size between 1 and {MAX_PAGE_SIZE}"}), 400
+    sort = request.args.get('sort', 'welch_p')
+    ascending = request.args.get('order', 'asc') == 'asc'
+    case = request.args.get('case', 'Case')
+    control = request.args.get('control', 'Control')
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+        metadata_upload, group_by, err_resp, status = sample_groups_from_request(session, user_id)
+        if err_resp:
+            return err_resp, status
+
+    filters = row_filters_from_request()
+    folder = get_cache_folder(current_app, "differential")
+    metadata_version = upload_version(metadata_upload) if metadata_upload else None
+    key = cache_key(upload_version(upload), filters, metadata_version, group_by, case, control, "differential_stats")
+
+    def compute_stats():
+        if metadata_upload is None:
+            return differential_stats(get_peptide_matrix(upload, filters), case, control)
+        matrix = with_sample_groups(get_peptide_matrix(upload, filters), get_sample_metadata(metadata_upload), group_by)
+        return differential_stats(matrix, case, control)
+
+    try:
+        stats = cached_pickle(folder, key, compute_stats)
+        rows, total = sort_and_page(stats, sort, ascending, page, page_size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Infinite t (both groups constant, different means) is not valid JSON
+    rows = rows.replace([np.inf, -np.inf], np.nan)
+    rows = rows.astype(object).where(rows.notna(), None)
+    return jsonify({
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "sort": sort,
+        "order": "asc" if ascending else "desc",
+        "case": case,
+        "control": control,
+        "group_by": group_by,
+        "columns": list(stats.columns),
+        "rows": rows.to_dict(orient='records')
+    })
+
+# ---------------- Chart Spec Routes ----------------
+# Render-ready Vega-Lite specs: interactive views need no server-side raster
+@visualisation_bp.route('/species_counts/spec/<int:upload_id>', methods=['GET'])
+@jwt_required
+def species_counts_spec(upload_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    return jsonify(heatmap_spec(get_heatmap_data(upload, row_filters_from_request(), top_n_species, cluster)))
+
+@visualisation_bp.route('/species_counts/clustering/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def species_counts_clustering_json(upload_id):
+    # Leaf orders and SciPy linkage matrices, for drawing dendrograms next to a clustered heatmap
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    if cluster is None:
+        return jsonify({"error": "cluster must be one of samples, species, both"}), 400
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    filters = row_filters_from_request()
+    heatmap_data = get_heatmap_data(upload, filters, top_n_species)
+    order = get_heatmap_order(upload_version(upload), filters, heatmap_data, top_n_species, cluster)
+    return jsonify({
+        "species": [str(s) for s in order["species"]],
+        "samples": [str(s) for s in order["samples"]],
+        "species_linkage": order["species_linkage"].tolist() if order["species_linkage"] is not None else None,
+        "sample_linkage": order["sample_linkage"].tolist() if order["sample_linkage"] is not None else None,
+        **cluster
+    })
+
+@visualisation_bp.route('/species_reactivity_stacked_barplot/spec/<int:upload_id>', methods=['GET'])
+@jwt_required
+def species_stacked_barplot_spec(upload_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 10))
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    species_matrix = get_species_matrix(upload, row_filters_from_request())
+    return jsonify(stacked_barplot_spec(top_species_barplot(species_matrix, top_n_species)))
+
+@visualisation_bp.route('/antigen_map/spec/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_spec_route(upload_id):
+    user_id = g.current_user_id
+    try:
+        win_size = int(request.args.get('win_size', 32))
+        step_size = int(request.args.get('step_size', 4))
+    except ValueError:
+        return jsonify({"error": "Invalid window or step size parameter"}), 400
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+    try:
+        moving_sum_df, ev_df = compute_antigen_map(upload, row_filters_from_request(), win_size, step_size, reference, preset)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+    return jsonify(antigen_map_spec(moving_sum_df, ev_df))
+
+# ---------------- Multi-species Antigen Map Routes ----------------
+# One job aligns every species that has a reference; the gallery gets all
+# tracks in one response instead of a round trip per species.
+@visualisation_bp.route('/antigen_map/species/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def antigen_map_gallery_json(upload_id):
+    user_id = g.current_user_id
+    try:
+        win_size = int(request.args.get('win_size', 32))
+        step_size = int(request.args.get('step_size', 4))
+    except ValueError:
+        return jsonify({"error": "Invalid window or step size parameter"}), 400
+    if win_size < 1 or step_size < 1:
+        return jsonify({"error": "win_size and step_size must be positive"}), 400
+    preset = request.args.get('preset') or None
+    if preset is not None and preset not in ALIGNMENT_PRESETS:
+        return jsonify({"error": f"Unknown alignment preset '{preset}'"}), 400
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+
+    try:
+        alignments = get_species_alignments(upload, row_filters_from_request(), preset)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+
+    results = alignments["results"]
+    tracks = species_tracks(results, win_size, step_size)
+    registry = get_reference_registry()
+    maps = []
+    for ref_id in sorted(results, key=lambda r: (-results[r]["n_hits"], r)):
+        result, track = results[ref_id], tracks[ref_id]
+        ev_df = registry.get(ref_id).ev_df
+        maps.append({
+            "reference": ref_id,
+            "species": result["species"],
+            "preset": result["preset"],
+            "n_peptides": result["n_peptides"],
+            "n_hits": result["n_hits"],
+            "moving_sum": track['moving_sum'].tolist(),
+            "window_start": track['window_start'].tolist(),
+            "window_end": track['window_end'].tolist(),
+            "ev_domains": ev_df[['start', 'end', 'ev_proteins']].to_dict(orient='records') if not ev_df.empty else [],
+            "ev_protein_colours": ev_domain_track(ev_df)[1]
+        })
+    return jsonify({
+        "win_size": win_size,
+        "step_size": step_size,
+        "maps": maps,
+        "unmatched": [{"taxon_species": s, "n_peptides": n}
+                      for s, n in sorted(alignments["unmatched"].items(), key=lambda item: -item[1])],
+        "failed": [{"reference": ref_id, "error": error}
+                   for ref_id, error in sorted(alignments.get("failed", {}).items())]
+    })
+
+# ---------------- Heatmap Tile Routes ----------------
+# Pan/zoom for cohorts with thousands of samples: /meta describes the pyramid,
+# tiles are fetched by (zoom, x, y) as PNG or in any matrix format.
+def get_heatmap_pyramid(upload, filters, cluster=None):
+    folder = get_cache_folder(current_app, "tiles")
+    version_key = cache_key(upload_version(upload), filters, cluster)
+
+    def build():
+        return store_pyramid(folder, version_key, get_heatmap_data(upload, filters, None, cluster))
+
+    meta, _ = single_flight(folder, version_key, lambda: load_pyramid_meta(folder, version_key), build)
+    return folder, version_key, meta
+
+@visualisation_bp.route('/species_counts/tiles/<int:upload_id>/meta', methods=['GET'])
+@jwt_required
+def species_counts_tiles_meta(upload_id):
+    user_id = g.current_user_id
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    _, _, meta = get_heatmap_pyramid(upload, row_filters_from_request(), cluster)
+    return jsonify(meta)
+
+@visualisation_bp.route('/species_counts/tiles/<int:upload_id>/<int:zoom>/<int:x>/<int:y>', methods=['GET'])
+@jwt_required
+def species_counts_tile(upload_id, zoom, x, y):
+    user_id = g.current_user_id
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+
+    filters = row_filters_from_request()
+    folder, version_key, meta = get_heatmap_pyramid(upload, filters, cluster)
+    try:
+        row0, row1, col0, col1 = tile_bounds(meta, zoom, x, y)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    level = load_level(folder, version_key, zoom)
+    if level is None:
+        # The level was evicted but its meta survived: rebuild the pyramid once
+        drop_pyramid_meta(folder, version_key)
+        folder, version_key, meta = get_heatmap_pyramid(upload, filters, cluster)
+        level = load_level(folder, version_key, zoom)
+        if level is None:
+            return jsonify({"error": "Heatmap tiles are unavailable, try again"}), 503
+    values = level[row0:row1, col0:col1]
+
+    if request.args.get('format', 'png') != 'png':
+        step = meta["levels"][zoom]["cells_per_tile_cell"]
+        tile_df = pd.DataFrame(np.asarray(values),
+                               index=tile_labels(meta["species"], row0, row1, step),
+                               columns=tile_labels(meta["samples"], col0, col1, step))
+        return send_matrix(tile_df, "species", "samples")
+
+    key = cache_key(version_key, "heatmap_tile", zoom, x, y)
+
+    def render():
+        png_bytes = render_tile_png(values, meta)
+        cache_put_bytes(folder, key, png_bytes)
+        return png_bytes
+
+    png_bytes, cache_status = single_flight(folder, key, lambda: cache_get_bytes(folder, key)[0], render)
+    response = send_file(io.BytesIO(png_bytes), mimetype="image/png", as_attachment=False,
+                         download_name=f"species_counts_{upload_id}_{zoom}_{x}_{y}.png")
+    response.headers["X-Render-Cache"] = cache_status
+    return response
+
+# ---------------- Sample Metadata Routes ----------------
+# Metadata uploads (one row per sample_id) are joined to a base upload's
+# cached aggregates at query time, so any metadata column can group samples.
+@visualisation_bp.route('/metadata/columns/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def metadata_columns_json(upload_id):
+    user_id = g.current_user_id
+    with Session() as session:
+        metadata_upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+    if metadata_upload.file_type != 'metadata':
+        return jsonify({"error": f"Upload {upload_id} is not a metadata file"}), 400
+    try:
+        metadata = get_sample_metadata(metadata_upload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"n_samples": len(metadata.table), "columns": metadata.describe()})
+
+@visualisation_bp.route('/species_counts/grouped/json/<int:upload_id>', methods=['GET'])
+@jwt_required
+def species_counts_grouped_json(upload_id):
+    # Top species x metadata groups (?metadata=<id>&group_by=<column>), mean over each group's samples
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 20))
+    with Session() as session:
+        upload, err_resp, status = get_upload_or_forbidden(session, upload_id, user_id)
+        if err_resp:
+            return err_resp, status
+        metadata_upload, group_by, err_resp, status = sample_groups_from_request(session, user_id)
+        if err_resp:
+            return err_resp, status
+    if metadata_upload is None:
+        return jsonify({"error": "metadata is required"}), 400
+
+    try:
+        grouped = group_species_matrix(get_species_matrix(upload, row_filters_from_request()),
+                                       get_sample_metadata(metadata_upload), group_by)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return send_matrix(top_species_heatmap(grouped, top_n_species), "species", group_by)
+
+# ---------------- Workspace Routes ----------------
+# Every base upload of a workspace as one cohort. Uploads are loaded
+# concurrently and reduced to per-upload aggregates before merging; the merge
+# is cached per set of upload versions. Sample columns are "<upload_id>:<sample_id>".
+@visualisation_bp.route('/workspace/<int:workspace_id>/species_counts/json', methods=['GET'])
+@jwt_required
+def workspace_species_counts_json(workspace_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+    filters = row_filters_from_request()
+    species_matrix = get_workspace_aggregates(uploads, filters)["species_matrix"]
+    heatmap_data = heatmap_from_matrix(species_matrix, workspace_version(uploads), filters, top_n_species, cluster)
+    return send_matrix(heatmap_data, "species", "samples")
+
+@visualisation_bp.route('/workspace/<int:workspace_id>/species_counts/png', methods=['GET'])
+@jwt_required
+def workspace_species_counts_heatmap(workspace_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 20))
+    cluster, err_resp, status = cluster_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+
+    filters = row_filters_from_request()
+    version = workspace_version(uploads)
+
+    def draw():
+        species_matrix = get_workspace_aggregates(uploads, filters)["species_matrix"]
+        heatmap_data = heatmap_from_matrix(species_matrix, version, filters, top_n_species, cluster)
+        return draw_rpk_heatmap(heatmap_data, top_n_species=top_n_species)
+
+    return send_rendered_graph(version, f"workspace_{workspace_id}", "heatmap",
+                               {"top_n_species": top_n_species, "filters": filters, "cluster": cluster},
+                               draw, "species_counts")
+
+@visualisation_bp.route('/workspace/<int:workspace_id>/species_reactivity_stacked_barplot/json', methods=['GET'])
+@jwt_required
+def workspace_species_stacked_barplot_json(workspace_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 10))
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+    species_matrix = get_workspace_aggregates(uploads, row_filters_from_request())["species_matrix"]
+    pivot_df = top_species_barplot(species_matrix, top_n_species, sort_species=False)
+    return send_matrix(pivot_df, "samples", "species")
+
+@visualisation_bp.route('/workspace/<int:workspace_id>/species_reactivity_stacked_barplot/png', methods=['GET'])
+@jwt_required
+def workspace_species_stacked_barplot(workspace_id):
+    user_id = g.current_user_id
+    top_n_species = int(request.args.get('top_n_species', 10))
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+
+    filters = row_filters_from_request()
+
+    def draw():
+        species_matrix = get_workspace_aggregates(uploads, filters)["species_matrix"]
+        pivot_df = top_species_barplot(species_matrix, top_n_species)
+        return draw_rpk_stacked_barplot(pivot_df, top_n_species=top_n_species)
+
+    return send_rendered_graph(workspace_version(uploads), f"workspace_{workspace_id}", "barplot",
+                               {"top_n_species": top_n_species, "filters": filters},
+                               draw, "species_reactivity")
+
+@visualisation_bp.route('/workspace/<int:workspace_id>/antigen_map/json', methods=['GET'])
+@jwt_required
+def workspace_antigen_map_json(workspace_id):
+    user_id = g.current_user_id
+    win_size, step_size, err_resp, status = window_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+
+    try:
+        profile, ev_df = get_workspace_antigen_profile(uploads, row_filters_from_request(), reference, preset)
+        moving_sum_df = moving_sum_from_profile(profile, win_size, step_size)
+    except Exception as e:
+        return jsonify({"error": f"Antigen map generation failed: {str(e)}"}), 500
+
+    return jsonify({
+        "upload_ids": [upload.upload_id for upload in uploads],
+        "moving_sum": moving_sum_df['moving_sum'].tolist() if not moving_sum_df.empty else [],
+        "window_start": moving_sum_df['window_start'].tolist() if not moving_sum_df.empty else [],
+        "window_end": moving_sum_df['window_end'].tolist() if not moving_sum_df.empty else [],
+        "ev_domains": ev_df[['start', 'end', 'ev_proteins']].to_dict(orient='records') if not ev_df.empty else [],
+        "ev_protein_colours": ev_domain_track(ev_df)[1]
+    })
+
+@visualisation_bp.route('/workspace/<int:workspace_id>/antigen_map/png', methods=['GET'])
+@jwt_required
+def workspace_antigen_map_png(workspace_id):
+    user_id = g.current_user_id
+    win_size, step_size, err_resp, status = window_options_from_request()
+    if err_resp:
+        return err_resp, status
+    with Session() as session:
+        uploads, err_resp, status = get_workspace_uploads_or_forbidden(session, workspace_id, user_id)
+        if err_resp:
+            return err_resp, status
+    reference, preset, err_resp, status = alignment_options_from_request()
+    if err_resp:
+        return err_resp, status
+
+    filters = row_filters_from_request()
+
+    def draw():
+        profile, ev_df = get_workspace_antigen_profile(uploads, filters, reference, preset)
+        return draw_antigen_map(moving_sum_from_profile(profile, win_size, step_size), ev_df=ev_df)
+
+    return send_rendered_graph(workspace_version(uploads), f"workspace_{workspace_id}", "antigen_map",
+                               {"win_size": win_size, "step_size": step_size, "filters": filters,
+                                "reference": reference.id, "db_version": reference.db_version,
+                                "preset": preset},
+                               draw, "antigen_map")
+
+# ---------------- Reference Routes ----------------
+@visualisation_bp.route('/references', methods=['GET'])
+@jwt_required
+def list_references():
+    registry = get_reference_registry()
+    return jsonify({
+        "default": registry.default_id,
+        "references": [
+            dict(registry.get(ref_id).describe(), alignment_preset=resolve_preset(None, ref_id))
+            for ref_id in registry.ids()
+        ],
+        "alignment_presets": list(ALIGNMENT_PRESETS)
+    })
+
 # ---------------- Graph Text Routes ----------------
 @visualisation_bp.route("/upload/<int:upload_id>/graph_text/<graph_type>", methods=['GET'])
 @jwt_required
@@ -250,8 +1231,32 @@ def generate_pdf_route(upload_id):
         if upload.user_id != user_id:
             return {"error": "Forbidden"}, 403
 
+    # Unknown references / presets are client errors, not failed renders
+    for graph in payload.get("graphs", []):
+        if graph.get("type", "").lower() != "antigen_map":
+            continue
+        ref_id = graph.get("reference")
+        try:
+            reference = get_reference(ref_id)
+        except KeyError:
+            return {"error": f"Unknown reference '{ref_id}'"}, 400
+        try:
+            resolve_preset(graph.get("preset"), reference.id)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        try:
+            win_size, step_size = int(graph.get("win_size", 32)), int(graph.get("step_size", 4))
+        except (TypeError, ValueError):
+            return {"error": "Invalid window or step size parameter"}, 400
+        if win_size < 1 or step_size < 1:
+            return {"error": "win_size and step_size must be positive"}, 400
+
+    def antigen_map(filters, win_size, step_size, reference, preset):
+        # Same cached alignment and profile as the antigen map routes
+        return compute_antigen_map(upload, filters, win_size, step_size, reference, preset)
+
     try:
-        pdf_buf = generate_pdf(upload_id, payload, app=current_app, return_buffer=True)
+        pdf_buf = generate_pdf(upload_id, payload, app=current_app, return_buffer=True, antigen_map=antigen_map)
         return send_file(
             pdf_buf,
             mimetype="application/pdf",
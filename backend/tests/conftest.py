@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Tests import backend modules as the app does (utils.*, benchmarks.*)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.synthetic import make_long_table
+from utils.dataset import compact_long_df, compute_rpk
+from utils.peptide_matrix import PeptideSampleMatrix
+
+@pytest.fixture(scope="session")
+def long_df():
+    # Complete table: one row per (sample, peptide), as VirScan exports are
+    return compute_rpk(compact_long_df(make_long_table(n_samples=24, n_peptides=400, seed=1)))
+
+@pytest.fixture(scope="session")
+def matrix(long_df):
+    return PeptideSampleMatrix.from_long(long_df)
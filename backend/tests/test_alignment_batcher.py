@@ -0,0 +1,88 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from utils.alignment import SETTINGS as ALIGNMENT_SETTINGS
+from utils.alignment_batcher import AlignmentBatcher
+
+BLAST_COLUMNS = ['qseqid', 'sseqid', 'pident', 'sstart', 'send']
+
+class FakeDiamond:
+    """One hit per query, placed by sequence so equal sequences get equal hits."""
+
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, fasta_path, db_path, preset):
+        with open(fasta_path) as f:
+            lines = f.read().split()
+        queries = dict(zip((l[1:] for l in lines[::2]), lines[1::2]))
+        with self.lock:
+            self.calls.append(queries)
+        if self.fail == "runner":
+            raise RuntimeError("diamond exited with status 1")
+        if self.fail == "columns":
+            return pd.DataFrame({'query_id': list(queries)})  # no qseqid: demux fails
+        return pd.DataFrame({
+            'qseqid': list(queries),
+            'sseqid': 'ref',
+            'pident': 100.0,
+            'sstart': [len(seq) * 10 for seq in queries.values()],
+            'send': [len(seq) * 10 + len(seq) - 1 for seq in queries.values()],
+        })[BLAST_COLUMNS]
+
+def peptides(ids, seqs):
+    return pd.DataFrame({'pep_id': ids, 'pep_aa': seqs})
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setitem(ALIGNMENT_SETTINGS, "batch_window", 0.2)
+
+def test_concurrent_submissions_share_one_run(window):
+    runner = FakeDiamond()
+    batcher = AlignmentBatcher(runner)
+    first = batcher.submit(peptides(['a1', 'a2'], ['AAAA', 'CCCCCC']), 'db', 'default')
+    second = batcher.submit(peptides(['b1', 'b2', 'b2'], ['CCCCCC', 'GG', 'GG']), 'db', 'default')
+
+    hits_a, hits_b = first.result(timeout=10), second.result(timeout=10)
+    assert len(runner.calls) == 1
+    assert sorted(runner.calls[0].values()) == ['AAAA', 'CCCCCC', 'GG']  # shared sequence queried once
+    assert dict(zip(hits_a['qseqid'], hits_a['sstart'])) == {'a1': 40, 'a2': 60}
+    assert dict(zip(hits_b['qseqid'], hits_b['sstart'])) == {'b1': 60, 'b2': 20}
+    assert list(hits_a.columns) == BLAST_COLUMNS
+
+def test_different_databases_run_separately(window):
+    runner = FakeDiamond()
+    batcher = AlignmentBatcher(runner)
+    first = batcher.submit(peptides(['a1'], ['AAAA']), 'db1', 'default')
+    second = batcher.submit(peptides(['b1'], ['AAAA']), 'db2', 'default')
+    first.result(timeout=10), second.result(timeout=10)
+    assert len(runner.calls) == 2
+
+def test_full_batch_runs_before_the_window(monkeypatch):
+    monkeypatch.setitem(ALIGNMENT_SETTINGS, "batch_window", 60)
+    batcher = AlignmentBatcher(FakeDiamond(), max_queries=3)
+    first = batcher.submit(peptides(['a1', 'a2'], ['AA', 'CC']), 'db', 'default')
+    second = batcher.submit(peptides(['b1'], ['GG']), 'db', 'default')
+    assert len(first.result(timeout=10)) == 2
+    assert len(second.result(timeout=10)) == 1
+
+def test_no_window_runs_each_submission_alone(monkeypatch):
+    monkeypatch.setitem(ALIGNMENT_SETTINGS, "batch_window", 0)
+    runner = FakeDiamond()
+    batcher = AlignmentBatcher(runner)
+    hits = batcher.align(peptides(['a1'], ['AAAA']), 'db', 'default')
+    batcher.align(peptides(['b1'], ['AAAA']), 'db', 'default')
+    assert list(hits['qseqid']) == ['a1']
+    assert len(runner.calls) == 2
+
+@pytest.mark.parametrize("fail, error", [("runner", RuntimeError), ("columns", KeyError)])
+def test_failures_reach_every_submitter(window, fail, error):
+    batcher = AlignmentBatcher(FakeDiamond(fail=fail))
+    futures = [batcher.submit(peptides([f"p{i}"], ['AAAA']), 'db', 'default') for i in range(3)]
+    for future in futures:
+        with pytest.raises(error):
+            future.result(timeout=10)
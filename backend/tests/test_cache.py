@@ -0,0 +1,90 @@
+import multiprocessing as mp
+import os
+import threading
+import time
+
+import pytest
+
+from utils.cache import (SETTINGS as CACHE_SETTINGS, cache_get_bytes, cache_get_pickle, cache_put_bytes,
+                         cache_put_pickle, cached_pickle, configure_cache, fcntl, prune_cache, single_flight)
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    folder = tmp_path / "ns"
+    folder.mkdir()
+    for i, key in enumerate(["old", "used", "new"]):
+        cache_put_bytes(str(folder), key, b"x" * 1000, meta={"i": i})
+        os.utime(folder / f"{key}.bin", (i, i))
+    cache_get_bytes(str(folder), "used")  # a hit makes it the most recent
+
+    prune_cache(str(tmp_path), max_bytes=2500)
+
+    assert cache_get_bytes(str(folder), "old") == (None, None)
+    assert not (folder / "old.json").exists()
+    assert cache_get_bytes(str(folder), "used")[0] is not None
+    assert cache_get_bytes(str(folder), "new")[0] is not None
+
+def test_puts_prune_once_the_cap_is_reached(tmp_path):
+    saved = dict(CACHE_SETTINGS)
+    configure_cache(str(tmp_path), max_mb=1)
+    try:
+        for i in range(40):
+            cache_put_bytes(str(tmp_path), f"k{i}", b"x" * 100_000)
+        total = sum(f.stat().st_size for f in tmp_path.iterdir())
+        assert total <= 1024 * 1024
+        assert cache_get_bytes(str(tmp_path), "k39")[0] is not None
+    finally:
+        CACHE_SETTINGS.update(saved)
+
+def test_single_flight_threads_share_one_computation(tmp_path):
+    folder, key = str(tmp_path), "k"
+    calls, statuses = [], []
+    barrier = threading.Barrier(6)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        cache_put_pickle(folder, key, "done")
+        return "done"
+
+    def run():
+        barrier.wait()
+        statuses.append(single_flight(folder, key, lambda: cache_get_pickle(folder, key), compute))
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert sorted(status for _, status in statuses) == ["miss"] + ["shared"] * 5
+    assert single_flight(folder, key, lambda: cache_get_pickle(folder, key), compute) == ("done", "hit")
+
+def slow_compute(folder, log_path):
+    def compute():
+        with open(log_path, "a") as f:
+            f.write("computed\n")
+        time.sleep(0.3)
+        return {"value": 42}
+    return cached_pickle(folder, "shared", compute)
+
+@pytest.mark.skipif(fcntl is None or "fork" not in mp.get_all_start_methods(), reason="needs fcntl and fork")
+def test_single_flight_across_processes(tmp_path):
+    log_path = str(tmp_path / "log.txt")
+    ctx = mp.get_context("fork")
+    workers = [ctx.Process(target=slow_compute, args=(str(tmp_path), log_path)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(timeout=30)
+        assert w.exitcode == 0
+    with open(log_path) as f:
+        assert f.read().count("computed") == 1
+    assert not list(tmp_path.glob("*.lock"))
+
+def test_failed_computation_is_not_cached(tmp_path):
+    def fail():
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        cached_pickle(str(tmp_path), "k", fail)
+    assert cached_pickle(str(tmp_path), "k", lambda: "ok") == "ok"
+    assert not list(tmp_path.glob("*.lock"))
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_long_table
+from utils.chunked import chunked_aggregates
+from utils.dataset import read_long_table, species_by_sample
+from utils.viruses.enterovirus import calculate_mean_rpk_difference
+
+FILTERS = [
+    None,
+    {'Condition': ['Case']},
+    {'taxon_species': ['Synthetic virus 1', 'Synthetic virus 2']},  # row filter: RPK keeps full-sample totals
+]
+
+@pytest.fixture(scope="module", params=[',', '\t'], ids=['csv', 'tsv'])
+def upload_path(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("upload") / "upload.txt"
+    make_long_table(n_samples=12, n_peptides=300, n_species=8, seed=2).to_csv(path, sep=request.param, index=False)
+    return str(path)
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_chunked_matches_in_memory(upload_path, filters):
+    df = read_long_table(upload_path, filters=filters, with_rpk=True)
+    chunked = chunked_aggregates(upload_path, filters, chunksize=500)
+
+    pd.testing.assert_frame_equal(chunked['species_by_sample'], species_by_sample(df), check_dtype=False)
+
+    expected = calculate_mean_rpk_difference(df).set_index('pep_id').sort_index()
+    actual = chunked['mean_diff'].set_index('pep_id').sort_index()
+    assert list(actual.index) == list(expected.index)
+    for col in ['mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference']:
+        np.testing.assert_allclose(actual[col].to_numpy(), expected[col].to_numpy())
+    assert set(chunked['peptides']['pep_id']) == set(df['pep_id'].astype(str))
+
+def test_row_filters_keep_unfiltered_totals(upload_path):
+    full = read_long_table(upload_path, with_rpk=True)
+    species = read_long_table(upload_path, filters={'taxon_species': ['Synthetic virus 1']}, with_rpk=True)
+    expected = full[full['taxon_species'] == 'Synthetic virus 1']['rpk'].to_numpy()
+    np.testing.assert_allclose(species['rpk'].to_numpy(), expected)
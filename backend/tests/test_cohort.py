@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_long_table
+from utils.chunked import empty_partial, sum_count_partial
+from utils.cohort import load_concurrently, merge_partials, namespace_samples
+from utils.dataset import compute_rpk, species_by_sample
+from utils.viruses.enterovirus import calculate_mean_rpk_difference
+
+def upload_table(seed, n_peptides):
+    # Same sample ids in every upload, as when two labs number samples alike
+    return compute_rpk(make_long_table(n_samples=6, n_peptides=n_peptides, n_species=5, seed=seed))
+
+def partials_of(df):
+    # As visualisation.load_upload_partials' in-memory path
+    return {
+        "species_sums": sum_count_partial(df, ['taxon_species', 'sample_id']),
+        "peptide_sums": sum_count_partial(df, ['pep_id', 'Condition']),
+        "peptides": df[['pep_id', 'pep_aa']].drop_duplicates(subset=['pep_id']),
+    }
+
+@pytest.fixture(scope="module")
+def uploads():
+    return {7: upload_table(1, 80), 9: upload_table(2, 120)}
+
+@pytest.fixture(scope="module")
+def merged(uploads):
+    return merge_partials({upload_id: partials_of(df) for upload_id, df in uploads.items()})
+
+def test_samples_are_kept_apart_per_upload(uploads, merged):
+    matrix = merged["species_matrix"]
+    assert len(matrix.columns) == sum(df['sample_id'].nunique() for df in uploads.values())
+    for upload_id, df in uploads.items():
+        own = species_by_sample(df)
+        cols = [f"{upload_id}:{s}" for s in own.columns]
+        np.testing.assert_allclose(matrix.loc[own.index, cols].to_numpy(), own.to_numpy())
+
+def test_mean_difference_pools_every_uploads_rows(uploads, merged):
+    expected = calculate_mean_rpk_difference(pd.concat(uploads.values(), ignore_index=True))
+    expected = expected.set_index('pep_id').sort_index()
+    actual = merged["mean_diff"].set_index('pep_id').sort_index()
+    assert list(actual.index) == list(expected.index)
+    np.testing.assert_allclose(actual['mean_rpk_difference'].to_numpy(),
+                               expected['mean_rpk_difference'].to_numpy())
+
+def test_peptides_are_the_union(uploads, merged):
+    expected = set().union(*(df['pep_id'] for df in uploads.values()))
+    assert set(merged["peptides"]['pep_id']) == expected
+    assert merged["peptides"]['pep_id'].is_unique
+
+def test_empty_uploads_are_skipped(uploads):
+    empty = {
+        "species_sums": empty_partial(['taxon_species', 'sample_id']),
+        "peptide_sums": empty_partial(['pep_id', 'Condition']),
+        "peptides": pd.DataFrame(columns=['pep_id', 'pep_aa']),
+    }
+    assert namespace_samples(empty["species_sums"], 3).empty
+    alone = merge_partials({7: partials_of(uploads[7])})
+    with_empty = merge_partials({7: partials_of(uploads[7]), 3: empty})
+    pd.testing.assert_frame_equal(with_empty["species_matrix"], alone["species_matrix"])
+
+def test_load_concurrently_keeps_order():
+    assert load_concurrently(lambda x: x * 2, range(10), max_workers=4) == [x * 2 for x in range(10)]
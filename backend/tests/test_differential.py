@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.stats import ttest_ind, mannwhitneyu
+
+from utils.differential import differential_stats, DIFFERENTIAL_COLUMNS
+
+def group_values(matrix, pep_id):
+    row = list(matrix.peptides).index(pep_id)
+    values = matrix.matrix[row].toarray().ravel()
+    conditions = list(matrix.conditions)
+    case = values[matrix.sample_conditions == conditions.index('Case')]
+    control = values[matrix.sample_conditions == conditions.index('Control')]
+    return case, control
+
+@pytest.fixture(scope="module")
+def stats(matrix):
+    return differential_stats(matrix)
+
+def test_columns_and_means_match_mean_difference(stats, matrix):
+    assert list(stats.columns) == DIFFERENTIAL_COLUMNS
+    expected = matrix.mean_difference().set_index('pep_id')
+    got = stats.set_index('pep_id').loc[expected.index]
+    np.testing.assert_allclose(got['mean_rpk_case'], expected['mean_rpk_case'])
+    np.testing.assert_allclose(got['mean_rpk_control'], expected['mean_rpk_control'])
+    np.testing.assert_allclose(got['mean_rpk_difference'], expected['mean_rpk_difference'])
+
+def test_welch_matches_scipy(stats, matrix):
+    for row in stats.itertuples():
+        case, control = group_values(matrix, row.pep_id)
+        expected = ttest_ind(case, control, equal_var=False)
+        if np.isfinite(expected.pvalue):
+            assert row.welch_t == pytest.approx(expected.statistic, rel=1e-7, abs=1e-9)
+            assert row.welch_p == pytest.approx(expected.pvalue, rel=1e-7, abs=1e-12)
+
+def test_mann_whitney_matches_scipy(stats, matrix):
+    for row in stats.itertuples():
+        case, control = group_values(matrix, row.pep_id)
+        if np.ptp(np.concatenate([case, control])) == 0:
+            assert row.mannwhitney_p == 1.0
+            continue
+        expected = mannwhitneyu(case, control, alternative='two-sided', method='asymptotic')
+        assert row.mannwhitney_u == pytest.approx(expected.statistic)
+        assert row.mannwhitney_p == pytest.approx(expected.pvalue, rel=1e-7, abs=1e-12)
+
+def test_blocked_ranking_matches_single_block(stats, matrix):
+    blocked = differential_stats(matrix, block_rows=7)
+    np.testing.assert_allclose(blocked['mannwhitney_p'], stats['mannwhitney_p'])
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.domain_rollup import assign_domains, domain_condition_rollup, domain_sample_rollup
+
+# Unsorted on purpose, with a gap (101-119) no domain covers
+EV_DF = pd.DataFrame({
+    'ev_proteins': ['VP2', 'VP4', 'VP3', '2A'],
+    'start': [40, 1, 120, 201],
+    'end': [100, 39, 200, 300],
+})
+
+@pytest.fixture(scope="module")
+def hits(matrix):
+    rng = np.random.default_rng(5)
+    starts = rng.integers(1, 320, len(matrix.peptides))
+    hits = pd.DataFrame({
+        'qseqid': np.asarray(matrix.peptides).astype(str),
+        'sstart': starts,
+        'send': starts + rng.integers(0, 90, len(starts)),
+    })
+    diff = matrix.mean_difference()
+    diff = diff.assign(qseqid=diff.pop('pep_id').astype(str))
+    return hits.merge(diff, on='qseqid')
+
+def brute_force_pairs(hits):
+    rows = []
+    for hit in hits.itertuples(index=False):
+        for dom in EV_DF.itertuples(index=False):
+            overlap = min(hit.send, dom.end) - max(hit.sstart, dom.start) + 1
+            if overlap > 0:
+                rows.append((hit.qseqid, dom.ev_proteins, overlap))
+    return sorted(rows)
+
+def test_assign_domains_matches_nested_loop(hits):
+    assignments = assign_domains(hits, EV_DF)
+    found = sorted(zip(assignments['pep_id'], assignments['ev_proteins'], assignments['overlap']))
+    assert found == brute_force_pairs(hits)
+
+def test_hits_in_gaps_or_outside_get_no_domain():
+    hits = pd.DataFrame({'qseqid': ['gap', 'after', 'span'], 'sstart': [105, 400, 90], 'send': [115, 410, 130]})
+    assignments = assign_domains(hits, EV_DF)
+    assert set(assignments['pep_id']) == {'span'}
+    assert list(assignments['ev_proteins']) == ['VP2', 'VP3']
+    assert list(assignments['overlap']) == [11, 11]
+
+def test_condition_rollup_means_assigned_peptides(hits):
+    assignments = assign_domains(hits, EV_DF)
+    rollup = domain_condition_rollup(assignments, hits).set_index('ev_proteins')
+    for domain, peptides in assignments.groupby('ev_proteins')['pep_id']:
+        values = hits[hits['qseqid'].isin(peptides)]
+        assert rollup.loc[domain, 'n_peptides'] == len(values)
+        assert rollup.loc[domain, 'mean_rpk_difference'] == pytest.approx(values['mean_rpk_difference'].mean())
+
+def test_sample_rollup_matches_dense_means(hits, matrix):
+    assignments = assign_domains(hits, EV_DF)
+    rollup = domain_sample_rollup(assignments, matrix)
+    dense = pd.DataFrame(matrix.matrix.toarray(), index=np.asarray(matrix.peptides).astype(str),
+                         columns=np.asarray(matrix.samples).astype(str))
+    for domain, peptides in assignments.groupby('ev_proteins')['pep_id']:
+        expected = dense.loc[peptides.unique()].mean(axis=0)
+        got = rollup[rollup['ev_proteins'] == domain].set_index('sample_id')['mean_rpk']
+        got.index = got.index.astype(str)
+        np.testing.assert_allclose(got.loc[expected.index].to_numpy(), expected.to_numpy())
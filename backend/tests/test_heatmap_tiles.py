@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.heatmap_tiles import (build_pyramid, load_level, load_pyramid_meta, drop_pyramid_meta,
+                                 store_pyramid, tile_bounds, _level_key)
+
+TILE = 4
+
+@pytest.fixture(scope="module")
+def species_matrix():
+    rng = np.random.default_rng(6)
+    values = rng.gamma(2.0, 3.0, size=(13, 19))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    return pd.DataFrame(values, index=[f"sp{i}" for i in range(13)], columns=[f"S{j}" for j in range(19)])
+
+def test_levels_are_block_means_of_the_matrix(species_matrix):
+    levels = build_pyramid(species_matrix, tile_size=TILE)
+    full = species_matrix.to_numpy()
+    max_zoom = len(levels) - 1
+    np.testing.assert_allclose(levels[-1], full.astype(np.float32), equal_nan=True)
+    assert max(levels[0].shape) <= TILE
+    for zoom, level in enumerate(levels):
+        block = 2 ** (max_zoom - zoom)
+        assert level.shape == (-(-full.shape[0] // block), -(-full.shape[1] // block))
+        for i in range(level.shape[0]):
+            for j in range(level.shape[1]):
+                cells = full[i * block:(i + 1) * block, j * block:(j + 1) * block]
+                if np.isfinite(cells).any():
+                    assert level[i, j] == pytest.approx(np.nanmean(cells), rel=1e-5)
+                else:
+                    assert np.isnan(level[i, j])
+
+def test_store_and_load_round_trip(tmp_path, species_matrix):
+    meta = store_pyramid(str(tmp_path), "v1", species_matrix, tile_size=TILE)
+    assert load_pyramid_meta(str(tmp_path), "v1") == meta
+    levels = build_pyramid(species_matrix, tile_size=TILE)
+    for zoom, level in enumerate(levels):
+        np.testing.assert_array_equal(load_level(str(tmp_path), "v1", zoom), level)
+    assert meta["species"] == list(species_matrix.index)
+
+    (tmp_path / f"{_level_key('v1', meta['max_zoom'])}.bin").unlink()  # evicted
+    assert load_level(str(tmp_path), "v1", meta["max_zoom"]) is None
+    drop_pyramid_meta(str(tmp_path), "v1")
+    assert load_pyramid_meta(str(tmp_path), "v1") is None
+
+def test_tile_bounds(tmp_path, species_matrix):
+    meta = store_pyramid(str(tmp_path), "v2", species_matrix, tile_size=TILE)
+    deepest = meta["max_zoom"]
+    assert tile_bounds(meta, deepest, 0, 0) == (0, TILE, 0, TILE)
+    last_x, last_y = meta["levels"][deepest]["tiles_x"] - 1, meta["levels"][deepest]["tiles_y"] - 1
+    assert tile_bounds(meta, deepest, last_x, last_y) == (last_y * TILE, 13, last_x * TILE, 19)
+    with pytest.raises(ValueError):
+        tile_bounds(meta, deepest + 1, 0, 0)
+    with pytest.raises(ValueError):
+        tile_bounds(meta, deepest, last_x + 1, 0)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.hit_index import HitIndex
+from utils.viruses.enterovirus import calculate_moving_sum
+
+@pytest.fixture(scope="module")
+def hits():
+    rng = np.random.default_rng(4)
+    n = 200
+    starts = rng.integers(10, 700, n)
+    return pd.DataFrame({
+        'qseqid': [f"p{i}" for i in range(n)],
+        'sstart': starts,
+        'send': starts + rng.integers(5, 60, n),
+        'mean_rpk_difference': rng.normal(size=n),
+    })
+
+@pytest.fixture(scope="module")
+def index(hits):
+    return HitIndex.from_hits(hits)
+
+RANGES = [(5, 5), (10, 10), (100, 140), (300, 301), (690, 800), (0, 2000), (900, 950)]
+
+@pytest.mark.parametrize("a, b", RANGES)
+def test_overlap_matches_brute_force(hits, index, a, b):
+    expected = hits[(hits['sstart'] <= b) & (hits['send'] >= a)]
+    found = index.query(a, b)
+    assert sorted(found['pep_id']) == sorted(expected['qseqid'])
+    assert index.count_overlapping(a, b) == len(expected)
+
+@pytest.mark.parametrize("a, b", RANGES)
+def test_cover_matches_brute_force(hits, index, a, b):
+    expected = hits[(hits['sstart'] <= a) & (hits['send'] >= b)]
+    assert sorted(index.query(a, b, mode='cover')['pep_id']) == sorted(expected['qseqid'])
+
+def test_cover_sums_equal_moving_sum(hits, index):
+    moving = calculate_moving_sum(hits, win_size=16, step_size=4)
+    for row in moving.itertuples(index=False):
+        found = index.query(row.window_start, row.window_end, mode='cover')
+        assert found['value'].sum() == pytest.approx(row.moving_sum)
+
+def test_coverage_is_clamped_to_the_indexed_span(hits, index):
+    first, last = int(hits['sstart'].min()), int(hits['send'].max())
+    coverage = index.coverage(first - 50, last + 50)
+    assert coverage['position'].iloc[0] == first
+    assert coverage['position'].iloc[-1] == last
+    depth = [((hits['sstart'] <= p) & (hits['send'] >= p)).sum() for p in coverage['position']]
+    np.testing.assert_array_equal(coverage['depth'].to_numpy(), depth)
+    assert index.coverage(last + 10, last + 20).empty
+
+def test_range_totals_match_coverage(index):
+    coverage = index.coverage(120, 260)
+    depth, covered, value = index.range_totals(120, 260)
+    assert depth == coverage['depth'].sum()
+    assert covered == (coverage['depth'] > 0).sum()
+    assert value == pytest.approx(coverage['value_sum'].sum())
+    assert index.range_totals(5000, 6000) == (0, 0, 0.0)
+
+def test_empty_index():
+    empty = HitIndex.from_hits(pd.DataFrame(columns=['qseqid', 'sstart', 'send']))
+    assert len(empty) == 0
+    assert empty.query(1, 100).empty
+    assert empty.count_overlapping(1, 100) == 0
+    assert empty.coverage().empty
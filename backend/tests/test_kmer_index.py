@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import REFERENCE_FASTA
+from utils.kmer_index import KmerIndex
+from utils.references import read_fasta_records
+from utils.viruses.enterovirus import BLAST_COLUMNS
+
+PEP_LEN = 56
+
+@pytest.fixture(scope="module")
+def records():
+    return read_fasta_records(REFERENCE_FASTA)
+
+@pytest.fixture(scope="module")
+def index(records):
+    return KmerIndex(records)
+
+def cut_peptides(sequence, n, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, len(sequence) - PEP_LEN, n)
+    return starts, [sequence[s:s + PEP_LEN] for s in starts]
+
+def test_exact_peptides_are_placed_at_their_offset(index, records):
+    seq_id, sequence = records[0]
+    starts, peptides = cut_peptides(sequence, 200)
+    df = pd.DataFrame({'pep_id': [f"p{i}" for i in range(len(peptides))], 'pep_aa': peptides})
+    hits, unresolved = index.resolve(df)
+    assert list(hits.columns) == BLAST_COLUMNS
+    assert unresolved.empty
+    hits = hits.set_index('qseqid').loc[df['pep_id']]
+    assert (hits['sseqid'] == seq_id).all()
+    for start, peptide, hit in zip(starts, peptides, hits.itertuples()):
+        # A repeated segment may place at its leftmost copy; it must still be identical there
+        assert sequence[hit.sstart - 1:hit.send] == peptide
+        assert hit.sstart <= start + 1
+    assert (hits['pident'] == 100.0).all()
+    assert (hits[['mismatch', 'gapopen']] == 0).all().all()
+    assert ((hits['qstart'] == 1) & (hits['qend'] == PEP_LEN) & (hits['length'] == PEP_LEN)).all()
+
+def test_substitutions_up_to_the_limit_are_resolved(index, records):
+    _, sequence = records[0]
+    start = 100
+    peptide = list(sequence[start:start + PEP_LEN])
+    for pos in (10, 40):
+        peptide[pos] = 'W' if peptide[pos] != 'W' else 'C'
+    hit = index.place(''.join(peptide))
+    assert hit is not None
+    assert (hit["sstart"], hit["send"]) == (start + 1, start + PEP_LEN)
+    assert hit["mismatch"] == 2
+
+    for pos in (20, 30):
+        peptide[pos] = 'W' if peptide[pos] != 'W' else 'C'
+    assert index.place(''.join(peptide)) is None
+
+def test_unrelated_and_filtered_peptides_are_left_for_diamond(index, records):
+    _, sequence = records[0]
+    rng = np.random.default_rng(1)
+    unrelated = ''.join(rng.choice(list("ACDEFGHIKLMNPQRSTVWY"), PEP_LEN))
+    df = pd.DataFrame({'pep_id': ['random', 'exact', 'short'],
+                       'pep_aa': [unrelated, sequence[:PEP_LEN], sequence[:5]]})
+    hits, unresolved = index.resolve(df)
+    assert list(hits['qseqid']) == ['exact']
+    assert list(unresolved['pep_id']) == ['random', 'short']
+
+    hits, unresolved = index.resolve(df.iloc[[1]], max_evalue=1e-300)
+    assert hits.empty and list(unresolved['pep_id']) == ['exact']
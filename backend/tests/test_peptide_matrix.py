@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.peptide_matrix import PeptideSampleMatrix
+from utils.viruses.enterovirus import calculate_mean_rpk_difference
+
+def test_mean_difference_matches_groupby(long_df, matrix):
+    expected = calculate_mean_rpk_difference(long_df).set_index('pep_id').sort_index()
+    actual = matrix.mean_difference().set_index('pep_id').sort_index()
+    for col in ['mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference']:
+        np.testing.assert_allclose(actual[col].to_numpy(), expected[col].to_numpy())
+
+def test_sample_with_two_conditions_is_rejected():
+    df = pd.DataFrame({
+        'pep_id': ['p1', 'p2', 'p1', 'p2'],
+        'sample_id': ['s1', 's1', 's2', 's2'],
+        'rpk': [1.0, 2.0, 3.0, 4.0],
+        'Condition': ['Case', 'Control', 'Control', 'Control'],
+    })
+    with pytest.raises(ValueError, match="s1"):
+        PeptideSampleMatrix.from_long(df)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import REFERENCE_FASTA
+from utils.antigen_profile import build_antigen_profile, moving_sum_from_profile
+from utils.kmer_index import KmerIndex
+from utils.references import read_fasta_records
+from utils.sharding import configure_sharding, SETTINGS as SHARD_SETTINGS
+import utils.permutation as permutation
+from utils.permutation import window_significance, window_design, sample_contrast, permutation_pvalues
+
+WIN_SIZE, STEP_SIZE = 32, 4
+
+@pytest.fixture(scope="module")
+def antigen_map(long_df, matrix):
+    peptides = long_df[['pep_id', 'pep_aa']].drop_duplicates(subset=['pep_id']).astype(str)
+    hits, _ = KmerIndex(read_fasta_records(REFERENCE_FASTA)).resolve(peptides)
+    merged = hits.merge(matrix.mean_difference(), left_on='qseqid', right_on='pep_id')
+    moving_sum_df = moving_sum_from_profile(build_antigen_profile(merged), WIN_SIZE, STEP_SIZE)
+    return hits, moving_sum_df
+
+def test_statistic_equals_moving_sum(antigen_map, matrix):
+    hits, moving_sum_df = antigen_map
+    result = window_significance(moving_sum_df, hits, matrix, WIN_SIZE, n_permutations=50)
+    assert len(result) == len(moving_sum_df) > 0
+    np.testing.assert_allclose(result['statistic'], result['moving_sum'], atol=1e-9)
+    assert ((result['p_value'] > 0) & (result['p_value'] <= 1)).all()
+    assert (result['q_value'] >= result['p_value'] - 1e-12).all()
+
+def test_same_seed_same_pvalues(antigen_map, matrix):
+    hits, moving_sum_df = antigen_map
+    design = window_design(hits, matrix, moving_sum_df['window_start'].to_numpy(), WIN_SIZE)
+    contrast = sample_contrast(matrix)
+    _, first = permutation_pvalues(design, contrast, n_permutations=600, seed=7)
+    _, again = permutation_pvalues(design, contrast, n_permutations=600, seed=7)
+    _, other = permutation_pvalues(design, contrast, n_permutations=600, seed=8)
+    np.testing.assert_array_equal(first, again)
+    assert not np.array_equal(first, other)
+
+def test_pool_gives_identical_pvalues(antigen_map, matrix, monkeypatch):
+    hits, moving_sum_df = antigen_map
+    design = window_design(hits, matrix, moving_sum_df['window_start'].to_numpy(), WIN_SIZE)
+    contrast = sample_contrast(matrix)
+    _, in_process = permutation_pvalues(design, contrast, n_permutations=600, seed=3)
+
+    workers = SHARD_SETTINGS["workers"]
+    monkeypatch.setattr(permutation, "POOL_MIN_WORK", 0)
+    configure_sharding(workers=2)
+    try:
+        _, pooled = permutation_pvalues(design, contrast, n_permutations=600, seed=3)
+    finally:
+        configure_sharding(workers=workers)
+    np.testing.assert_array_equal(pooled, in_process)
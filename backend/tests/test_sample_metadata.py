@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.dataset import species_by_sample
+from utils.sample_metadata import group_species_matrix, read_sample_metadata, with_sample_groups
+
+@pytest.fixture(scope="module")
+def samples(long_df):
+    return sorted(long_df['sample_id'].astype(str).unique())
+
+@pytest.fixture(scope="module")
+def metadata_path(samples, tmp_path_factory):
+    # Three sites; the last two samples have no row, one row has no site,
+    # a duplicated sample keeps its first row
+    sites = ['north', 'south', 'east']
+    rows = [f"{s} ; {sites[i % 3]} ; {20 + i}" for i, s in enumerate(samples[:-2])]
+    rows[0] = f"{samples[0]} ; ; 20"
+    rows.append(f"{samples[1]} ; east ; 99")
+    path = tmp_path_factory.mktemp("metadata") / "metadata.csv"
+    path.write_text("sample_id;site;age\n" + "\n".join(rows) + "\n")
+    return str(path)
+
+@pytest.fixture(scope="module")
+def metadata(metadata_path):
+    return read_sample_metadata(metadata_path)
+
+def expected_sites(samples):
+    sites = {s: ['north', 'south', 'east'][i % 3] for i, s in enumerate(samples[:-2])}
+    del sites[samples[0]]
+    return sites
+
+def test_read_strips_values_and_keeps_first_row(metadata, samples):
+    assert metadata.columns == ['site', 'age']
+    assert metadata.table.loc[samples[1], 'site'] == 'south'
+    described = {d["column"]: d for d in metadata.describe()}
+    assert described["site"]["values"] == ['east', 'north', 'south']
+
+def test_missing_sample_column_is_rejected(tmp_path):
+    path = tmp_path / "bad.csv"
+    path.write_text("id,site\nS1,north\n")
+    with pytest.raises(ValueError, match="sample_id"):
+        read_sample_metadata(str(path))
+
+def test_group_codes(metadata, samples):
+    codes, labels = metadata.group_codes(samples, 'site')
+    sites = expected_sites(samples)
+    assert [labels[c] if c >= 0 else None for c in codes] == [sites.get(s) for s in samples]
+    with pytest.raises(ValueError):
+        metadata.group_codes(samples, 'unknown')
+
+def test_group_species_matrix_averages_sample_columns(long_df, metadata, samples):
+    species = species_by_sample(long_df)
+    species.columns = species.columns.astype(str)
+    grouped = group_species_matrix(species, metadata, 'site')
+    sites = pd.Series(expected_sites(samples))
+    for site in grouped.columns:
+        members = sites.index[sites == site]
+        np.testing.assert_allclose(grouped[site].to_numpy(), species[members].mean(axis=1).to_numpy())
+
+def test_with_sample_groups_compares_metadata_groups(long_df, matrix, metadata, samples):
+    grouped = with_sample_groups(matrix, metadata, 'site')
+    diff = grouped.mean_difference(case='north', control='south').set_index('pep_id').sort_index()
+
+    sites = expected_sites(samples)
+    rows = long_df.assign(site=long_df['sample_id'].astype(str).map(sites)).dropna(subset=['site'])
+    means = rows.groupby(['pep_id', 'site'], observed=True)['rpk'].mean().unstack('site')
+    means.index = means.index.astype(str)
+    diff.index = diff.index.astype(str)
+    np.testing.assert_allclose(diff['mean_rpk_case'].to_numpy(), means.loc[diff.index, 'north'].to_numpy())
+    np.testing.assert_allclose(diff['mean_rpk_difference'].to_numpy(),
+                               (means['north'] - means['south']).loc[diff.index].to_numpy())
+    assert grouped.matrix is matrix.matrix  # shared, not copied
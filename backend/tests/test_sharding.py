@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_sharding import synthetic_hits
+from utils.dataset import compact_long_df, compute_rpk
+from utils.sharding import (configure_sharding, sharded_compute_rpk, sharded_group_mean, sharded_moving_sum,
+                            SETTINGS as SHARD_SETTINGS)
+from utils.viruses.enterovirus import calculate_moving_sum
+
+@pytest.fixture
+def two_workers():
+    workers, min_rows = SHARD_SETTINGS["workers"], SHARD_SETTINGS["min_rows"]
+    configure_sharding(workers=2, min_rows=0)
+    try:
+        yield
+    finally:
+        configure_sharding(workers=workers, min_rows=min_rows)
+
+def test_sharded_rpk_matches_serial(long_df, two_workers):
+    raw = long_df.drop(columns=['rpk'])
+    sharded = sharded_compute_rpk(raw)
+    np.testing.assert_allclose(sharded['rpk'].to_numpy(), long_df['rpk'].to_numpy())
+
+def test_sharded_group_mean_matches_groupby(long_df, two_workers):
+    df = long_df.copy()
+    df.loc[df.index[::7], 'rpk'] = np.nan  # skipped, as by pandas
+    serial = df.groupby(['pep_id', 'Condition'], observed=True)['rpk'].mean()
+    sharded = sharded_group_mean(df, 'pep_id', 'Condition')
+    sharded.index = sharded.index.set_levels([level.astype(str) for level in sharded.index.levels])
+    serial.index = serial.index.set_levels([level.astype(str) for level in serial.index.levels])
+    pd.testing.assert_series_equal(sharded.sort_index(), serial.sort_index(), check_names=False)
+
+@pytest.mark.parametrize("win_size, step_size", [(32, 4), (8, 1), (56, 3)])
+def test_sharded_moving_sum_matches_serial(two_workers, win_size, step_size):
+    hits = synthetic_hits(300, length=800, seed=3)
+    expected = calculate_moving_sum(hits, win_size=win_size, step_size=step_size)
+    window_starts = np.arange(hits['sstart'].min(), hits['send'].max() - win_size + 2, step_size)
+    sums, covered = sharded_moving_sum(hits['sstart'], hits['send'], hits['mean_rpk_difference'],
+                                       window_starts, win_size)
+    np.testing.assert_array_equal(window_starts[covered], expected['window_start'].to_numpy())
+    np.testing.assert_allclose(sums[covered], expected['moving_sum'].to_numpy())
+
+def test_dataset_helpers_shard_above_min_rows(two_workers):
+    raw = compact_long_df(pd.DataFrame({
+        'sample_id': ['s1', 's1', 's2', 's2', 's2'],
+        'pep_id': ['p1', 'p2', 'p1', 'p2', 'p3'],
+        'abundance': [1.0, 3.0, 2.0, 2.0, 4.0],
+    }))
+    np.testing.assert_allclose(compute_rpk(raw)['rpk'], [25_000, 75_000, 25_000, 25_000, 50_000])
@@ -0,0 +1,72 @@
+import os
+
+# -----------------------
+# DIAMOND alignment presets
+# -----------------------
+# 'default' reproduces the original call (DIAMOND's default sensitivity,
+# evalue 0.01). The others trade speed for sensitivity on short peptides;
+# block size (billions of letters per pass) is raised and index chunks kept
+# at 1 because reference databases here are tiny, so one pass suffices.
+ALIGNMENT_PRESETS = {
+    "default": {"mode": None, "evalue": 0.01, "block_size": None, "index_chunks": None},
+    "fast": {"mode": "--fast", "evalue": 0.01, "block_size": 4.0, "index_chunks": 1},
+    "sensitive": {"mode": "--sensitive", "evalue": 0.01, "block_size": 4.0, "index_chunks": 1},
+    "very-sensitive": {"mode": "--very-sensitive", "evalue": 0.01, "block_size": 4.0, "index_chunks": 1},
+}
+DEFAULT_PRESET = "default"
+
+# Per-reference and global overrides, set from app.py via configure_alignment
+SETTINGS = {
+    "default_preset": DEFAULT_PRESET,
+    "reference_presets": {},   # {reference id: preset name}
+    "threads": None,           # None: derived from available cores
+    "kmer_fast_path": True,    # place near-exact peptides in-process (utils/kmer_index.py)
+    "batch_window": 0.05,      # seconds to coalesce DIAMOND queries (utils/alignment_batcher.py); 0 disables
+    "max_concurrent_alignments": 4,  # per-species alignments run at once (utils/species_maps.py)
+}
+
+def configure_alignment(default_preset=None, reference_presets=None, threads=None, kmer_fast_path=None,
+                        batch_window=None, max_concurrent_alignments=None):
+    for name in [default_preset] + list((reference_presets or {}).values()):
+        if name is not None and name not in ALIGNMENT_PRESETS:
+            raise ValueError(f"Unknown alignment preset '{name}'")
+    if default_preset is not None:
+        SETTINGS["default_preset"] = default_preset
+    if reference_presets is not None:
+        SETTINGS["reference_presets"] = dict(reference_presets)
+    if threads is not None:
+        SETTINGS["threads"] = int(threads) or None
+    if kmer_fast_path is not None:
+        SETTINGS["kmer_fast_path"] = bool(kmer_fast_path)
+    if batch_window is not None:
+        SETTINGS["batch_window"] = max(float(batch_window), 0.0)
+    if max_concurrent_alignments is not None:
+        SETTINGS["max_concurrent_alignments"] = max(int(max_concurrent_alignments), 1)
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def alignment_threads():
+    return SETTINGS["threads"] or available_cores()
+
+def resolve_preset(requested=None, reference_id=None):
+    """Request choice, else the reference's configured preset, else the global default."""
+    name = requested or SETTINGS["reference_presets"].get(reference_id) or SETTINGS["default_preset"]
+    if name not in ALIGNMENT_PRESETS:
+        raise ValueError(f"Unknown alignment preset '{name}'")
+    return name
+
+def diamond_args(preset=DEFAULT_PRESET, threads=None):
+    """blastp arguments for a preset (excluding query/db/out)."""
+    spec = ALIGNMENT_PRESETS[preset]
+    args = ["--threads", str(threads or alignment_threads()), "--evalue", str(spec["evalue"])]
+    if spec["mode"]:
+        args.append(spec["mode"])
+    if spec["block_size"]:
+        args += ["--block-size", str(spec["block_size"])]
+    if spec["index_chunks"]:
+        args += ["--index-chunks", str(spec["index_chunks"])]
+    return args
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+
+import pandas as pd
+
+from utils.alignment import SETTINGS
+
+# Longest a request thread waits for its batch before giving up
+ALIGN_TIMEOUT = 30 * 60
+
+# -----------------------
+# Alignment batcher
+# -----------------------
+# Concurrent antigen-map requests (gthread workers, PDF jobs) each used to
+# start their own `diamond blastp`, loading the same database every time.
+# Peptide sets submitted for the same database and preset within one time
+# window are merged into a single query FASTA instead; hits are then
+# demultiplexed back to each submitter under its own pep_ids.
+class _Batch:
+    def __init__(self):
+        self.members = []   # (future, peptides_df)
+        self.n_queries = 0
+
+class AlignmentBatcher:
+    """
+    `runner(query_fasta, db_path, preset)` returns a BLAST-columns DataFrame
+    (e.g. enterovirus.diamond_blast_df). The window comes from
+    SETTINGS["batch_window"] (seconds); 0 runs every submission on its own.
+    """
+
+    def __init__(self, runner, max_queries=500_000):
+        self.runner = runner
+        self.max_queries = max_queries
+        self._pending = {}  # (db_path, preset) -> _Batch
+        self._lock = threading.Lock()
+
+    def align(self, peptides_df, db_path, preset, pep_id_col='pep_id', pep_seq_col='pep_aa',
+              timeout=ALIGN_TIMEOUT):
+        """
+        Hits for `peptides_df` (qseqid = its pep_ids); blocks until its batch
+        has run, raising concurrent.futures.TimeoutError after `timeout` seconds.
+        """
+        return self.submit(peptides_df, db_path, preset, pep_id_col, pep_seq_col).result(timeout=timeout)
+
+    def submit(self, peptides_df, db_path, preset, pep_id_col='pep_id', pep_seq_col='pep_aa'):
+        peptides_df = (
+            peptides_df[[pep_id_col, pep_seq_col]]
+            .drop_duplicates(subset=[pep_id_col])
+            .set_axis(['pep_id', 'pep_aa'], axis=1)
+        )
+        future = Future()
+        window = SETTINGS["batch_window"]
+        if window <= 0:
+            batch = _Batch()
+            batch.members.append((future, peptides_df))
+            self._run(batch, db_path, preset)
+            return future
+
+        key = (db_path, preset)
+        flush_now = None
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch()
+                timer = threading.Timer(window, self._flush, args=(key, batch))
+                timer.daemon = True
+                timer.start()
+            batch.members.append((future, peptides_df))
+            batch.n_queries += len(peptides_df)
+            if batch.n_queries >= self.max_queries:
+                # Full: run now rather than wait out the window (the timer then finds nothing)
+                flush_now = self._pending.pop(key)
+        if flush_now is not None:
+            threading.Thread(target=self._run, args=(flush_now, db_path, preset), daemon=True).start()
+        return future
+
+    def _flush(self, key, batch):
+        with self._lock:
+            if self._pending.get(key) is not batch:
+                return
+            del self._pending[key]
+        self._run(batch, *key)
+
+    def _run(self, batch, db_path, preset):
+        try:
+            # One query per distinct sequence: uploads of the same library share peptides
+            combined = pd.concat([df.assign(member=i) for i, (_, df) in enumerate(batch.members)],
+                                 ignore_index=True)
+            codes, sequences = pd.factorize(combined['pep_aa'].astype(str))
+            combined['query'] = [f"q{c}" for c in codes]
+
+            fasta_path = write_query_fasta(sequences)
+            try:
+                blast_df = self.runner(fasta_path, db_path, preset)
+            finally:
+                os.remove(fasta_path)
+
+            columns = list(blast_df.columns)
+            for i, (future, _) in enumerate(batch.members):
+                member = combined.loc[combined['member'] == i, ['pep_id', 'query']]
+                hits = member.merge(blast_df, left_on='query', right_on='qseqid', how='inner')
+                hits['qseqid'] = hits['pep_id']
+                future.set_result(hits[columns].reset_index(drop=True))
+        except Exception as e:
+            # Every submitter must be released, including those after a failed demultiplex
+            for future, _ in batch.members:
+                if not future.done():
+                    future.set_exception(e)
+
+def write_query_fasta(sequences):
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.fasta') as f:
+        for i, seq in enumerate(sequences):
+            f.write(f">q{i}\n{seq}\n")
+    return f.name
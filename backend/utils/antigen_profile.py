@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# -----------------------
+# Multi-resolution antigen map profile
+# -----------------------
+# calculate_moving_sum sums the values of hits that fully cover each window
+# [ws, ws + win_size - 1]. A hit (sstart, send) covers exactly the window
+# starts sstart .. send - win_size + 1, so for one win_size all step-1 window
+# sums come from a difference array over the reference in O(hits + length),
+# and any step_size is a strided slice of that. The profile keeps the deduped
+# hits once per upload plus precomputed step-1 sums for common window sizes,
+# so moving the slider never re-runs DIAMOND or the domain parse.
+COMMON_WIN_SIZES = (8, 16, 24, 32, 48, 64, 96, 128)
+
+def build_antigen_profile(hits_df, value_column='mean_rpk_difference', win_sizes=COMMON_WIN_SIZES):
+    # Same dedupe as calculate_moving_sum: first hit per peptide
+    unique = hits_df.drop_duplicates(subset=['qseqid'])
+    sstart = unique['sstart'].to_numpy(np.int64)
+    send = unique['send'].to_numpy(np.int64)
+    values = unique[value_column].to_numpy(np.float64)
+
+    profile = {
+        "sstart": sstart,
+        "send": send,
+        "values": values,
+        "min_start": int(sstart.min()) if len(sstart) else 0,
+        "max_end": int(send.max()) if len(send) else -1,
+        "levels": {},
+    }
+    for win_size in win_sizes:
+        profile["levels"][int(win_size)] = window_start_sums(profile, win_size)
+    return profile
+
+def window_start_sums(profile, win_size):
+    """Step-1 (sums, covering hit counts) for every window start from min_start."""
+    levels = profile.get("levels", {})
+    if win_size in levels:
+        return levels[win_size]
+
+    min_start, max_end = profile["min_start"], profile["max_end"]
+    n_windows = max(max_end - win_size + 2 - min_start, 0)
+    sstart, send, values = profile["sstart"], profile["send"], profile["values"]
+
+    last_start = send - win_size + 1
+    fits = last_start >= sstart
+    lo = sstart[fits] - min_start
+    hi = last_start[fits] - min_start + 1
+
+    # NaN values still mark a window as covered but add nothing, as in .sum()
+    weights = np.nan_to_num(values[fits])
+    sums = np.bincount(lo, weights, minlength=n_windows + 1) - np.bincount(hi, weights, minlength=n_windows + 1)
+    counts = np.bincount(lo, minlength=n_windows + 1) - np.bincount(hi, minlength=n_windows + 1)
+    return np.cumsum(sums)[:n_windows], np.cumsum(counts)[:n_windows]
+
+def residue_profile(profile):
+    """Per-residue coverage-weighted RPK difference (the win_size=1 sums)."""
+    sums, counts = window_start_sums(profile, 1)
+    positions = np.arange(profile["min_start"], profile["min_start"] + len(sums))
+    return pd.DataFrame({"position": positions, "rpk_difference": sums, "coverage": counts})
+
+def moving_sum_from_profile(profile, win_size=32, step_size=4):
+    """Same rows as calculate_moving_sum(hits, win_size=..., step_size=...)."""
+    if win_size < 1 or step_size < 1:
+        raise ValueError("win_size and step_size must be positive")
+    sums, counts = window_start_sums(profile, win_size)
+    offsets = np.arange(0, len(sums), step_size)
+    covered = offsets[counts[offsets] > 0]
+    if not len(covered):
+        return pd.DataFrame(columns=['window_start', 'window_end', 'moving_sum'])
+    window_starts = covered + profile["min_start"]
+    return pd.DataFrame({
+        'window_start': window_starts,
+        'window_end': window_starts + win_size - 1,
+        'moving_sum': sums[covered]
+    })
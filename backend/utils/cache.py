@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; single-flight is then per process only
+    fcntl = None
+
+from flask import current_app
+
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), "virscope_cache")
+
+# -----------------------
+# Settings (set from app.py via configure_cache)
+# -----------------------
+SETTINGS = {
+    "root": DEFAULT_CACHE_FOLDER,  # folder (namespaces included) the size cap applies to
+    "max_bytes": 0,                # 0 disables eviction
+    "prune_fraction": 0.1,         # prune after writing this share of the cap, down to 1 - it
+}
+
+_written_since_prune = 0
+_prune_lock = threading.Lock()
+
+def configure_cache(root=None, max_mb=None):
+    if root is not None:
+        SETTINGS["root"] = root
+    if max_mb is not None:
+        SETTINGS["max_bytes"] = max(int(max_mb), 0) * 1024 * 1024
+
+# -----------------------
+# Helper: cache folder from app config
+# -----------------------
+def get_cache_folder(app=None, namespace=None):
+    flask_app = app or current_app
+    folder = flask_app.config.get("CACHE_FOLDER") or DEFAULT_CACHE_FOLDER
+    if namespace:
+        folder = os.path.join(folder, namespace)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+# -----------------------
+# Helper: cache keys
+# -----------------------
+def upload_version(upload):
+    """Changes whenever the upload's file is replaced or renamed."""
+    modified = upload.date_modified.isoformat() if upload.date_modified else ""
+    return f"{upload.upload_id}:{upload.name}:{modified}"
+
+def cache_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+# -----------------------
+# Bytes / pickle entries with optional JSON metadata
+# -----------------------
+def cache_get_bytes(folder, key):
+    path = os.path.join(folder, f"{key}.bin")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None, None
+    _touch(path)
+    return data, _read_meta(folder, key)
+
+def cache_put_bytes(folder, key, data, meta=None):
+    if meta is not None:
+        _atomic_write(os.path.join(folder, f"{key}.json"), json.dumps(meta).encode("utf-8"))
+    _atomic_write(os.path.join(folder, f"{key}.bin"), data)
+    _note_written(len(data))
+
+def cache_file_path(folder, key):
+    """
+    Path of a cached entry (e.g. for np.load(mmap_mode='r')), or None on a miss.
+    The entry can still be evicted before it is opened; callers treat
+    FileNotFoundError as a miss.
+    """
+    path = os.path.join(folder, f"{key}.bin")
+    return path if _touch(path) else None
+
+def cache_delete(folder, key):
+    for suffix in (".bin", ".json"):
+        try:
+            os.remove(os.path.join(folder, f"{key}{suffix}"))
+        except FileNotFoundError:
+            pass
+
+def cache_get_pickle(folder, key):
+    data, _ = cache_get_bytes(folder, key)
+    return pickle.loads(data) if data is not None else None
+
+def cache_put_pickle(folder, key, obj):
+    cache_put_bytes(folder, key, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+# -----------------------
+# Single-flight: concurrent identical computations share one run
+# -----------------------
+# The frontend requests e.g. the antigen map PNG and JSON together; without
+# this both miss the cache and both run DIAMOND. The first caller for a key
+# computes (and caches) while the others wait, then read its cached result.
+# Threads in one worker wait on an in-process lock, other gunicorn workers on
+# a lock file next to the entry.
+_key_locks = {}  # (folder, key) -> [lock, users]
+_key_locks_guard = threading.Lock()
+
+@contextmanager
+def _process_lock(folder, key):
+    with _key_locks_guard:
+        entry = _key_locks.setdefault((folder, key), [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[(folder, key)]
+
+@contextmanager
+def _file_lock(folder, key):
+    if fcntl is None:
+        yield
+        return
+    # The holder removes the lock file before unlocking, so none accumulate.
+    # A waiter that locked a removed file sees the path is gone (or is a new
+    # file) and retries, so two workers never hold different inodes for a key.
+    path = os.path.join(folder, f"{key}.lock")
+    while True:
+        f = open(path, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        f.close()
+    try:
+        yield
+    finally:
+        os.remove(path)
+        f.close()
+
+def single_flight(folder, key, lookup, compute):
+    """
+    `lookup()` returns the cached value or None; `compute()` builds and caches it.
+    Returns (value, status) with status 'hit', 'shared' (computed by a concurrent
+    caller while this one waited) or 'miss'.
+    """
+    value = lookup()
+    if value is not None:
+        return value, "hit"
+    with _process_lock(folder, key), _file_lock(folder, key):
+        value = lookup()
+        if value is not None:
+            return value, "shared"
+        return compute(), "miss"
+
+def cached_pickle(folder, key, compute):
+    """Pickle-cached `compute()`, single-flight per key."""
+    def compute_and_store():
+        obj = compute()
+        cache_put_pickle(folder, key, obj)
+        return obj
+    value, _ = single_flight(folder, key, lambda: cache_get_pickle(folder, key), compute_and_store)
+    return value
+
+# -----------------------
+# Size cap: least recently used entries are evicted
+# -----------------------
+# Hits bump an entry's mtime, so mtime order is least-recently-used order.
+# Each process counts the bytes it writes and, once that reaches
+# prune_fraction of the cap, scans the cache root and removes the oldest
+# entries until the total is back under (1 - prune_fraction) of the cap.
+# Entries whose upload version changed are never hit again and age out first.
+def prune_cache(root=None, max_bytes=None):
+    """Evict least recently used entries under `root` until it fits the cap; returns bytes freed."""
+    root = root or SETTINGS["root"]
+    max_bytes = SETTINGS["max_bytes"] if max_bytes is None else max_bytes
+    if not max_bytes:
+        return 0
+    entries, total = [], 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(dirpath, name)
+            meta_path = path[:-len(".bin")] + ".json"
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size = st.st_size + (os.path.getsize(meta_path) if os.path.exists(meta_path) else 0)
+            entries.append((st.st_mtime, size, path, meta_path))
+            total += size
+    target = max_bytes * (1 - SETTINGS["prune_fraction"])
+    freed = 0
+    for _, size, path, meta_path in sorted(entries):
+        if total - freed <= target:
+            break
+        # Entry first, metadata second: a reader never sees metadata without data
+        for p in (path, meta_path):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+        freed += size
+    return freed
+
+def _note_written(n_bytes):
+    global _written_since_prune
+    max_bytes = SETTINGS["max_bytes"]
+    if not max_bytes:
+        return
+    with _prune_lock:
+        _written_since_prune += n_bytes
+        if _written_since_prune < max_bytes * SETTINGS["prune_fraction"]:
+            return
+        _written_since_prune = 0
+    prune_cache()
+
+def _touch(path):
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def _read_meta(folder, key):
+    try:
+        with open(os.path.join(folder, f"{key}.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _atomic_write(path, data):
+    # Write then rename so concurrent readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,168 @@
+import json
+
+import numpy as np
+
+from utils.viruses.enterovirus import EV_PROTEIN_COLOURS, EV_DEFAULT_COLOUR
+
+def finite_or_none(value):
+    # NaN/inf are not valid JSON
+    return float(value) if np.isfinite(value) else None
+
+# -----------------------
+# Vega-Lite chart specs (rendered client-side)
+# -----------------------
+# Each builder returns a complete spec with inline data that mirrors the
+# matching matplotlib plot, so the frontend can draw it without a raster.
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v5.json"
+
+def heatmap_spec(heatmap_data, title="Species RPK Heatmap"):
+    """`heatmap_data`: species (rows) x samples (columns), as from top_species_heatmap."""
+    values = [
+        {"taxon_species": str(species), "sample_id": str(sample), "rpk": finite_or_none(v)}
+        for species, row in zip(heatmap_data.index, heatmap_data.values)
+        for sample, v in zip(heatmap_data.columns, row)
+    ]
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": title,
+        "data": {"values": values},
+        "mark": "rect",
+        "width": "container",
+        "encoding": {
+            "x": {"field": "sample_id", "type": "nominal", "sort": [str(c) for c in heatmap_data.columns],
+                  "title": "Sample ID", "axis": {"labelAngle": -45}},
+            "y": {"field": "taxon_species", "type": "nominal", "sort": [str(i) for i in heatmap_data.index],
+                  "title": None},
+            "color": {"field": "rpk", "type": "quantitative", "title": "RPK",
+                      "scale": {"scheme": "viridis"}},
+            "tooltip": [
+                {"field": "taxon_species", "type": "nominal"},
+                {"field": "sample_id", "type": "nominal"},
+                {"field": "rpk", "type": "quantitative", "format": ".2f"}
+            ]
+        }
+    }
+
+def stacked_barplot_spec(pivot_df, title="Stacked Bar Plot of RPK per Species"):
+    """`pivot_df`: samples (rows) x species (columns), as from top_species_barplot."""
+    values = [
+        {"sample_id": str(sample), "taxon_species": str(species), "rpk": finite_or_none(v)}
+        for sample, row in zip(pivot_df.index, pivot_df.values)
+        for species, v in zip(pivot_df.columns, row)
+    ]
+    species_order = [str(c) for c in pivot_df.columns]
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": title,
+        "data": {"values": values},
+        "mark": "bar",
+        "width": "container",
+        "transform": [{"calculate": f"indexof({json.dumps(species_order)}, datum.taxon_species)", "as": "stack_order"}],
+        "encoding": {
+            "x": {"field": "sample_id", "type": "nominal", "sort": [str(i) for i in pivot_df.index],
+                  "title": "Sample ID", "axis": {"labelAngle": -45}},
+            "y": {"field": "rpk", "type": "quantitative", "stack": "zero", "title": "RPK"},
+            "color": {"field": "taxon_species", "type": "nominal", "sort": species_order,
+                      "title": "taxon_species", "scale": {"scheme": "tableau10"}},
+            "order": {"field": "stack_order", "type": "quantitative"},
+            "tooltip": [
+                {"field": "sample_id", "type": "nominal"},
+                {"field": "taxon_species", "type": "nominal"},
+                {"field": "rpk", "type": "quantitative", "format": ".2f"}
+            ]
+        }
+    }
+
+def ev_domain_track(ev_df):
+    """Domain records plus the colour table used by plot_antigen_map."""
+    if ev_df is None or ev_df.empty:
+        return [], {}
+    domains = [
+        {"ev_proteins": str(r["ev_proteins"]), "start": int(r["start"]), "end": int(r["end"]),
+         "show_label": bool(r["end"] - r["start"] >= 20)}
+        for r in ev_df[["ev_proteins", "start", "end"]].to_dict(orient="records")
+    ]
+    colours = {d["ev_proteins"]: EV_PROTEIN_COLOURS.get(d["ev_proteins"], EV_DEFAULT_COLOUR) for d in domains}
+    return domains, colours
+
+def antigen_map_spec(moving_sum_df, ev_df=None, title="Antigen Map: Moving Sum of RPK Differences"):
+    plot_df = moving_sum_df.drop_duplicates(subset=["window_start"])
+    x_mid = ((plot_df["window_start"] + plot_df["window_end"]) / 2).to_numpy(dtype=float)
+    moving_sum = np.nan_to_num(plot_df["moving_sum"].to_numpy(dtype=float))
+    windows = [
+        {"x_mid": float(x), "window_start": int(ws), "window_end": int(we), "moving_sum": float(v),
+         "case": float(max(v, 0)), "control": float(min(v, 0))}
+        for x, ws, we, v in zip(x_mid, plot_df["window_start"], plot_df["window_end"], moving_sum)
+    ]
+    domains, colours = ev_domain_track(ev_df)
+
+    x_domain = None
+    if windows:
+        x_domain = [float(plot_df["window_start"].min()) - 5, float(plot_df["window_end"].max()) + 5]
+    x_scale = {"domain": x_domain} if x_domain else {}
+
+    domain_track = {
+        "height": 40,
+        "data": {"values": domains},
+        "layer": [
+            {
+                "mark": {"type": "rect", "y": 0, "y2": 40},
+                "encoding": {
+                    "x": {"field": "start", "type": "quantitative", "scale": x_scale, "axis": None},
+                    "x2": {"field": "end"},
+                    "color": {
+                        "field": "ev_proteins", "type": "nominal", "legend": None,
+                        "scale": {"domain": list(colours), "range": list(colours.values())}
+                    },
+                    "tooltip": [
+                        {"field": "ev_proteins", "type": "nominal", "title": "Protein"},
+                        {"field": "start", "type": "quantitative"},
+                        {"field": "end", "type": "quantitative"}
+                    ]
+                }
+            },
+            {
+                "transform": [{"filter": "datum.show_label"}, {"calculate": "(datum.start + datum.end) / 2", "as": "mid"}],
+                "mark": {"type": "text", "fontWeight": "bold", "fontSize": 8, "y": 20},
+                "encoding": {
+                    "x": {"field": "mid", "type": "quantitative", "scale": x_scale},
+                    "text": {"field": "ev_proteins"}
+                }
+            }
+        ]
+    }
+
+    moving_sum_track = {
+        "height": 320,
+        "data": {"values": windows},
+        "encoding": {
+            "x": {"field": "x_mid", "type": "quantitative", "scale": x_scale,
+                  "title": "Position in sequence (amino acids)"}
+        },
+        "layer": [
+            {"mark": {"type": "area", "color": "#d73027"},
+             "encoding": {"y": {"field": "case", "type": "quantitative", "title": "Moving Sum"}}},
+            {"mark": {"type": "area", "color": "#4575b4"},
+             "encoding": {"y": {"field": "control", "type": "quantitative"}}},
+            {"mark": {"type": "rule", "color": "black", "strokeWidth": 0.5},
+             "encoding": {"y": {"datum": 0}}},
+            {"mark": {"type": "point", "opacity": 0},
+             "encoding": {
+                 "y": {"field": "moving_sum", "type": "quantitative"},
+                 "tooltip": [
+                     {"field": "window_start", "type": "quantitative"},
+                     {"field": "window_end", "type": "quantitative"},
+                     {"field": "moving_sum", "type": "quantitative", "format": ".2f"}
+                 ]
+             }}
+        ]
+    }
+
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": title,
+        "width": "container",
+        "vconcat": [domain_track, moving_sum_track],
+        "resolve": {"scale": {"x": "shared", "color": "independent"}},
+        "usermeta": {"ev_protein_colours": colours, "ev_domains": domains},
+    }
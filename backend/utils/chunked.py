@@ -0,0 +1,167 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+
+from utils.dataset import (
+    sniff_delimiter, apply_row_filters, plain_axes,
+    SAMPLE_LEVEL_FILTERS, SPECIES_COLUMNS, ANTIGEN_MAP_COLUMNS
+)
+from utils.viruses.enterovirus import mean_rpk_difference_from_means
+
+DEFAULT_MEMORY_CEILING_MB = 512
+
+# In-memory path holds the parsed table plus groupby/pivot working copies
+IN_MEMORY_OVERHEAD = 3
+# Fraction of the ceiling a single chunk (plus its partial aggregates) may use
+CHUNK_SHARE = 0.25
+MIN_CHUNKSIZE = 10_000
+
+# -----------------------
+# Helper: estimate parsed size of an upload from its first rows
+# -----------------------
+def estimate_table_bytes(path, columns=None, sample_rows=5000):
+    """Return (estimated parsed bytes per row, estimated row count)."""
+    sep = sniff_delimiter(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        header = f.readline()
+        lines = [line for _, line in zip(range(sample_rows), f)]
+    if not lines:
+        return 0, 0
+
+    usecols = (lambda c: c in columns) if columns else None
+    sample = pd.read_csv(io.StringIO(header + "".join(lines)), sep=sep, usecols=usecols)
+    bytes_per_row = sample.memory_usage(deep=True).sum() / len(sample)
+
+    text_bytes_per_row = sum(len(line.encode('utf-8')) for line in lines) / len(lines)
+    data_bytes = os.path.getsize(path) - len(header.encode('utf-8'))
+    est_rows = int(data_bytes / text_bytes_per_row) if text_bytes_per_row else 0
+    return bytes_per_row, est_rows
+
+def fits_in_memory(path, columns=None, memory_ceiling_mb=DEFAULT_MEMORY_CEILING_MB):
+    bytes_per_row, est_rows = estimate_table_bytes(path, columns)
+    return bytes_per_row * est_rows * IN_MEMORY_OVERHEAD <= memory_ceiling_mb * 1024 ** 2
+
+def chunksize_for_ceiling(path, columns=None, memory_ceiling_mb=DEFAULT_MEMORY_CEILING_MB):
+    bytes_per_row, _ = estimate_table_bytes(path, columns)
+    if not bytes_per_row:
+        return MIN_CHUNKSIZE
+    rows = int(memory_ceiling_mb * 1024 ** 2 * CHUNK_SHARE / (bytes_per_row * IN_MEMORY_OVERHEAD))
+    return max(rows, MIN_CHUNKSIZE)
+
+# -----------------------
+# Pass 1: per-sample totals
+# -----------------------
+def chunked_sample_totals(path, filters=None, chunksize=MIN_CHUNKSIZE,
+                          abundance_col='abundance', sample_col='sample_id'):
+    filters = _normalise_filters(filters)
+    sample_filters = {c: v for c, v in filters.items() if c in SAMPLE_LEVEL_FILTERS}
+    wanted = {abundance_col, sample_col} | set(sample_filters)
+
+    totals = None
+    for chunk in _read_chunks(path, wanted, sample_filters, chunksize):
+        chunk = apply_row_filters(chunk, sample_filters)
+        partial = chunk.groupby(sample_col, sort=False)[abundance_col].sum()
+        totals = partial if totals is None else totals.add(partial, fill_value=0)
+    return totals if totals is not None else pd.Series(dtype=float)
+
+# -----------------------
+# Pass 2: stream normalised rows into partial aggregates
+# -----------------------
+def chunked_aggregates(path, filters=None, chunksize=MIN_CHUNKSIZE,
+                       species=True, peptides=True, peptide_species=False, partials=False,
+                       abundance_col='abundance', sample_col='sample_id'):
+    """
+    Out-of-core equivalent of read_long_table(with_rpk=True) followed by
+    species_by_sample and calculate_mean_rpk_difference. Only one chunk and
+    the running (species x sample) / (peptide x condition) sums and counts are
+    held in memory at a time.
+
+    Returns a dict with 'species_by_sample', 'mean_diff' and 'peptides'
+    (pep_id, pep_aa, plus taxon_species with `peptide_species`) for the
+    requested outputs. With `partials`, the running sums and counts are
+    returned too ('species_sums', 'peptide_sums'; see sum_count_partial).
+    """
+    filters = _normalise_filters(filters)
+    totals = chunked_sample_totals(path, filters, chunksize, abundance_col, sample_col)
+
+    sample_filters = {c: v for c, v in filters.items() if c in SAMPLE_LEVEL_FILTERS}
+    row_filters = {c: v for c, v in filters.items() if c not in SAMPLE_LEVEL_FILTERS}
+    wanted = set(filters) | {abundance_col, sample_col}
+    if species:
+        wanted |= set(SPECIES_COLUMNS)
+    peptide_columns = ['pep_id', 'pep_aa'] + (['taxon_species'] if peptide_species else [])
+    if peptides:
+        wanted |= set(ANTIGEN_MAP_COLUMNS) | set(peptide_columns)
+
+    species_sums = peptide_sums = None
+    peptide_seqs = []
+    for chunk in _read_chunks(path, wanted, filters, chunksize):
+        chunk = apply_row_filters(chunk, sample_filters)
+        chunk = apply_row_filters(chunk, row_filters)
+        if chunk.empty:
+            continue
+        chunk = chunk.assign(rpk=chunk[abundance_col] / chunk[sample_col].map(totals).astype(float) * 1e5)
+
+        if species:
+            species_sums = _add_partial(species_sums, sum_count_partial(chunk, ['taxon_species', sample_col]))
+        if peptides:
+            peptide_sums = _add_partial(peptide_sums, sum_count_partial(chunk, ['pep_id', 'Condition']))
+            peptide_seqs.append(chunk[peptide_columns].drop_duplicates(subset=['pep_id']))
+
+    result = {}
+    if species:
+        result['species_by_sample'] = species_matrix_from_sums(species_sums, sample_col)
+    if peptides:
+        result['mean_diff'] = mean_diff_from_sums(peptide_sums)
+        if peptide_seqs:
+            result['peptides'] = pd.concat(peptide_seqs, ignore_index=True).drop_duplicates(subset=['pep_id'])
+        else:
+            result['peptides'] = pd.DataFrame(columns=peptide_columns)
+    if partials:
+        result['species_sums'] = species_sums if species_sums is not None else empty_partial(['taxon_species', sample_col])
+        result['peptide_sums'] = peptide_sums if peptide_sums is not None else empty_partial(['pep_id', 'Condition'])
+    return result
+
+# -----------------------
+# Additive (sum, count) partials and the results built from them
+# -----------------------
+# Means are sum / count, so partials from chunks (or from separate uploads)
+# combine exactly by adding them before dividing.
+def sum_count_partial(df, keys, value_col='rpk'):
+    """DataFrame of `value_col` sum and row count per `keys`, on a plain (non-categorical) index."""
+    partial = df.groupby(keys, observed=True, sort=False)[value_col].agg(['sum', 'count'])
+    partial.index = pd.MultiIndex.from_arrays(
+        [np.asarray(partial.index.get_level_values(i)) for i in range(len(keys))], names=keys)
+    return partial
+
+def empty_partial(keys):
+    return pd.DataFrame({'sum': pd.Series(dtype=float), 'count': pd.Series(dtype=np.int64)},
+                        index=pd.MultiIndex.from_arrays([[] for _ in keys], names=keys))
+
+def species_matrix_from_sums(species_sums, sample_col='sample_id'):
+    """Mean RPK species x sample from (taxon_species, sample) partials, as species_by_sample."""
+    if species_sums is None or species_sums.empty:
+        return pd.DataFrame()
+    means = species_sums['sum'] / species_sums['count']
+    matrix = means.unstack(sample_col, fill_value=0)
+    return plain_axes(matrix).sort_index().sort_index(axis=1)
+
+def mean_diff_from_sums(peptide_sums):
+    """Case/Control mean RPK difference from (pep_id, Condition) partials, as calculate_mean_rpk_difference."""
+    if peptide_sums is None or peptide_sums.empty:
+        return pd.DataFrame(columns=['pep_id', 'mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference'])
+    means = (peptide_sums['sum'] / peptide_sums['count']).sort_index()
+    return mean_rpk_difference_from_means(means)
+
+def _add_partial(running, partial):
+    if running is None:
+        return partial
+    return running.add(partial, fill_value=0)
+
+def _normalise_filters(filters):
+    return {col: set(map(str, values)) for col, values in (filters or {}).items() if values}
+
+def _read_chunks(path, wanted, filters, chunksize):
+    return pd.read_csv(path, sep=sniff_delimiter(path), usecols=lambda c: c in wanted,
+                       chunksize=chunksize, dtype={c: str for c in filters})
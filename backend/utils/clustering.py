@@ -0,0 +1,64 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage, leaves_list
+from scipy.spatial.distance import pdist
+
+# -----------------------
+# Hierarchical clustering order for heatmaps
+# -----------------------
+CLUSTER_AXES = ("samples", "species", "both")
+CLUSTER_METRICS = ("euclidean", "correlation", "cosine", "cityblock", "braycurtis")
+CLUSTER_METHODS = ("average", "complete", "single", "weighted", "ward")
+EUCLIDEAN_ONLY_METHODS = ("ward",)
+
+def validate_cluster_options(axis, metric="euclidean", method="average"):
+    if axis not in CLUSTER_AXES:
+        raise ValueError(f"cluster must be one of {', '.join(CLUSTER_AXES)}")
+    if metric not in CLUSTER_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(CLUSTER_METRICS)}")
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"method must be one of {', '.join(CLUSTER_METHODS)}")
+    if method in EUCLIDEAN_ONLY_METHODS and metric != "euclidean":
+        raise ValueError(f"method '{method}' requires the euclidean metric")
+
+def normalise_for_clustering(values):
+    # RPK is heavy-tailed; log1p keeps a few hot samples from dominating distances
+    return np.log1p(np.clip(np.asarray(values, dtype=np.float64), 0, None))
+
+def cluster_linkage(values, metric="euclidean", method="average"):
+    """
+    SciPy linkage matrix over the rows of `values` (None for fewer than two
+    rows). Condensed distances are computed once; SciPy then uses the
+    nearest-neighbour chain (average/complete/weighted/ward) or MST (single)
+    algorithm, O(n^2) in time and memory.
+    """
+    if len(values) < 2:
+        return None
+    distances = pdist(values, metric=metric)
+    # Constant rows have undefined correlation/cosine distance: treat them as far apart
+    if not np.isfinite(distances).all():
+        finite = distances[np.isfinite(distances)]
+        distances = np.where(np.isfinite(distances), distances, finite.max() if len(finite) else 1.0)
+    return linkage(distances, method=method)
+
+def leaf_order(Z, n):
+    return leaves_list(Z) if Z is not None else np.arange(n)
+
+def clustered_order(heatmap_data, axis="samples", metric="euclidean", method="average"):
+    """
+    Species and sample orders (labels) for a species x samples matrix, with
+    the non-clustered axis left as given. Also returns the linkage matrices
+    (None for an axis that was not clustered) so the frontend can draw dendrograms.
+    """
+    validate_cluster_options(axis, metric, method)
+    values = normalise_for_clustering(heatmap_data.values)
+    species_Z = sample_Z = None
+    if axis in ("species", "both"):
+        species_Z = cluster_linkage(values, metric, method)
+    if axis in ("samples", "both"):
+        sample_Z = cluster_linkage(values.T, metric, method)
+    return {
+        "species": [heatmap_data.index[i] for i in leaf_order(species_Z, len(heatmap_data.index))],
+        "samples": [heatmap_data.columns[i] for i in leaf_order(sample_Z, len(heatmap_data.columns))],
+        "species_linkage": species_Z,
+        "sample_linkage": sample_Z,
+    }
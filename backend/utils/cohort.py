@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.chunked import species_matrix_from_sums, mean_diff_from_sums
+from utils.antigen_profile import build_antigen_profile
+from utils.viruses.enterovirus import align_peptides
+
+DEFAULT_LOAD_WORKERS = 4
+
+# -----------------------
+# Workspace cohorts: many uploads merged into one
+# -----------------------
+# Each upload is reduced once to additive partials (RPK sums and row counts
+# per species x sample and per peptide x condition, see
+# visualisation.load_upload_partials). Merging a workspace only adds those
+# small tables and divides, so the result equals the means over every
+# upload's rows without re-reading them. RPK is normalised within each
+# upload, against that upload's sample totals. Samples are kept apart per
+# upload ("<upload_id>:<sample_id>"), so two uploads reusing a sample id are
+# two heatmap columns rather than one averaged column; peptides are shared.
+def load_concurrently(load, items, max_workers=DEFAULT_LOAD_WORKERS):
+    """[load(item) for item in items], at most `max_workers` at a time."""
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [load(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(load, items))
+
+def merge_partials(partials):
+    """
+    Species x sample matrix, Case/Control mean differences and unique
+    peptides of several uploads' partials ({upload_id: partials}) combined.
+    """
+    species_sums = _add_partials([namespace_samples(p["species_sums"], upload_id)
+                                  for upload_id, p in partials.items()])
+    peptide_sums = _add_partials([p["peptide_sums"] for p in partials.values()])
+    peptides = [p["peptides"] for p in partials.values() if not p["peptides"].empty]
+    return {
+        "species_matrix": species_matrix_from_sums(species_sums),
+        "mean_diff": mean_diff_from_sums(peptide_sums),
+        "peptides": (pd.concat(peptides, ignore_index=True).drop_duplicates(subset=['pep_id'])
+                     if peptides else pd.DataFrame(columns=['pep_id', 'pep_aa'])),
+    }
+
+def namespace_samples(species_sums, upload_id, sample_col='sample_id'):
+    """(taxon_species, sample) partials with samples renamed "<upload_id>:<sample_id>"."""
+    if species_sums.empty:
+        return species_sums
+    index = species_sums.index
+    samples = np.asarray(index.get_level_values(sample_col)).astype(str)
+    levels = [np.char.add(f"{upload_id}:", samples) if name == sample_col else index.get_level_values(name)
+              for name in index.names]
+    return species_sums.set_axis(pd.MultiIndex.from_arrays(levels, names=index.names), axis=0)
+
+def _add_partials(frames):
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    combined = pd.concat(frames)
+    return combined.groupby(level=list(range(combined.index.nlevels)), sort=False).sum()
+
+def cohort_antigen_profile(aggregates, diamond_db_path, preset, kmer_index=None):
+    """Antigen profile of merged cohort aggregates (one alignment of the union of peptides)."""
+    peptides = aggregates["peptides"][['pep_id', 'pep_aa']]
+    if peptides.empty:
+        return build_antigen_profile(pd.DataFrame(columns=['qseqid', 'sstart', 'send', 'mean_rpk_difference']))
+    hits = align_peptides(peptides, diamond_db_path, preset=preset, kmer_index=kmer_index)
+    merged = hits.merge(aggregates["mean_diff"], left_on='qseqid', right_on='pep_id', how='left')
+    merged['sstart'] = merged['sstart'].astype(int)
+    merged['send'] = merged['send'].astype(int)
+    return build_antigen_profile(merged)
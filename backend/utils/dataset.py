@@ -0,0 +1,197 @@
+import csv
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals, is_integer_dtype, is_object_dtype, is_string_dtype
+
+from utils.sharding import should_shard, sharded_compute_rpk, sharded_group_mean
+
+# -----------------------
+# Column sets needed by each graph
+# -----------------------
+SPECIES_COLUMNS = ['taxon_species', 'sample_id', 'abundance']
+ANTIGEN_MAP_COLUMNS = ['pep_id', 'pep_aa', 'sample_id', 'abundance', 'Condition']
+PEPTIDE_MATRIX_COLUMNS = ['pep_id', 'sample_id', 'abundance', 'Condition', 'taxon_species']
+
+# Filters that select whole samples (safe to apply before RPK normalisation)
+SAMPLE_LEVEL_FILTERS = {'sample_id', 'Condition'}
+
+# Repeated string columns that are dictionary-encoded in memory
+CATEGORICAL_COLUMNS = ['sample_id', 'taxon_species', 'pep_id', 'pep_aa', 'Condition']
+
+READ_CHUNKSIZE = 250_000
+
+# -----------------------
+# Helper: detect delimiter from the first lines (comma if undecidable)
+# -----------------------
+SNIFF_LINES = 5
+SNIFF_DELIMITERS = ',\t;|'
+
+def sniff_delimiter(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        sample = ''.join(line for _, line in zip(range(SNIFF_LINES), f))
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=SNIFF_DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+# -----------------------
+# Helper: build row filters from request args / PDF payload
+# -----------------------
+def build_row_filters(samples=None, species=None, conditions=None):
+    filters = {}
+    if samples:
+        filters['sample_id'] = list(samples)
+    if species:
+        filters['taxon_species'] = list(species)
+    if conditions:
+        filters['Condition'] = list(conditions)
+    return filters
+
+# -----------------------
+# Column- and row-aware reader for long-format uploads
+# -----------------------
+def read_long_table(path, columns=None, filters=None, with_rpk=False,
+                    abundance_col='abundance', sample_col='sample_id',
+                    chunksize=READ_CHUNKSIZE, compact=True):
+    """
+    Read only `columns` (plus any filter columns) from an upload and apply
+    `filters` ({column: allowed values}) chunk by chunk while parsing.
+
+    When `with_rpk` is set, per-sample totals are accumulated before any
+    row-level filter (e.g. species) is applied, so RPK matches the value
+    computed on the unfiltered table. With `compact`, each chunk is
+    dictionary-encoded as soon as it is parsed (see compact_long_df).
+    """
+    filters = {col: set(map(str, values)) for col, values in (filters or {}).items() if values}
+    wanted = list(columns) if columns else None
+    if wanted is not None:
+        extra = list(filters)
+        if with_rpk:
+            extra += [abundance_col, sample_col]
+        wanted += [c for c in extra if c not in wanted]
+
+    sep = sniff_delimiter(path)
+    usecols = (lambda c: c in wanted) if wanted is not None else None
+    reader = pd.read_csv(path, sep=sep, usecols=usecols, chunksize=chunksize,
+                         dtype={c: str for c in filters})
+
+    sample_filters = {c: v for c, v in filters.items() if c in SAMPLE_LEVEL_FILTERS}
+    row_filters = {c: v for c, v in filters.items() if c not in SAMPLE_LEVEL_FILTERS}
+
+    parts = []
+    totals = []
+    for chunk in reader:
+        chunk = apply_row_filters(chunk, sample_filters)
+        if with_rpk and not chunk.empty:
+            totals.append(chunk.groupby(sample_col)[abundance_col].sum())
+        chunk = apply_row_filters(chunk, row_filters)
+        if not chunk.empty:
+            parts.append(compact_long_df(chunk) if compact else chunk)
+
+    if parts:
+        df = concat_compact(parts) if compact else pd.concat(parts, ignore_index=True)
+    else:
+        df = pd.read_csv(path, sep=sep, usecols=usecols, nrows=0)
+
+    if with_rpk:
+        sample_totals = pd.concat(totals).groupby(level=0).sum() if totals else pd.Series(dtype=float)
+        totals_per_row = df[sample_col].map(sample_totals).astype(float)
+        df['rpk'] = df[abundance_col] / totals_per_row * 1e5
+    return df
+
+def apply_row_filters(chunk, filters):
+    for col, allowed in filters.items():
+        if col not in chunk.columns:
+            raise ValueError(f"Cannot filter on missing column '{col}'")
+        chunk = chunk[chunk[col].astype(str).isin(allowed)]
+    return chunk
+
+# -----------------------
+# Compact in-memory representation
+# -----------------------
+def compact_long_df(df, categorical_columns=CATEGORICAL_COLUMNS):
+    """
+    Dictionary-encode repeated string columns as categoricals and downcast
+    integer columns. Float columns (e.g. rpk) stay float64 so means and sums
+    match the uncompacted table exactly.
+    """
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if col in categorical_columns:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[col] = series.astype('category')
+        elif is_integer_dtype(series.dtype):
+            kind = 'unsigned' if len(series) and series.min() >= 0 else 'integer'
+            df[col] = pd.to_numeric(series, downcast=kind)
+        elif is_object_dtype(series.dtype) or is_string_dtype(series.dtype):
+            # Repeated strings outside the known set: encode when it pays off
+            if len(series) and series.nunique(dropna=False) <= len(series) // 2:
+                df[col] = series.astype('category')
+    return df
+
+def concat_compact(parts):
+    """Concatenate compacted chunks, unioning categories instead of falling back to object."""
+    if len(parts) == 1:
+        return parts[0].reset_index(drop=True)
+    columns = {}
+    for col in parts[0].columns:
+        pieces = [p[col] for p in parts]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in pieces):
+            columns[col] = pd.Series(union_categoricals(pieces), name=col)
+        else:
+            combined = pd.concat(pieces, ignore_index=True)
+            if all(is_integer_dtype(p.dtype) for p in pieces):
+                kind = 'unsigned' if combined.min() >= 0 else 'integer'
+                combined = pd.to_numeric(combined, downcast=kind)
+            columns[col] = combined
+    return pd.DataFrame(columns)
+
+def memory_usage_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+# -----------------------
+# Aggregation helpers (work on object or categorical columns)
+# -----------------------
+def compute_rpk(df, abundance_col='abundance', sample_col='sample_id'):
+    if should_shard(len(df)):
+        return sharded_compute_rpk(df, abundance_col, sample_col)
+    df = df.copy()
+    totals = df.groupby(sample_col, observed=True)[abundance_col].transform('sum').astype(float)
+    df['rpk'] = df[abundance_col] / totals * 1e5
+    return df
+
+def species_by_sample(df, value_col='rpk'):
+    """Mean RPK per species (rows) x sample (columns), zero-filled."""
+    if should_shard(len(df)):
+        grouped = sharded_group_mean(df, 'sample_id', 'taxon_species', value_col).swaplevel()
+    else:
+        grouped = df.groupby(['taxon_species', 'sample_id'], observed=True)[value_col].mean()
+    matrix = grouped.unstack('sample_id', fill_value=0)
+    return plain_axes(matrix).sort_index().sort_index(axis=1)
+
+def species_heatmap_matrix(df, top_n_species=20):
+    return top_species_heatmap(species_by_sample(df), top_n_species)
+
+def species_barplot_matrix(df, top_n_species=10, sort_species=True):
+    return top_species_barplot(species_by_sample(df), top_n_species, sort_species)
+
+def top_species_heatmap(matrix, top_n_species=20):
+    """Top species (rows) by total RPK, samples sorted, from a species_by_sample matrix."""
+    top_species = matrix.sum(axis=1).nlargest(top_n_species).index
+    heatmap_data = matrix.loc[top_species]
+    return heatmap_data[sorted(heatmap_data.columns)]
+
+def top_species_barplot(matrix, top_n_species=10, sort_species=True):
+    """Samples (rows) x top species (columns) from a species_by_sample matrix."""
+    pivot_df = matrix.T
+    top_species = pivot_df.sum(axis=0).nlargest(top_n_species).index
+    pivot_df = pivot_df[top_species]
+    return pivot_df.sort_index(axis=1) if sort_species else pivot_df
+
+def plain_axes(df):
+    # Categorical axes break column insertion and JSON encoding downstream
+    df.index = pd.Index(np.asarray(df.index), name=df.index.name)
+    df.columns = pd.Index(np.asarray(df.columns), name=df.columns.name)
+    return df
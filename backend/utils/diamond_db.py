@@ -0,0 +1,157 @@
+"""
+Build DIAMOND databases for every reference FASTA under data/, rebuilding
+only those whose FASTA checksum changed since the last build.
+
+Run from backend/:  python -m utils.diamond_db [--force] [--only REF_ID ...]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+FASTA_EXTENSIONS = (".fasta", ".fa", ".faa")
+MANIFEST_NAME = "manifest.json"
+
+# -----------------------
+# Manifest
+# -----------------------
+# data/blast_databases/manifest.json, one entry per reference id:
+#   {"fasta": "coxsackievirusB1_P08291.fasta", "sha256": ..., "version": 3,
+#    "db": "coxsackievirusB1_P08291_db.dmnd", "diamond_version": "2.1.14",
+#    "built_at": "2025-...Z"}
+# Paths are relative to data/ and data/blast_databases/ respectively.
+def db_folder(data_dir):
+    return os.path.join(data_dir, "blast_databases")
+
+def manifest_path(data_dir):
+    return os.path.join(db_folder(data_dir), MANIFEST_NAME)
+
+def load_manifest(data_dir):
+    try:
+        with open(manifest_path(data_dir)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(data_dir, manifest):
+    path = manifest_path(data_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+def db_version(entry):
+    """Short version tag for cache keys, e.g. '3-1a2b3c4d5e6f'; '' if never built."""
+    if not entry:
+        return ""
+    return f"{entry['version']}-{entry['sha256'][:12]}"
+
+# -----------------------
+# Checksums / discovery
+# -----------------------
+def fasta_checksum(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def find_reference_fastas(data_dir):
+    """{ref_id: fasta path} for FASTAs directly under data_dir."""
+    fastas = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "*"))):
+        stem, ext = os.path.splitext(os.path.basename(path))
+        if ext.lower() in FASTA_EXTENSIONS:
+            fastas[stem] = path
+    return fastas
+
+def db_filename(ref_id):
+    return f"{ref_id}_db.dmnd"
+
+# -----------------------
+# Build
+# -----------------------
+def diamond_version(diamond="diamond"):
+    try:
+        out = subprocess.run([diamond, "version"], check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.strip().split()[-1] if out.strip() else None
+
+def needs_build(entry, checksum, db_path):
+    return entry is None or entry.get("sha256") != checksum or not os.path.exists(db_path)
+
+def run_makedb(fasta_path, db_path, diamond="diamond", threads=None):
+    # Build under a temporary name, then swap in so running alignments never see a partial db
+    tmp_prefix = f"{db_path[:-len('.dmnd')]}.building"
+    cmd = [diamond, "makedb", "--in", fasta_path, "--db", tmp_prefix]
+    if threads:
+        cmd += ["--threads", str(threads)]
+    try:
+        subprocess.run(cmd, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"diamond makedb failed for {fasta_path}: {e}") from e
+    os.replace(f"{tmp_prefix}.dmnd", db_path)
+
+def build_reference_databases(data_dir, force=False, only=None, diamond="diamond", threads=None):
+    """
+    Run `diamond makedb` for each reference FASTA whose checksum changed (or
+    whose db is missing), bumping its manifest version. Returns the ids built.
+    """
+    manifest = load_manifest(data_dir)
+    os.makedirs(db_folder(data_dir), exist_ok=True)
+    version_string = None
+    built = []
+
+    for ref_id, fasta_path in find_reference_fastas(data_dir).items():
+        if only and ref_id not in only:
+            continue
+        entry = manifest.get(ref_id)
+        checksum = fasta_checksum(fasta_path)
+        db_path = os.path.join(db_folder(data_dir), db_filename(ref_id))
+        if not force and not needs_build(entry, checksum, db_path):
+            logger.info("%s: up to date (version %s)", ref_id, entry["version"])
+            continue
+
+        if version_string is None:
+            version_string = diamond_version(diamond) or "unknown"
+        logger.info("%s: building %s", ref_id, db_filename(ref_id))
+        run_makedb(fasta_path, db_path, diamond=diamond, threads=threads)
+        manifest[ref_id] = {
+            "fasta": os.path.basename(fasta_path),
+            "sha256": checksum,
+            "version": (entry or {}).get("version", 0) + 1,
+            "db": db_filename(ref_id),
+            "diamond_version": version_string,
+            "built_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        # Saved after every build so a failure later on keeps earlier results
+        save_manifest(data_dir, manifest)
+        built.append(ref_id)
+    return built
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"))
+    parser.add_argument("--force", action="store_true", help="rebuild even if checksums match")
+    parser.add_argument("--only", nargs="+", help="reference ids to consider")
+    parser.add_argument("--diamond", default="diamond", help="diamond executable")
+    parser.add_argument("--threads", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    built = build_reference_databases(args.data_dir, force=args.force, only=args.only,
+                                      diamond=args.diamond, threads=args.threads)
+    print(f"Built {len(built)} database(s): {', '.join(built) or 'none'}")
+
+if __name__ == "__main__":
+    main()
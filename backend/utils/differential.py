@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import t as t_dist, norm, rankdata, false_discovery_control
+
+from utils.permutation import sample_contrast
+
+DIFFERENTIAL_COLUMNS = [
+    'pep_id', 'taxon_species', 'mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference',
+    'log2_fold_change', 'welch_t', 'welch_p', 'welch_q', 'mannwhitney_u', 'mannwhitney_p', 'mannwhitney_q',
+]
+RANK_BLOCK_ROWS = 8192  # peptides ranked at once for Mann-Whitney (dense block of rows x samples)
+
+# -----------------------
+# Per-peptide Case vs Control tests
+# -----------------------
+# Every peptide is tested at once on the PeptideSampleMatrix behind
+# calculate_mean_rpk_difference. Group sums and sums of squares are two
+# sparse products; Mann-Whitney ranks dense blocks of rows. A missing
+# (peptide, sample) row counts as RPK 0 (as in utils/permutation.py); on
+# complete tables the means equal mean_difference().
+def welch_t_test(sum1, sumsq1, n1, sum2, sumsq2, n2):
+    """Vectorised Welch t statistic and two-sided p-value from group sums."""
+    mean1, mean2 = sum1 / n1, sum2 / n2
+    var1 = np.maximum(sumsq1 - n1 * mean1 ** 2, 0) / (n1 - 1)
+    var2 = np.maximum(sumsq2 - n2 * mean2 ** 2, 0) / (n2 - 1)
+    se1, se2 = var1 / n1, var2 / n2
+    se = np.sqrt(se1 + se2)
+    diff = mean1 - mean2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = diff / se
+        df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        p = 2 * t_dist.sf(np.abs(t), df)
+    # Both groups constant: equal means are no evidence, different means are certain
+    flat = se == 0
+    t[flat & (diff == 0)] = 0.0
+    p[flat] = np.where(diff[flat] == 0, 1.0, 0.0)
+    return t, p
+
+def mann_whitney_u(values, n1):
+    """
+    U statistic of the first `n1` columns vs the rest for each row, with the
+    two-sided normal approximation (tie and continuity corrected, as
+    scipy.stats.mannwhitneyu(method='asymptotic')).
+    """
+    n_rows, n = values.shape
+    n2 = n - n1
+    ranks = rankdata(values, axis=1)
+    u1 = ranks[:, :n1].sum(axis=1) - n1 * (n1 + 1) / 2
+
+    # Tie correction: sum of (t^3 - t) over runs of equal values in each row
+    ordered = np.sort(values, axis=1)
+    starts = np.ones_like(ordered, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run_ids = np.cumsum(starts.ravel()) - 1
+    run_sizes = np.bincount(run_ids).astype(np.float64)
+    run_rows = np.repeat(np.arange(n_rows), starts.sum(axis=1))
+    ties = np.bincount(run_rows, weights=run_sizes ** 3 - run_sizes, minlength=n_rows)
+
+    mu = n1 * n2 / 2
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = (u - mu - 0.5) / sigma
+        p = np.clip(2 * norm.sf(z), 0, 1)
+    p[sigma == 0] = 1.0
+    return u1, p
+
+def differential_stats(matrix, case='Case', control='Control', pseudocount=1.0,
+                       block_rows=RANK_BLOCK_ROWS):
+    """
+    One row per peptide: Case/Control means, log2 fold change (with
+    `pseudocount` RPK), Welch t and Mann-Whitney U with p-values and BH q-values.
+    """
+    contrast = sample_contrast(matrix, case, control)
+    case_cols, control_cols = np.flatnonzero(contrast > 0), np.flatnonzero(contrast < 0)
+    n1, n2 = len(case_cols), len(control_cols)
+    if n1 < 2 or n2 < 2:
+        raise ValueError(f"Differential tests need at least two '{case}' and two '{control}' samples")
+
+    values = matrix.matrix.tocsc()
+    ordered = values[:, np.concatenate([case_cols, control_cols])].tocsr()
+    indicator = sparse.csr_matrix(
+        (np.ones(n1 + n2), (np.arange(n1 + n2), np.r_[np.zeros(n1, dtype=int), np.ones(n2, dtype=int)])),
+        shape=(n1 + n2, 2)
+    )
+    sums = np.asarray((ordered @ indicator).todense())
+    sumsq = np.asarray((ordered.multiply(ordered) @ indicator).todense())
+
+    mean_case, mean_control = sums[:, 0] / n1, sums[:, 1] / n2
+    welch_t, welch_p = welch_t_test(sums[:, 0], sumsq[:, 0], n1, sums[:, 1], sumsq[:, 1], n2)
+
+    n_peptides = ordered.shape[0]
+    mw_u, mw_p = np.empty(n_peptides), np.empty(n_peptides)
+    for start in range(0, n_peptides, block_rows):
+        block = ordered[start:start + block_rows].toarray()
+        mw_u[start:start + block_rows], mw_p[start:start + block_rows] = mann_whitney_u(block, n1)
+
+    species = np.full(n_peptides, None, dtype=object)
+    if matrix.peptide_species is not None:
+        has_species = matrix.peptide_species >= 0
+        species[has_species] = matrix.species[matrix.peptide_species[has_species]]
+    return pd.DataFrame({
+        'pep_id': matrix.peptides,
+        'taxon_species': species,
+        'mean_rpk_case': mean_case,
+        'mean_rpk_control': mean_control,
+        'mean_rpk_difference': mean_case - mean_control,
+        'log2_fold_change': np.log2((mean_case + pseudocount) / (mean_control + pseudocount)),
+        'welch_t': welch_t,
+        'welch_p': welch_p,
+        'welch_q': false_discovery_control(welch_p, method='bh') if n_peptides else welch_p,
+        'mannwhitney_u': mw_u,
+        'mannwhitney_p': mw_p,
+        'mannwhitney_q': false_discovery_control(mw_p, method='bh') if n_peptides else mw_p,
+    }, columns=DIFFERENTIAL_COLUMNS)
+
+def sort_and_page(stats, sort='welch_p', ascending=True, page=1, page_size=100):
+    """(rows of one page, total rows); NaNs sort last in either direction."""
+    if sort not in stats.columns:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    ordered = stats.sort_values(sort, ascending=ascending, na_position='last', kind='stable')
+    start = (page - 1) * page_size
+    return ordered.iloc[start:start + page_size], len(ordered)
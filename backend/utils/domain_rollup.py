@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# -----------------------
+# Peptide -> domain interval join
+# -----------------------
+def assign_domains(hits_df, ev_df):
+    """
+    Every (peptide, domain) pair whose intervals overlap, with the overlap
+    length in residues. Domains are sorted and non-overlapping, so each hit's
+    first and last domain come from two searchsorted calls and the pairs are
+    expanded with np.repeat: no per-row loop.
+    """
+    hits = hits_df.drop_duplicates(subset=['qseqid'])
+    domains = ev_df.sort_values('start').reset_index(drop=True)
+    d_start = domains['start'].to_numpy(np.int64)
+    d_end = domains['end'].to_numpy(np.int64)
+    h_start = hits['sstart'].to_numpy(np.int64)
+    h_end = hits['send'].to_numpy(np.int64)
+
+    first = np.searchsorted(d_end, h_start, side='left')
+    last = np.searchsorted(d_start, h_end, side='right') - 1
+    n_domains = np.maximum(last - first + 1, 0)
+
+    hit_idx = np.repeat(np.arange(len(hits)), n_domains)
+    # Offsets 0..n-1 within each hit's run of domains
+    run_starts = np.repeat(np.cumsum(n_domains) - n_domains, n_domains)
+    dom_idx = np.repeat(first, n_domains) + np.arange(len(hit_idx)) - run_starts
+
+    overlap = (np.minimum(h_end[hit_idx], d_end[dom_idx])
+               - np.maximum(h_start[hit_idx], d_start[dom_idx]) + 1)
+    return pd.DataFrame({
+        'pep_id': hits['qseqid'].astype(str).to_numpy()[hit_idx],
+        'ev_proteins': domains['ev_proteins'].to_numpy()[dom_idx],
+        'domain_start': d_start[dom_idx],
+        'domain_end': d_end[dom_idx],
+        'overlap': overlap,
+    })
+
+# -----------------------
+# Rollups
+# -----------------------
+def domain_condition_rollup(assignments, hits_df):
+    """Per domain: peptide count and mean of the peptides' Case/Control means and difference."""
+    values = hits_df.drop_duplicates(subset=['qseqid']).assign(pep_id=lambda d: d['qseqid'].astype(str))
+    joined = assignments.merge(
+        values[['pep_id', 'mean_rpk_case', 'mean_rpk_control', 'mean_rpk_difference']],
+        on='pep_id', how='left'
+    )
+    rollup = joined.groupby(['ev_proteins', 'domain_start', 'domain_end'], sort=False).agg(
+        n_peptides=('pep_id', 'nunique'),
+        mean_rpk_case=('mean_rpk_case', 'mean'),
+        mean_rpk_control=('mean_rpk_control', 'mean'),
+        mean_rpk_difference=('mean_rpk_difference', 'mean'),
+    ).reset_index()
+    return rollup.sort_values('domain_start').reset_index(drop=True)
+
+def domain_sample_rollup(assignments, matrix):
+    """
+    Mean RPK of each domain's peptides per sample, from a PeptideSampleMatrix
+    (peptides absent from a sample count as 0). Long format with Condition.
+    """
+    assignments = assignments.sort_values('domain_start', kind='stable')
+    lookup = pd.Index(np.asarray(matrix.peptides).astype(str))
+    rows = lookup.get_indexer(assignments['pep_id'])
+    known = rows >= 0
+    domain_codes, domain_labels = pd.factorize(assignments['ev_proteins'][known], sort=False)
+
+    membership = sparse.csr_matrix(
+        (np.ones(known.sum()), (domain_codes, rows[known])),
+        shape=(len(domain_labels), len(lookup))
+    )
+    sizes = np.asarray(membership.sum(axis=1)).ravel()
+    sums = (membership @ matrix.matrix).toarray()
+    means = sums / np.maximum(sizes, 1)[:, None]
+
+    conditions = np.full(len(matrix.samples), None, dtype=object)
+    if matrix.sample_conditions is not None:
+        has_cond = matrix.sample_conditions >= 0
+        conditions[has_cond] = np.asarray(matrix.conditions)[matrix.sample_conditions[has_cond]]
+
+    return pd.DataFrame({
+        'ev_proteins': np.repeat(np.asarray(domain_labels), len(matrix.samples)),
+        'sample_id': np.tile(np.asarray(matrix.samples), len(domain_labels)),
+        'Condition': np.tile(conditions, len(domain_labels)),
+        'n_peptides': np.repeat(sizes.astype(np.int64), len(matrix.samples)),
+        'mean_rpk': means.ravel(),
+    })
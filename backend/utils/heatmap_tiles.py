@@ -0,0 +1,138 @@
+import io
+import math
+
+import numpy as np
+from matplotlib import colormaps
+from PIL import Image
+
+from utils.cache import cache_key, cache_get_bytes, cache_put_bytes, cache_file_path, cache_delete
+
+# -----------------------
+# Heatmap tile pyramid
+# -----------------------
+# The full species x sample matrix (species by total RPK, samples sorted) is
+# stored at every zoom level: the deepest level is the matrix itself, each
+# level above averages 2x2 blocks of the one below, and zoom 0 fits in a
+# single tile. A tile is TILE_SIZE x TILE_SIZE cells of one level, so each
+# request touches a bounded slice regardless of cohort size.
+TILE_SIZE = 256
+HEATMAP_CMAP = "viridis"
+
+def max_zoom_for(shape, tile_size=TILE_SIZE):
+    largest = max(shape) if len(shape) else 0
+    return max(int(math.ceil(math.log2(largest / tile_size))), 0) if largest else 0
+
+def _halve(sums, counts):
+    """Sum 2x2 blocks (padding odd edges), so means stay exact across levels."""
+    rows, cols = sums.shape
+    pad = ((0, rows % 2), (0, cols % 2))
+    sums, counts = np.pad(sums, pad), np.pad(counts, pad)
+    shape = (sums.shape[0] // 2, 2, sums.shape[1] // 2, 2)
+    return sums.reshape(shape).sum(axis=(1, 3)), counts.reshape(shape).sum(axis=(1, 3))
+
+def build_pyramid(matrix, tile_size=TILE_SIZE):
+    """List of float32 mean matrices, index = zoom (0 = coarsest)."""
+    values = matrix.to_numpy(dtype=np.float64)
+    observed = np.isfinite(values)
+    sums = np.where(observed, values, 0.0)
+    counts = observed.astype(np.int64)
+
+    levels = []
+    for _ in range(max_zoom_for(values.shape, tile_size) + 1):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            levels.append(np.where(counts > 0, sums / np.maximum(counts, 1), np.nan).astype(np.float32))
+        sums, counts = _halve(sums, counts)
+    return levels[::-1]
+
+def pyramid_meta(matrix, levels, tile_size=TILE_SIZE):
+    finite = levels[-1][np.isfinite(levels[-1])]
+    max_zoom = len(levels) - 1
+    return {
+        "tile_size": tile_size,
+        "max_zoom": max_zoom,
+        "shape": list(levels[-1].shape),
+        "vmin": float(finite.min()) if finite.size else 0.0,
+        "vmax": float(finite.max()) if finite.size else 0.0,
+        "cmap": HEATMAP_CMAP,
+        "levels": [
+            {
+                "zoom": z,
+                "rows": int(level.shape[0]),
+                "cols": int(level.shape[1]),
+                "cells_per_tile_cell": 2 ** (max_zoom - z),
+                "tiles_x": int(math.ceil(level.shape[1] / tile_size)) or 1,
+                "tiles_y": int(math.ceil(level.shape[0] / tile_size)) or 1,
+            }
+            for z, level in enumerate(levels)
+        ],
+        "species": [str(s) for s in matrix.index],
+        "samples": [str(s) for s in matrix.columns],
+    }
+
+# -----------------------
+# Cache: one .npy entry per level (memory-mapped on read) + meta
+# -----------------------
+def _level_key(version_key, zoom):
+    return cache_key(version_key, "heatmap_level", zoom)
+
+def store_pyramid(folder, version_key, matrix, tile_size=TILE_SIZE):
+    levels = build_pyramid(matrix, tile_size)
+    for zoom, level in enumerate(levels):
+        buf = io.BytesIO()
+        np.save(buf, level)
+        cache_put_bytes(folder, _level_key(version_key, zoom), buf.getvalue())
+    meta = pyramid_meta(matrix, levels, tile_size)
+    # Meta is written last: its presence marks a complete pyramid
+    cache_put_bytes(folder, cache_key(version_key, "heatmap_meta"), b"", meta=meta)
+    return meta
+
+def load_pyramid_meta(folder, version_key):
+    _, meta = cache_get_bytes(folder, cache_key(version_key, "heatmap_meta"))
+    return meta
+
+def drop_pyramid_meta(folder, version_key):
+    # Marks the pyramid incomplete, e.g. after one of its levels was evicted
+    cache_delete(folder, cache_key(version_key, "heatmap_meta"))
+
+def load_level(folder, version_key, zoom):
+    path = cache_file_path(folder, _level_key(version_key, zoom))
+    try:
+        return np.load(path, mmap_mode='r') if path else None
+    except FileNotFoundError:  # evicted since the lookup
+        return None
+
+# -----------------------
+# Tiles
+# -----------------------
+def tile_bounds(meta, zoom, x, y):
+    """(row0, row1, col0, col1) of a tile within its level; ValueError if out of range."""
+    if not 0 <= zoom <= meta["max_zoom"]:
+        raise ValueError(f"zoom must be between 0 and {meta['max_zoom']}")
+    level = meta["levels"][zoom]
+    if not (0 <= x < level["tiles_x"] and 0 <= y < level["tiles_y"]):
+        raise ValueError(f"tile ({x}, {y}) is outside zoom {zoom}")
+    size = meta["tile_size"]
+    return (y * size, min((y + 1) * size, level["rows"]),
+            x * size, min((x + 1) * size, level["cols"]))
+
+def tile_labels(labels, start, end, step):
+    """Axis labels for aggregated cells: the single label, or 'first – last' of each block."""
+    out = []
+    for i in range(start, end):
+        block = labels[i * step:(i + 1) * step]
+        out.append(block[0] if len(block) == 1 else f"{block[0]} – {block[-1]}")
+    return out
+
+def render_tile_png(values, meta):
+    """Colour a tile slice with the pyramid-wide scale; padded to a full tile, NaN transparent."""
+    size = meta["tile_size"]
+    vmin, vmax = meta["vmin"], meta["vmax"]
+    scaled = (np.asarray(values, dtype=np.float64) - vmin) / ((vmax - vmin) or 1.0)
+    rgba = colormaps[meta["cmap"]](np.clip(scaled, 0, 1), bytes=True)
+    rgba[~np.isfinite(values)] = 0
+
+    tile = np.zeros((size, size, 4), dtype=np.uint8)
+    tile[:rgba.shape[0], :rgba.shape[1]] = rgba
+    buf = io.BytesIO()
+    Image.fromarray(tile).save(buf, format="PNG", optimize=False)
+    return buf.getvalue()
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+# -----------------------
+# Sorted-endpoint index over aligned hits
+# -----------------------
+class HitIndex:
+    """
+    Index over (sstart, send) hits on the reference, one hit per peptide
+    (first hit, as in calculate_moving_sum).
+
+    Hits are sorted by start and, separately, by end, so how many hits touch
+    a residue or range is two binary searches. Listing them binary-searches
+    the start-sorted hits between `a - max_length + 1` and `b`; peptide hits
+    are short, so that window holds little more than the answer itself.
+    Per-residue depth and value sums are prefix-summed for O(1) range totals.
+    """
+
+    def __init__(self, peptides, sstart, send, values=None):
+        order = np.argsort(sstart, kind='stable')
+        self.peptides = np.asarray(peptides)[order]
+        self.sstart = np.asarray(sstart, dtype=np.int64)[order]
+        self.send = np.asarray(send, dtype=np.int64)[order]
+        self.values = (np.zeros(len(order)) if values is None
+                       else np.asarray(values, dtype=np.float64)[order])
+        self.sorted_ends = np.sort(self.send)
+        self.max_length = int((self.send - self.sstart).max()) + 1 if len(order) else 0
+
+        # Per-residue depth / value sums over [origin, last], with prefix sums
+        self.origin = int(self.sstart.min()) if len(order) else 0
+        last = int(self.send.max()) if len(order) else -1
+        n = max(last - self.origin + 1, 0)
+        lo, hi = self.sstart - self.origin, self.send - self.origin + 1
+        weights = np.nan_to_num(self.values)
+        self.depth = np.cumsum(np.bincount(lo, minlength=n + 1) - np.bincount(hi, minlength=n + 1))[:n]
+        self.value_sum = np.cumsum(np.bincount(lo, weights, minlength=n + 1)
+                                   - np.bincount(hi, weights, minlength=n + 1))[:n]
+        self._depth_prefix = np.concatenate([[0], np.cumsum(self.depth)])
+        self._value_prefix = np.concatenate([[0.0], np.cumsum(self.value_sum)])
+        self._covered_prefix = np.concatenate([[0], np.cumsum(self.depth > 0)])
+
+    @classmethod
+    def from_hits(cls, hits_df, value_column='mean_rpk_difference'):
+        unique = hits_df.drop_duplicates(subset=['qseqid'])
+        values = unique[value_column] if value_column in unique.columns else None
+        return cls(unique['qseqid'].astype(str), unique['sstart'], unique['send'], values)
+
+    def __len__(self):
+        return len(self.peptides)
+
+    # -----------------------
+    # Counts (two binary searches)
+    # -----------------------
+    def count_overlapping(self, a, b=None):
+        b = a if b is None else b
+        started = np.searchsorted(self.sstart, b, side='right')
+        ended_before = np.searchsorted(self.sorted_ends, a, side='left')
+        return int(started - ended_before)
+
+    # -----------------------
+    # Listings
+    # -----------------------
+    def query(self, a, b=None, mode='overlap'):
+        """
+        Hits touching residue `a` (or range [a, b]). mode='cover' keeps only hits
+        spanning the whole range, i.e. those counted by a moving-sum window.
+        """
+        b = a if b is None else b
+        if mode == 'cover':
+            lowest_start, highest_start, min_end = b - self.max_length + 1, a, b
+        else:
+            lowest_start, highest_start, min_end = a - self.max_length + 1, b, a
+        first = np.searchsorted(self.sstart, lowest_start, side='left')
+        stop = np.searchsorted(self.sstart, highest_start, side='right')
+        idx = np.arange(first, stop)
+        keep = self.send[idx] >= min_end
+        idx = idx[keep]
+        return pd.DataFrame({
+            'pep_id': self.peptides[idx],
+            'sstart': self.sstart[idx],
+            'send': self.send[idx],
+            'value': self.values[idx],
+        })
+
+    # -----------------------
+    # Per-residue coverage
+    # -----------------------
+    def _clip(self, a, b):
+        return max(a - self.origin, 0), min(b - self.origin + 1, len(self.depth))
+
+    def coverage(self, a=None, b=None):
+        """
+        Per-residue depth and summed value over [a, b], clamped to the indexed
+        span (default: the whole span).
+        """
+        span_end = self.origin + len(self.depth) - 1
+        a = self.origin if a is None else max(a, self.origin)
+        b = span_end if b is None else min(b, span_end)
+        positions = np.arange(a, b + 1)
+        depth = np.zeros(len(positions), dtype=np.int64)
+        value_sum = np.zeros(len(positions))
+        lo, hi = self._clip(a, b)
+        if hi > lo:
+            offset = lo + self.origin - a
+            depth[offset:offset + hi - lo] = self.depth[lo:hi]
+            value_sum[offset:offset + hi - lo] = self.value_sum[lo:hi]
+        return pd.DataFrame({'position': positions, 'depth': depth, 'value_sum': value_sum})
+
+    def range_totals(self, a, b):
+        """(sum of depth, covered residues, sum of value) over residues [a, b] in O(1)."""
+        lo, hi = self._clip(a, b)
+        if hi <= lo:
+            return 0, 0, 0.0
+        return (int(self._depth_prefix[hi] - self._depth_prefix[lo]),
+                int(self._covered_prefix[hi] - self._covered_prefix[lo]),
+                float(self._value_prefix[hi] - self._value_prefix[lo]))
+
+    # -----------------------
+    # Per-domain summary
+    # -----------------------
+    def domain_summary(self, ev_df):
+        """One row per domain in ev_df (ev_proteins, start, end)."""
+        rows = []
+        for domain in ev_df[['ev_proteins', 'start', 'end']].itertuples(index=False):
+            start, end = int(domain.start), int(domain.end)
+            length = end - start + 1
+            depth_total, covered, value_total = self.range_totals(start, end)
+            rows.append({
+                'ev_proteins': domain.ev_proteins,
+                'start': start,
+                'end': end,
+                'n_peptides': self.count_overlapping(start, end),
+                'mean_depth': depth_total / length if length > 0 else 0.0,
+                'covered_fraction': covered / length if length > 0 else 0.0,
+                'value_sum': value_total,
+                'value_per_residue': value_total / length if length > 0 else 0.0,
+            })
+        return pd.DataFrame(rows, columns=['ev_proteins', 'start', 'end', 'n_peptides', 'mean_depth',
+                                           'covered_fraction', 'value_sum', 'value_per_residue'])
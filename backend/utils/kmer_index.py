@@ -0,0 +1,148 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from utils.viruses.enterovirus import BLAST_COLUMNS
+
+# -----------------------
+# BLOSUM62 (ungapped scoring of near-exact placements)
+# -----------------------
+_BLOSUM62_ORDER = "ARNDCQEGHILKMFPSTWYV"
+_BLOSUM62_ROWS = """
+ 4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0
+-1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3
+-2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3
+-2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3
+ 0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1
+-1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2
+-1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2
+ 0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3
+-2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3
+-1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3
+-1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1
+-1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2
+-1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1
+-2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1
+-1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2
+ 1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2
+ 0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0
+-3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3
+-2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1
+ 0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4
+"""
+BLOSUM62 = {
+    (a, b): int(score)
+    for a, row in zip(_BLOSUM62_ORDER, _BLOSUM62_ROWS.split("\n")[1:])
+    for b, score in zip(_BLOSUM62_ORDER, row.split())
+}
+UNKNOWN_SCORE = -1
+
+# Karlin-Altschul parameters of BLOSUM62 with gap costs 11/1 (DIAMOND's defaults)
+LAMBDA = 0.267
+LN_K = math.log(0.041)
+
+def bit_score(raw_score):
+    return (LAMBDA * raw_score - LN_K) / math.log(2)
+
+# -----------------------
+# In-process k-mer index over reference sequences
+# -----------------------
+class KmerIndex:
+    """
+    Positions of every k-mer in the reference records, used to place peptides
+    cut from the reference without running DIAMOND.
+
+    A peptide is seeded with non-overlapping k-mers; the reference diagonal
+    with most seed votes is checked residue by residue. Placements with at
+    most `max_mismatches` substitutions (no gaps, no overhang) are resolved
+    and reported like an ungapped DIAMOND HSP: the maximal-scoring BLOSUM62
+    segment, with bitscore and evalue from the same statistics. Anything
+    else is left for DIAMOND.
+    """
+
+    def __init__(self, records, k=8, max_mismatches=2):
+        self.records = [(str(seq_id), str(seq).upper()) for seq_id, seq in records]
+        self.k = k
+        self.max_mismatches = max_mismatches
+        self.db_letters = sum(len(seq) for _, seq in self.records)
+        self.positions = defaultdict(list)
+        for rec, (_, seq) in enumerate(self.records):
+            for pos in range(len(seq) - k + 1):
+                self.positions[seq[pos:pos + k]].append((rec, pos))
+
+    def _candidates(self, peptide):
+        """Diagonals (record, reference offset of the peptide start) by seed votes."""
+        k = self.k
+        offsets = list(range(0, len(peptide) - k + 1, k))
+        if offsets and offsets[-1] != len(peptide) - k:
+            offsets.append(len(peptide) - k)
+        votes = defaultdict(int)
+        for off in offsets:
+            for rec, pos in self.positions.get(peptide[off:off + k], ()):
+                votes[(rec, pos - off)] += 1
+        # Most votes first, then leftmost position for a stable choice among repeats
+        return sorted(votes, key=lambda d: (-votes[d], d[0], d[1]))
+
+    def place(self, peptide, max_evalue=None, max_candidates=3):
+        """BLAST-style hit dict for a near-exact placement, or None if unresolved."""
+        peptide = str(peptide).upper()
+        if len(peptide) < self.k:
+            return None
+        for rec, start in self._candidates(peptide)[:max_candidates]:
+            seq_id, seq = self.records[rec]
+            if start < 0 or start + len(peptide) > len(seq):
+                continue
+            target = seq[start:start + len(peptide)]
+            mismatches = sum(a != b for a, b in zip(peptide, target))
+            if mismatches > self.max_mismatches:
+                continue
+            hit = self._ungapped_hsp(peptide, target, seq_id, start)
+            if max_evalue is None or hit["evalue"] <= max_evalue:
+                return hit
+        return None
+
+    def _ungapped_hsp(self, peptide, target, seq_id, start):
+        # Maximal-scoring segment on the diagonal, as a local aligner would trim it
+        scores = [BLOSUM62.get((a, b), UNKNOWN_SCORE) for a, b in zip(peptide, target)]
+        best, best_lo, best_hi = 0, 0, 0
+        running, lo = 0, 0
+        for i, s in enumerate(scores):
+            if running <= 0:
+                running, lo = 0, i
+            running += s
+            if running > best:
+                best, best_lo, best_hi = running, lo, i + 1
+        length = best_hi - best_lo
+        identities = sum(a == b for a, b in zip(peptide[best_lo:best_hi], target[best_lo:best_hi]))
+        bits = bit_score(best)
+        return {
+            "qseqid": None,
+            "sseqid": seq_id,
+            "pident": round(100.0 * identities / length, 1) if length else 0.0,
+            "length": length,
+            "mismatch": length - identities,
+            "gapopen": 0,
+            "qstart": best_lo + 1,
+            "qend": best_hi,
+            "sstart": start + best_lo + 1,
+            "send": start + best_hi,
+            "evalue": float(len(peptide) * self.db_letters * 2.0 ** -bits),
+            "bitscore": round(bits, 1),
+        }
+
+    def resolve(self, peptides_df, pep_id_col='pep_id', pep_seq_col='pep_aa', max_evalue=None):
+        """
+        (blast_df of resolved peptides with BLAST_COLUMNS, unresolved peptides_df).
+        """
+        hits, unresolved = [], []
+        for i, (pep_id, seq) in enumerate(zip(peptides_df[pep_id_col], peptides_df[pep_seq_col])):
+            hit = self.place(seq, max_evalue=max_evalue) if isinstance(seq, str) else None
+            if hit is None:
+                unresolved.append(i)
+            else:
+                hit["qseqid"] = pep_id
+                hits.append(hit)
+        blast_df = pd.DataFrame(hits, columns=BLAST_COLUMNS)
+        return blast_df, peptides_df.iloc[np.asarray(unresolved, dtype=np.int64)]
@@ -0,0 +1,126 @@
+import gzip
+import json
+import struct
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# -----------------------
+# Matrix wire formats
+# -----------------------
+# 'json'  : {row_key: [...], col_key: [...], "values": [[...]]} (the original payload)
+# 'typed' : little-endian uint32 header length, JSON header (labels, shape, dtype),
+#           zero padding to 4 bytes, then row-major float32 values. Maps straight
+#           onto a Float32Array in the browser; labels act as the dictionary.
+# 'arrow' : Arrow IPC stream with a dictionary-encoded label column and a
+#           fixed-size float32 list per row; column labels live in the schema
+#           metadata (only when pyarrow is installed).
+MATRIX_FORMATS = {
+    "json": "application/json",
+    "typed": "application/x-virscope-matrix",
+}
+if pa is not None:
+    MATRIX_FORMATS["arrow"] = "application/vnd.apache.arrow.stream"
+
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def negotiate_matrix_format(format_param=None, accept=""):
+    """`?format=` wins; otherwise the first supported mimetype in Accept; default json."""
+    if format_param:
+        if format_param not in MATRIX_FORMATS:
+            raise ValueError(f"Unsupported matrix format '{format_param}'")
+        return format_param
+    for part in (accept or "").split(","):
+        mimetype = part.split(";")[0].strip()
+        for fmt, supported in MATRIX_FORMATS.items():
+            if mimetype == supported and fmt != "json":
+                return fmt
+    return "json"
+
+def encode_matrix(df, row_key, col_key, fmt="json"):
+    """Serialise a labelled 2D frame; returns (bytes, mimetype)."""
+    rows = [_label(v) for v in df.index]
+    cols = [_label(v) for v in df.columns]
+    if fmt == "json":
+        payload = {row_key: rows, col_key: cols, "values": df.values.tolist()}
+        data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    elif fmt == "typed":
+        data = _encode_typed(df, rows, cols, row_key, col_key)
+    elif fmt == "arrow" and pa is not None:
+        data = _encode_arrow(df, rows, cols, row_key, col_key)
+    else:
+        raise ValueError(f"Unsupported matrix format '{fmt}'")
+    return data, MATRIX_FORMATS[fmt]
+
+def decode_typed_matrix(data):
+    """Inverse of the 'typed' format: (header, float32 values of shape header['shape'])."""
+    (header_len,) = struct.unpack_from("<I", data, 0)
+    header = json.loads(data[4:4 + header_len].decode("utf-8"))
+    offset = 4 + header_len
+    offset += -offset % 4
+    values = np.frombuffer(data, dtype="<f4", offset=offset).reshape(header["shape"])
+    return header, values
+
+def _label(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+def _encode_typed(df, rows, cols, row_key, col_key):
+    header = json.dumps({
+        row_key: rows, col_key: cols,
+        "rows": row_key, "columns": col_key,
+        "shape": [len(rows), len(cols)], "dtype": "float32", "order": "row-major",
+    }, separators=(",", ":")).encode("utf-8")
+    prefix = struct.pack("<I", len(header)) + header
+    padding = b"\x00" * (-len(prefix) % 4)
+    values = np.ascontiguousarray(df.to_numpy(dtype=np.float64), dtype="<f4")
+    return prefix + padding + values.tobytes()
+
+def _encode_arrow(df, rows, cols, row_key, col_key):
+    values = np.ascontiguousarray(df.to_numpy(dtype=np.float32))
+    if cols:
+        value_rows = pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1), type=pa.float32()), len(cols))
+    else:
+        # Arrow has no zero-width fixed lists
+        value_rows = pa.nulls(len(rows), pa.list_(pa.float32(), 1))
+    table = pa.Table.from_arrays(
+        [pa.array([str(r) for r in rows], type=pa.string()).dictionary_encode(), value_rows],
+        names=[row_key, "values"]
+    ).replace_schema_metadata({"rows": row_key, "columns": col_key, col_key: json.dumps(cols)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+# -----------------------
+# Response compression
+# -----------------------
+def choose_encoding(accept_encoding=""):
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress_bytes(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+def encode_for_request(data, accept_encoding=""):
+    """(body, Content-Encoding or None); small payloads are sent as-is."""
+    encoding = choose_encoding(accept_encoding) if len(data) >= MIN_COMPRESS_BYTES else None
+    return compress_bytes(data, encoding), encoding
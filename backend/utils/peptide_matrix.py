@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from utils.sharding import codes_for
+
+# -----------------------
+# Sparse peptide x sample matrix
+# -----------------------
+class PeptideSampleMatrix:
+    """
+    CSR matrix of RPK (peptides x samples) built straight from the long
+    table, storing only non-zero reads.
+
+    Means follow the long table's row semantics: every (peptide, sample) row
+    that exists counts towards the denominator even when its RPK is zero, so
+    results equal the groupby/pivot helpers. Those row counts are kept as a
+    small dense table (peptides x conditions). Each sample belongs to one
+    condition; a table giving a sample two conditions is rejected.
+    """
+
+    def __init__(self, matrix, peptides, samples, conditions, condition_counts,
+                 peptide_species=None, species=None, sample_conditions=None):
+        self.matrix = matrix
+        self.peptides = peptides
+        self.samples = samples
+        self.conditions = conditions
+        self.condition_counts = condition_counts
+        self.peptide_species = peptide_species
+        self.species = species
+        self.sample_conditions = sample_conditions
+
+    @classmethod
+    def from_long(cls, df, pep_col='pep_id', sample_col='sample_id', value_col='rpk',
+                  cond_col='Condition', species_col='taxon_species'):
+        pep_codes, peptides = codes_for(df[pep_col])
+        sample_codes, samples = codes_for(df[sample_col])
+        values = df[value_col].to_numpy(np.float64)
+        valid = (pep_codes >= 0) & (sample_codes >= 0) & ~np.isnan(values)
+        stored = valid & (values != 0)
+
+        # Duplicate (peptide, sample) rows are summed by the COO -> CSR conversion
+        matrix = sparse.coo_matrix(
+            (values[stored], (pep_codes[stored], sample_codes[stored])),
+            shape=(len(peptides), len(samples))
+        ).tocsr()
+
+        conditions = np.array([])
+        condition_counts = np.zeros((len(peptides), 0), dtype=np.int64)
+        sample_conditions = None
+        if cond_col in df.columns:
+            cond_codes, conditions = codes_for(df[cond_col])
+            ok = valid & (cond_codes >= 0)
+            condition_counts = np.bincount(
+                pep_codes[ok].astype(np.int64) * len(conditions) + cond_codes[ok],
+                minlength=len(peptides) * len(conditions)
+            ).reshape(len(peptides), len(conditions))
+            sample_conditions = np.full(len(samples), -1, dtype=np.int64)
+            sample_conditions[sample_codes[ok]] = cond_codes[ok]
+            conflicting = np.unique(sample_codes[ok][sample_conditions[sample_codes[ok]] != cond_codes[ok]])
+            if len(conflicting):
+                listed = ", ".join(map(str, samples[conflicting][:5]))
+                raise ValueError(f"{len(conflicting)} sample(s) have more than one {cond_col} (e.g. {listed})")
+
+        peptide_species = species = None
+        if species_col in df.columns:
+            species_codes, species = codes_for(df[species_col])
+            peptide_species = np.full(len(peptides), -1, dtype=np.int64)
+            ok = valid & (species_codes >= 0)
+            peptide_species[pep_codes[ok][::-1]] = species_codes[ok][::-1]
+
+        return cls(matrix, peptides, samples, conditions, condition_counts,
+                   peptide_species, species, sample_conditions)
+
+    @property
+    def density(self):
+        cells = self.matrix.shape[0] * self.matrix.shape[1]
+        return self.matrix.nnz / cells if cells else 0.0
+
+    def nbytes(self):
+        m = self.matrix
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+
+    # -----------------------
+    # Mean by condition / differences
+    # -----------------------
+    def condition_sums(self):
+        """Sum of RPK per peptide x condition (dense: peptides x n_conditions)."""
+        if self.sample_conditions is None:
+            raise ValueError("Matrix was built without a Condition column")
+        has_cond = self.sample_conditions >= 0
+        indicator = sparse.csr_matrix(
+            (np.ones(has_cond.sum()), (np.flatnonzero(has_cond), self.sample_conditions[has_cond])),
+            shape=(len(self.samples), len(self.conditions))
+        )
+        return np.asarray((self.matrix @ indicator).todense())
+
+    def condition_means(self):
+        counts = self.condition_counts
+        sums = self.condition_sums()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+        return pd.DataFrame(means, index=pd.Index(self.peptides, name='pep_id'),
+                            columns=pd.Index(self.conditions, name='Condition'))
+
+    def mean_difference(self, case='Case', control='Control'):
+        """Same columns and values as calculate_mean_rpk_difference."""
+        means = self.condition_means()
+        # Peptides with no rows in any condition are dropped, as in the groupby
+        means = means[self.condition_counts.sum(axis=1) > 0]
+        for c in [case, control]:
+            if c not in means.columns:
+                means[c] = 0
+        means['mean_rpk_difference'] = means[case] - means[control]
+        return means.reset_index().rename(columns={case: 'mean_rpk_case', control: 'mean_rpk_control'})
+
+    def top_peptides(self, n=20, by='mean_rpk_difference', ascending=False):
+        diff = self.mean_difference()
+        return diff.nsmallest(n, by) if ascending else diff.nlargest(n, by)
+
+    def sample_values(self, peptides):
+        """Dense RPK rows for a handful of peptides (e.g. the top-N)."""
+        lookup = pd.Index(self.peptides)
+        rows = lookup.get_indexer(list(peptides))
+        rows = rows[rows >= 0]
+        return pd.DataFrame(self.matrix[rows].toarray(), index=pd.Index(self.peptides[rows], name='pep_id'),
+                            columns=pd.Index(self.samples, name='sample_id'))
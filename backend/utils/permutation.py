@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import false_discovery_control
+
+from utils.sharding import SETTINGS as SHARD_SETTINGS, SharedArrays, _get_pool, _attach, _detach
+
+ALTERNATIVES = ("two-sided", "greater", "less")
+CHUNK_SIZE = 256  # permutations per chunk; fixed so results don't depend on the worker count
+POOL_MIN_WORK = 1e9  # windows x samples x permutations below which the pool costs more than it saves
+
+# -----------------------
+# Window x sample design
+# -----------------------
+# The antigen-map statistic of a window is the sum, over peptides whose hit
+# covers it, of mean_case - mean_control. That is linear in the sample
+# labels: with W (windows x peptides, covering hits) and M (peptides x
+# samples, RPK), stat = (W @ M) @ contrast, where contrast is 1/n_case for
+# Case samples, -1/n_control for Control samples and 0 otherwise. A label
+# permutation only reorders the contrast vector, so N permutations are one
+# (windows x samples) @ (samples x N) product.
+#
+# Means here divide by the number of samples in each group, i.e. a missing
+# (peptide, sample) row counts as RPK 0. On complete tables (one row per
+# peptide and sample, as VirScan exports are) this equals moving_sum.
+def window_design(hits, matrix, window_starts, win_size, block=256):
+    """
+    Dense (windows x samples) A = W @ M for the first hit of each peptide
+    (same dedupe as the antigen profile). Hits whose peptide is not in
+    `matrix` (a PeptideSampleMatrix) are ignored.
+    """
+    unique = hits.drop_duplicates(subset=['qseqid'])
+    rows = pd.Index(matrix.peptides).get_indexer(unique['qseqid'])
+    keep = rows >= 0
+    sstart = unique['sstart'].to_numpy(np.int64)[keep]
+    send = unique['send'].to_numpy(np.int64)[keep]
+    rows = rows[keep]
+
+    window_starts = np.asarray(window_starts, dtype=np.int64)
+    win_idx, hit_idx = [], []
+    for i in range(0, len(window_starts), block):
+        ws = window_starts[i:i + block, None]
+        w, h = np.nonzero((sstart[None, :] <= ws) & (send[None, :] >= ws + win_size - 1))
+        win_idx.append(w + i)
+        hit_idx.append(h)
+    win_idx = np.concatenate(win_idx) if win_idx else np.array([], dtype=np.int64)
+    hit_idx = np.concatenate(hit_idx) if hit_idx else np.array([], dtype=np.int64)
+    W = sparse.csr_matrix(
+        (np.ones(len(win_idx)), (win_idx, rows[hit_idx])),
+        shape=(len(window_starts), len(matrix.peptides))
+    )
+    return np.asarray((W @ matrix.matrix).todense())
+
+def sample_contrast(matrix, case='Case', control='Control'):
+    """Per-sample weights: 1/n_case, -1/n_control, 0 for other or missing conditions."""
+    if matrix.sample_conditions is None:
+        raise ValueError("Matrix was built without a Condition column")
+    conditions = list(matrix.conditions)
+    codes = matrix.sample_conditions
+    is_case = codes == conditions.index(case) if case in conditions else np.zeros(len(codes), dtype=bool)
+    is_control = codes == conditions.index(control) if control in conditions else np.zeros(len(codes), dtype=bool)
+    if not is_case.any() or not is_control.any():
+        raise ValueError(f"Permutation tests need both '{case}' and '{control}' samples")
+    contrast = np.zeros(len(codes))
+    contrast[is_case] = 1.0 / is_case.sum()
+    contrast[is_control] = -1.0 / is_control.sum()
+    return contrast
+
+# -----------------------
+# Permutation engine
+# -----------------------
+def exceedance_counts(design, contrast, observed, seed_seq, n_permutations, alternative):
+    """Per window, how many of `n_permutations` shuffled statistics are at least as extreme."""
+    labelled = np.flatnonzero(contrast != 0)
+    sub_design = design[:, labelled]
+    rng = np.random.default_rng(seed_seq)
+    # Each column is one permutation of the labelled samples' weights
+    contrasts = rng.permuted(np.tile(contrast[labelled][:, None], (1, n_permutations)), axis=0)
+    stats = sub_design @ contrasts
+    if alternative == "greater":
+        return (stats >= observed[:, None] - 1e-12).sum(axis=1)
+    if alternative == "less":
+        return (stats <= observed[:, None] + 1e-12).sum(axis=1)
+    return (np.abs(stats) >= np.abs(observed)[:, None] - 1e-12).sum(axis=1)
+
+def _permutation_worker(specs, seed_seq, n_permutations, alternative):
+    arrays, handles = _attach(specs, ["design", "contrast", "observed"])
+    try:
+        return exceedance_counts(arrays["design"], arrays["contrast"], arrays["observed"],
+                                 seed_seq, n_permutations, alternative)
+    finally:
+        _detach(handles)
+
+def permutation_pvalues(design, contrast, n_permutations=1000, seed=0, alternative="two-sided",
+                        chunk_size=CHUNK_SIZE):
+    """
+    (observed statistic, empirical p-value) per window. Permutations run in
+    chunks with independent seeds spawned from `seed`, across the sharding
+    process pool when it is enabled; results are identical either way.
+    """
+    if alternative not in ALTERNATIVES:
+        raise ValueError(f"alternative must be one of {', '.join(ALTERNATIVES)}")
+    if n_permutations < 1:
+        raise ValueError("n_permutations must be positive")
+    design = np.ascontiguousarray(design, dtype=np.float64)
+    observed = design @ contrast
+    sizes = [min(chunk_size, n_permutations - i) for i in range(0, n_permutations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if SHARD_SETTINGS["workers"] > 1 and len(sizes) > 1 and design.size * n_permutations >= POOL_MIN_WORK:
+        with SharedArrays() as shared:
+            shared.put("design", design)
+            shared.put("contrast", contrast)
+            shared.put("observed", observed)
+            futures = [_get_pool().submit(_permutation_worker, shared.specs, s, n, alternative)
+                       for s, n in zip(seeds, sizes)]
+            exceed = sum(f.result() for f in futures)
+    else:
+        exceed = sum(exceedance_counts(design, contrast, observed, s, n, alternative)
+                     for s, n in zip(seeds, sizes))
+    # The observed labelling counts as one permutation, so p is never 0
+    return observed, (exceed + 1) / (n_permutations + 1)
+
+def window_significance(moving_sum_df, hits, matrix, win_size, n_permutations=1000, seed=0,
+                        alternative="two-sided", case='Case', control='Control'):
+    """moving_sum_df (window_start, window_end, moving_sum) plus statistic, p_value and q_value (BH FDR)."""
+    result = moving_sum_df[['window_start', 'window_end', 'moving_sum']].reset_index(drop=True)
+    if result.empty:
+        return result.assign(statistic=[], p_value=[], q_value=[])
+    design = window_design(hits, matrix, result['window_start'].to_numpy(), win_size)
+    statistic, p_values = permutation_pvalues(design, sample_contrast(matrix, case, control),
+                                              n_permutations, seed, alternative)
+    result['statistic'] = statistic
+    result['p_value'] = p_values
+    result['q_value'] = false_discovery_control(p_values, method='bh')
+    return result
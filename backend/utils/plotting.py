@@ -0,0 +1,95 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# -----------------------
+# Figure helpers (no pyplot global state)
+# -----------------------
+# Every figure is created, drawn and saved through its own Figure and
+# FigureCanvasAgg, so renders can run concurrently in threads.
+DEFAULT_DPI = 300
+
+def new_figure(figsize, **subplots_kwargs):
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(**subplots_kwargs)
+    return fig, axes
+
+def figure_to_png_bytes(fig, dpi=DEFAULT_DPI):
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight')
+    return buf.getvalue()
+
+def save_figure(fig, output_path=None, dpi=DEFAULT_DPI):
+    """Write to `output_path` (returning the path) or return PNG bytes."""
+    if output_path:
+        fig.savefig(output_path, dpi=dpi, bbox_inches='tight')
+        return output_path
+    return figure_to_png_bytes(fig, dpi)
+
+# -----------------------
+# Render tiers
+# -----------------------
+# 'preview' is for on-screen dashboards, 'full' for export and the PDF.
+RENDER_TIERS = {
+    "preview": {"dpi": 72, "format": "webp", "mimetype": "image/webp"},
+    "full": {"dpi": DEFAULT_DPI, "format": "png", "mimetype": "image/png"},
+}
+DEFAULT_TIER = "preview"
+
+def _webp_supported():
+    try:
+        from PIL import features
+        return bool(features.check("webp"))
+    except ImportError:
+        return False
+
+if not _webp_supported():
+    RENDER_TIERS["preview"].update(format="png", mimetype="image/png")
+
+def render_tier(fig, tier=DEFAULT_TIER):
+    """Return (image bytes, stats) for a figure at the given tier."""
+    if tier not in RENDER_TIERS:
+        raise ValueError(f"Unknown render tier '{tier}'")
+    spec = RENDER_TIERS[tier]
+    t0 = time.perf_counter()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=spec["format"], dpi=spec["dpi"], bbox_inches='tight')
+    data = buf.getvalue()
+    stats = {
+        "tier": tier,
+        "format": spec["format"],
+        "mimetype": spec["mimetype"],
+        "dpi": spec["dpi"],
+        "render_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "bytes": len(data),
+    }
+    return data, stats
+
+# -----------------------
+# Shared render pool
+# -----------------------
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        # Concurrent first requests must not each start (and leak) a pool
+        with _render_pool_lock:
+            if _render_pool is None:
+                _render_pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("RENDER_THREADS", 4)),
+                    thread_name_prefix="render"
+                )
+    return _render_pool
+
+def render_many(jobs):
+    """Run (fn, args, kwargs) render jobs concurrently; results keep job order."""
+    futures = [get_render_pool().submit(fn, *args, **kwargs) for fn, args, kwargs in jobs]
+    return [f.result() for f in futures]
@@ -0,0 +1,222 @@
+import glob
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+import pandas as pd
+from flask import current_app
+
+from utils.viruses.enterovirus import parse_ev_domains_from_tsv
+from utils.diamond_db import load_manifest, db_version, db_folder, db_filename, FASTA_EXTENSIONS
+from utils.alignment import SETTINGS as ALIGNMENT_SETTINGS
+from utils.kmer_index import KmerIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFERENCE_ID = "coxsackievirusB1_P08291"
+DOMAIN_COLUMNS = ["ev_proteins", "start", "end", "protein_aa"]
+
+# -----------------------
+# Reference proteome + domain annotations
+# -----------------------
+@dataclass(frozen=True)
+class Reference:
+    """One reference under data/: <id>.fasta, optional <id>.tsv and DIAMOND db."""
+    id: str
+    fasta_path: str
+    tsv_path: str
+    diamond_db_path: str
+    db_version: str  # from the build manifest; part of alignment cache keys
+    sequence: str
+    domains: tuple  # (ev_proteins, start, end, protein_aa) rows, parsed once
+    records: tuple = ()  # (sequence id, residues) for every FASTA record, as DIAMOND sees them
+    species: tuple = ()  # normalised taxon names this reference stands for (see species_key)
+
+    @property
+    def ev_df(self):
+        # A fresh frame per call, so callers can't mutate the shared domains
+        return pd.DataFrame(list(self.domains), columns=DOMAIN_COLUMNS)
+
+    @property
+    def length(self):
+        return len(self.sequence)
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "length": self.length,
+            "domains": [d[0] for d in self.domains],
+            "has_diamond_db": bool(self.diamond_db_path) and os.path.exists(self.diamond_db_path),
+            "db_version": self.db_version,
+            "species": list(self.species),
+        }
+
+def read_fasta_records(path):
+    """(id, residues) per record; the id is the header up to the first space, like DIAMOND's sseqid."""
+    records, seq_id, residues = [], None, []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if seq_id is not None:
+                    records.append((seq_id, "".join(residues)))
+                seq_id, residues = (line[1:].split() or [""])[0], []
+                continue
+            residues.append(line)
+    if seq_id is not None:
+        records.append((seq_id, "".join(residues)))
+    return tuple(records)
+
+def species_key(name):
+    """Case- and whitespace-insensitive form used to match taxon_species to references."""
+    return " ".join(str(name).split()).casefold()
+
+def fasta_species(path):
+    """
+    Species names from the first UniProt header's OS= field, with and without
+    a trailing strain, e.g. 'coxsackievirus b1 (strain japan)' and 'coxsackievirus b1'.
+    """
+    with open(path) as f:
+        header = f.readline()
+    match = re.search(r"\bOS=(.+?)(?:\s+[A-Z]{2}=|$)", header.strip())
+    if not match:
+        return ()
+    organism = match.group(1)
+    names = [species_key(organism), species_key(re.sub(r"\s*\(.*\)\s*$", "", organism))]
+    return tuple(dict.fromkeys(n for n in names if n))
+
+def read_fasta_sequence(path):
+    """Concatenated residues of the first record."""
+    records = read_fasta_records(path)
+    return records[0][1] if records else ""
+
+def find_diamond_db(data_dir, ref_id, entry=None):
+    if entry:
+        return os.path.join(db_folder(data_dir), entry["db"])
+    for candidate in (
+        os.path.join(db_folder(data_dir), db_filename(ref_id)),
+        os.path.join(db_folder(data_dir), f"{ref_id}.dmnd"),
+    ):
+        if os.path.exists(candidate):
+            return candidate
+    return os.path.join(db_folder(data_dir), db_filename(ref_id))
+
+def load_domains(tsv_path):
+    if not tsv_path:
+        return ()
+    try:
+        ev_df = parse_ev_domains_from_tsv(tsv_path)
+    except Exception as e:
+        logger.warning("Could not parse domains from %s: %s", tsv_path, e)
+        return ()
+    ev_df = ev_df.dropna(subset=["ev_proteins"])
+    return tuple(
+        (str(r.ev_proteins), int(r.start), int(r.end), str(r.protein_aa))
+        for r in ev_df[DOMAIN_COLUMNS].itertuples(index=False)
+    )
+
+# -----------------------
+# Registry (built once at startup)
+# -----------------------
+class ReferenceRegistry:
+    def __init__(self, references, default_id=DEFAULT_REFERENCE_ID, species_aliases=None):
+        self.references = dict(references)
+        if default_id not in self.references and self.references:
+            default_id = sorted(self.references)[0]
+        self.default_id = default_id
+        # taxon_species -> reference id: configured aliases win over FASTA organism names
+        self.species_index = {}
+        for ref_id in sorted(self.references):
+            for name in self.references[ref_id].species:
+                self.species_index.setdefault(name, ref_id)
+        for name, ref_id in (species_aliases or {}).items():
+            if ref_id in self.references:
+                self.species_index[species_key(name)] = ref_id
+            else:
+                logger.warning("Species alias '%s' points to unknown reference '%s'", name, ref_id)
+        self._kmer_indexes = {}
+        self._kmer_lock = threading.Lock()
+
+    @classmethod
+    def discover(cls, data_dir, default_id=DEFAULT_REFERENCE_ID, species_aliases=None):
+        """Every reference FASTA (and UniProt TSV of the same name) directly under `data_dir`."""
+        stems = {}
+        for path in sorted(glob.glob(os.path.join(data_dir, "*"))):
+            stem, ext = os.path.splitext(os.path.basename(path))
+            if ext.lower() in FASTA_EXTENSIONS:
+                stems.setdefault(stem, {})["fasta"] = path
+            elif ext.lower() == ".tsv":
+                stems.setdefault(stem, {})["tsv"] = path
+
+        manifest = load_manifest(data_dir)
+        references = {}
+        for ref_id, files in stems.items():
+            fasta_path = files.get("fasta", "")
+            records = read_fasta_records(fasta_path) if fasta_path else ()
+            references[ref_id] = Reference(
+                id=ref_id,
+                fasta_path=fasta_path,
+                tsv_path=files.get("tsv", ""),
+                diamond_db_path=find_diamond_db(data_dir, ref_id, manifest.get(ref_id)),
+                db_version=db_version(manifest.get(ref_id)),
+                sequence=records[0][1] if records else "",
+                domains=load_domains(files.get("tsv")),
+                records=records,
+                species=fasta_species(fasta_path) if fasta_path else (),
+            )
+        logger.info("Registered %d reference(s) from %s", len(references), data_dir)
+        return cls(references, default_id, species_aliases)
+
+    def get(self, ref_id=None):
+        ref_id = ref_id or self.default_id
+        if ref_id not in self.references:
+            raise KeyError(f"Unknown reference '{ref_id}'")
+        return self.references[ref_id]
+
+    def for_species(self, taxon_species):
+        """Reference for a taxon_species value, or None if no reference covers it."""
+        ref_id = self.species_index.get(species_key(taxon_species))
+        return self.references[ref_id] if ref_id else None
+
+    def kmer_index(self, ref_id=None):
+        """In-process k-mer index over the reference's records, built on first use."""
+        reference = self.get(ref_id)
+        with self._kmer_lock:
+            if reference.id not in self._kmer_indexes:
+                self._kmer_indexes[reference.id] = KmerIndex(reference.records)
+            return self._kmer_indexes[reference.id]
+
+    def ids(self):
+        return sorted(self.references)
+
+    def __contains__(self, ref_id):
+        return ref_id in self.references
+
+# -----------------------
+# Flask wiring
+# -----------------------
+def init_reference_registry(app, data_dir=None):
+    data_dir = data_dir or os.path.join(app.root_path, "data")
+    registry = ReferenceRegistry.discover(data_dir, app.config.get("DEFAULT_REFERENCE", DEFAULT_REFERENCE_ID),
+                                          app.config.get("REFERENCE_SPECIES"))
+    app.extensions["references"] = registry
+    return registry
+
+def get_reference_registry(app=None):
+    flask_app = app or current_app
+    registry = flask_app.extensions.get("references")
+    if registry is None:
+        registry = init_reference_registry(flask_app)
+    return registry
+
+def get_reference(ref_id=None, app=None):
+    """Reference by id (default reference if None); KeyError if unknown."""
+    return get_reference_registry(app).get(ref_id)
+
+def get_kmer_index(reference, app=None):
+    """K-mer fast path for `reference`, or None when disabled or there is nothing to index."""
+    if not ALIGNMENT_SETTINGS["kmer_fast_path"] or not reference.records:
+        return None
+    return get_reference_registry(app).kmer_index(reference.id)
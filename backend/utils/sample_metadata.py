@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from utils.dataset import sniff_delimiter
+from utils.peptide_matrix import PeptideSampleMatrix
+
+MAX_LISTED_VALUES = 50
+
+# -----------------------
+# Sample metadata table (one row per sample_id)
+# -----------------------
+# Metadata uploads stay a small table indexed by sample_id instead of being
+# repeated on every peptide row of the base file. Aggregates built from the
+# base file (species x sample matrix, PeptideSampleMatrix) already have one
+# column per sample, so a metadata column is joined by mapping those sample
+# codes to metadata rows once; the base file is never re-read.
+class SampleMetadata:
+    def __init__(self, table):
+        self.table = table
+
+    @property
+    def columns(self):
+        return list(self.table.columns)
+
+    def describe(self):
+        """Per column: number of distinct values and (up to MAX_LISTED_VALUES of) the values."""
+        return [{
+            "column": col,
+            "n_values": len(self.table[col].cat.categories),
+            "values": [str(v) for v in self.table[col].cat.categories[:MAX_LISTED_VALUES]],
+        } for col in self.columns]
+
+    def sample_rows(self, samples):
+        """Metadata row of each sample id (-1 for samples without metadata)."""
+        return self.table.index.get_indexer(np.asarray(samples).astype(str))
+
+    def group_codes(self, samples, column):
+        """
+        (code per sample, group labels) for `column`: codes index the labels,
+        -1 where the sample has no metadata or no value. Only groups that
+        occur among `samples` are kept.
+        """
+        if column not in self.table.columns:
+            raise ValueError(f"Unknown metadata column '{column}'")
+        values = self.table[column]
+        rows = self.sample_rows(samples)
+        value_codes = values.cat.codes.to_numpy(np.int64)
+        codes = np.where(rows >= 0, value_codes[np.maximum(rows, 0)], -1)
+        used = np.unique(codes[codes >= 0])
+        remap = np.full(len(values.cat.categories), -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+        return codes, np.asarray(values.cat.categories[used])
+
+def read_sample_metadata(path, sample_col='sample_id'):
+    df = pd.read_csv(path, sep=sniff_delimiter(path), dtype=str)
+    df.columns = [str(c).strip() for c in df.columns]
+    if sample_col not in df.columns:
+        raise ValueError(f"Metadata file has no '{sample_col}' column")
+    df = df.apply(lambda col: col.str.strip()).replace('', np.nan)  # blank cells are missing values
+    df = df[df[sample_col].notna()].drop_duplicates(subset=[sample_col])  # first row per sample wins
+    table = df.set_index(sample_col).astype('category')
+    table.index = pd.Index(table.index.astype(str), name=sample_col)
+    return SampleMetadata(table)
+
+# -----------------------
+# Aggregates grouped by a metadata column
+# -----------------------
+def group_species_matrix(species_matrix, metadata, column):
+    """Species x group mean of the per-sample mean RPK; samples without a group are left out."""
+    codes, labels = metadata.group_codes(species_matrix.columns, column)
+    grouped = codes >= 0
+    indicator = sparse.csr_matrix(
+        (np.ones(grouped.sum()), (np.flatnonzero(grouped), codes[grouped])),
+        shape=(len(codes), len(labels))
+    )
+    sizes = np.bincount(codes[grouped], minlength=len(labels))
+    means = np.asarray(indicator.T @ species_matrix.to_numpy(np.float64).T).T / np.maximum(sizes, 1)
+    return pd.DataFrame(means, index=species_matrix.index, columns=pd.Index(labels, name=column))
+
+def with_sample_groups(matrix, metadata, column):
+    """
+    The PeptideSampleMatrix with its conditions replaced by `column`'s groups,
+    so Case/Control helpers (mean_difference, differential_stats, ...) compare
+    any metadata groups. The RPK matrix is shared, not copied. Denominators
+    are group sizes: a sample with no row for a peptide counts as RPK 0.
+    """
+    codes, labels = metadata.group_codes(matrix.samples, column)
+    sizes = np.bincount(codes[codes >= 0], minlength=len(labels))
+    condition_counts = np.broadcast_to(sizes, (len(matrix.peptides), len(labels)))
+    return PeptideSampleMatrix(matrix.matrix, matrix.peptides, matrix.samples, labels, condition_counts,
+                               matrix.peptide_species, matrix.species, codes)
@@ -0,0 +1,224 @@
+import atexit
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# -----------------------
+# Settings (set from app.py via configure_sharding)
+# -----------------------
+SETTINGS = {
+    "workers": 0,            # 0 or 1 disables sharding
+    "min_rows": 2_000_000,   # smaller tables are cheaper to process in-process
+}
+
+_pool = None
+
+def configure_sharding(workers=None, min_rows=None):
+    global _pool
+    if workers is not None:
+        SETTINGS["workers"] = max(int(workers), 0)
+    if min_rows is not None:
+        SETTINGS["min_rows"] = int(min_rows)
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+def should_shard(n_rows):
+    return SETTINGS["workers"] > 1 and n_rows >= SETTINGS["min_rows"]
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # forkserver avoids forking a multi-threaded gunicorn/Flask worker
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=SETTINGS["workers"], mp_context=mp.get_context(method))
+    return _pool
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+# -----------------------
+# Shared memory helpers
+# -----------------------
+class SharedArrays:
+    """Owns shared memory blocks for the duration of one sharded computation."""
+
+    def __init__(self):
+        self.blocks = []
+        self.specs = {}
+
+    def put(self, name, array):
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self.blocks.append(shm)
+        self.specs[name] = (shm.name, array.shape, array.dtype.str)
+        return shm
+
+    def view(self, name):
+        shm_name, shape, dtype = self.specs[name]
+        shm = next(b for b in self.blocks if b.name == shm_name)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+def _attach(specs, names):
+    handles, arrays = [], {}
+    for name in names:
+        shm_name, shape, dtype = specs[name]
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return arrays, handles
+
+def _detach(handles):
+    for shm in handles:
+        shm.close()
+
+# -----------------------
+# Partitioning helpers
+# -----------------------
+def codes_for(series):
+    """Integer codes and labels for a (categorical or plain) column."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(np.int32), np.asarray(series.cat.categories)
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes.astype(np.int32), np.asarray(uniques)
+
+def shard_bounds(sorted_keys, n_shards):
+    """Split sorted keys into ~equal row ranges that never cut a key in two."""
+    n = len(sorted_keys)
+    if n == 0:
+        return []
+    cuts = [0]
+    for i in range(1, n_shards):
+        pos = int(np.searchsorted(sorted_keys, sorted_keys[min(i * n // n_shards, n - 1)], side='left'))
+        if pos > cuts[-1]:
+            cuts.append(pos)
+    cuts.append(n)
+    return [(cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1) if cuts[i + 1] > cuts[i]]
+
+# -----------------------
+# Workers (run in the process pool)
+# -----------------------
+def _rpk_worker(specs, start, end):
+    arrays, handles = _attach(specs, ["key", "value", "out"])
+    try:
+        keys = arrays["key"][start:end]
+        values = arrays["value"][start:end].astype(np.float64)
+        local, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=np.nan_to_num(values), minlength=len(local))
+        arrays["out"][start:end] = values / totals[inverse] * 1e5
+    finally:
+        _detach(handles)
+
+def _group_worker(specs, start, end, n_other):
+    arrays, handles = _attach(specs, ["key", "other", "value"])
+    try:
+        combined = arrays["key"][start:end].astype(np.int64) * n_other + arrays["other"][start:end]
+        groups, inverse = np.unique(combined, return_inverse=True)
+        values = arrays["value"][start:end]
+        # NaNs are skipped, as in pandas' groupby mean
+        sums = np.bincount(inverse, weights=np.nan_to_num(values), minlength=len(groups))
+        counts = np.bincount(inverse, weights=~np.isnan(values), minlength=len(groups))
+        return groups, sums, counts
+    finally:
+        _detach(handles)
+
+def _moving_sum_worker(specs, first, last, win_size, block=256):
+    arrays, handles = _attach(specs, ["sstart", "send", "value", "window_starts"])
+    try:
+        return moving_sum_block(arrays["sstart"], arrays["send"], arrays["value"],
+                                arrays["window_starts"][first:last], win_size, block)
+    finally:
+        _detach(handles)
+
+def moving_sum_block(sstart, send, values, window_starts, win_size, block=256):
+    """Sum of values of hits fully covering each window; also whether any hit covers it."""
+    values = np.nan_to_num(values)
+    sums = np.zeros(len(window_starts))
+    covered = np.zeros(len(window_starts), dtype=bool)
+    for i in range(0, len(window_starts), block):
+        ws = window_starts[i:i + block, None]
+        mask = (sstart[None, :] <= ws) & (send[None, :] >= ws + win_size - 1)
+        sums[i:i + block] = (mask * values[None, :]).sum(axis=1)
+        covered[i:i + block] = mask.any(axis=1)
+    return sums, covered
+
+# -----------------------
+# Sharded computations
+# -----------------------
+def sharded_compute_rpk(df, abundance_col='abundance', sample_col='sample_id'):
+    keys, _ = codes_for(df[sample_col])
+    order = np.argsort(keys, kind='stable')
+    with SharedArrays() as shared:
+        shared.put("key", keys[order])
+        shared.put("value", df[abundance_col].to_numpy(np.float64)[order])
+        shared.put("out", np.zeros(len(df)))
+        bounds = shard_bounds(shared.view("key"), SETTINGS["workers"])
+        futures = [_get_pool().submit(_rpk_worker, shared.specs, s, e) for s, e in bounds]
+        for f in futures:
+            f.result()
+        rpk = np.empty(len(df))
+        rpk[order] = shared.view("out")
+    df = df.copy()
+    df['rpk'] = rpk
+    return df
+
+def sharded_group_mean(df, key_col, other_col, value_col='rpk'):
+    """
+    Mean of `value_col` per (key_col, other_col), sharded by key_col. Each
+    shard owns whole keys, so partial results are disjoint and merge by
+    concatenation. Returns a Series indexed by (key_col, other_col).
+    """
+    keys, key_labels = codes_for(df[key_col])
+    others, other_labels = codes_for(df[other_col])
+    valid = (keys >= 0) & (others >= 0)
+    order = np.argsort(keys, kind='stable')
+    order = order[valid[order]]
+    n_other = max(len(other_labels), 1)
+
+    with SharedArrays() as shared:
+        shared.put("key", keys[order])
+        shared.put("other", others[order])
+        shared.put("value", df[value_col].to_numpy(np.float64)[order])
+        bounds = shard_bounds(shared.view("key"), SETTINGS["workers"])
+        futures = [_get_pool().submit(_group_worker, shared.specs, s, e, n_other) for s, e in bounds]
+        parts = [f.result() for f in futures]
+
+    if parts:
+        groups = np.concatenate([p[0] for p in parts])
+        means = np.concatenate([p[1] for p in parts]) / np.concatenate([p[2] for p in parts])
+    else:
+        groups, means = np.array([], dtype=np.int64), np.array([])
+    index = pd.MultiIndex.from_arrays(
+        [key_labels[groups // n_other], other_labels[groups % n_other]], names=[key_col, other_col])
+    return pd.Series(means, index=index, name=value_col)
+
+def sharded_moving_sum(sstart, send, values, window_starts, win_size):
+    """Moving sums for `window_starts`, with windows split across the pool."""
+    with SharedArrays() as shared:
+        shared.put("sstart", np.asarray(sstart, dtype=np.int64))
+        shared.put("send", np.asarray(send, dtype=np.int64))
+        shared.put("value", np.asarray(values, dtype=np.float64))
+        shared.put("window_starts", np.asarray(window_starts, dtype=np.int64))
+        n = len(window_starts)
+        step = -(-n // SETTINGS["workers"]) if n else 1
+        futures = [_get_pool().submit(_moving_sum_worker, shared.specs, i, min(i + step, n), win_size)
+                   for i in range(0, n, step)]
+        parts = [f.result() for f in futures]
+    if not parts:
+        return np.array([]), np.array([], dtype=bool)
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
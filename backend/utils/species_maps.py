@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from utils.alignment import resolve_preset, SETTINGS
+from utils.antigen_profile import build_antigen_profile, moving_sum_from_profile
+from utils.viruses.enterovirus import align_peptides
+
+# -----------------------
+# Antigen maps for every species in an upload
+# -----------------------
+def partition_by_species(peptides_df, registry, species_col='taxon_species'):
+    """
+    ({reference id: peptides_df} for species with a reference,
+     {taxon_species: peptide count} for species without one).
+    Species sharing a reference (e.g. aliases) are aligned together.
+    """
+    by_reference, unmatched = {}, {}
+    for species, group in peptides_df.groupby(species_col, observed=True, sort=True):
+        reference = registry.for_species(species)
+        if reference is None:
+            unmatched[str(species)] = len(group)
+        else:
+            by_reference.setdefault(reference.id, []).append(group)
+    return {ref_id: pd.concat(groups, ignore_index=True) for ref_id, groups in by_reference.items()}, unmatched
+
+def align_species(peptides_df, mean_diff_df, registry, preset=None, kmer_indexes=None, max_workers=None):
+    """
+    Partition peptides by taxon_species, align each partition against its
+    reference concurrently (at most `max_workers` at a time, default
+    SETTINGS["max_concurrent_alignments"]) and build one antigen profile per
+    reference. Returns ({reference id: {"profile", "species", "n_peptides",
+    "n_hits", "preset"}}, unmatched species counts, {reference id: error
+    message} for references whose alignment failed).
+    """
+    partitions, unmatched = partition_by_species(peptides_df, registry)
+    kmer_indexes = kmer_indexes or {}
+
+    def align(ref_id):
+        reference = registry.get(ref_id)
+        peptides = partitions[ref_id]
+        ref_preset = resolve_preset(preset, ref_id)
+        hits = align_peptides(peptides[['pep_id', 'pep_aa']], reference.diamond_db_path,
+                              preset=ref_preset, kmer_index=kmer_indexes.get(ref_id))
+        merged = hits.merge(mean_diff_df, left_on='qseqid', right_on='pep_id', how='left')
+        merged['sstart'] = merged['sstart'].astype(int)
+        merged['send'] = merged['send'].astype(int)
+        return ref_id, {
+            "profile": build_antigen_profile(merged),
+            "species": sorted(str(s) for s in peptides['taxon_species'].unique()),
+            "n_peptides": len(peptides),
+            "n_hits": int(merged['qseqid'].nunique()),
+            "preset": ref_preset,
+        }
+
+    if not partitions:
+        return {}, unmatched, {}
+    workers = max(1, min(max_workers or SETTINGS["max_concurrent_alignments"], len(partitions)))
+    results, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(align, ref_id): ref_id for ref_id in sorted(partitions)}
+        # One reference failing (missing .dmnd, DIAMOND error) must not lose the others
+        for future in as_completed(futures):
+            try:
+                ref_id, result = future.result()
+                results[ref_id] = result
+            except Exception as e:
+                failed[futures[future]] = str(e)
+    return results, unmatched, failed
+
+def species_tracks(results, win_size=32, step_size=4):
+    """Moving-sum track per reference from align_species results (empty if nothing aligned)."""
+    return {ref_id: moving_sum_from_profile(result["profile"], win_size, step_size)
+            for ref_id, result in results.items()}
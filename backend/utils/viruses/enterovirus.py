@@ -1,6 +1,5 @@
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import pandas as pd
 import numpy as np
@@ -9,6 +8,9 @@ import tempfile
 import os
 import subprocess
 from flask import send_file, current_app
+from utils.plotting import new_figure, save_figure
+from utils.alignment import diamond_args, DEFAULT_PRESET, ALIGNMENT_PRESETS
+from utils.alignment_batcher import AlignmentBatcher
 
 # -----------------------
 # Helper: load file from R2
@@ -29,39 +31,66 @@ def load_file_from_r2(bucket_name, object_name, sep="\t"):
 # -----------------------
 def generate_temp_fasta_from_peptides(peptide_df, pep_id_col='pep_id', pep_seq_col='pep_aa'):
     temp_fasta = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.fasta')
-    for _, row in peptide_df.iterrows():
-        header = str(row[pep_id_col])
-        seq = str(row[pep_seq_col])
-        temp_fasta.write(f">{header}\n{seq}\n")
-    temp_fasta.flush()
     temp_fasta.close()
-    return temp_fasta.name
+    return write_fasta(peptide_df, temp_fasta.name, pep_id_col, pep_seq_col)
+
+def write_fasta(peptide_df, path, pep_id_col='pep_id', pep_seq_col='pep_aa'):
+    with open(path, 'w') as f:
+        for header, seq in zip(peptide_df[pep_id_col].astype(str), peptide_df[pep_seq_col].astype(str)):
+            f.write(f">{header}\n{seq}\n")
+    return path
 
 # -----------------------
 # Run DIAMOND / BLAST
 # -----------------------
-def run_diamond(query_fasta, db_path, output_path, threads=4, evalue=0.01):
+BLAST_COLUMNS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
+                 "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
+
+def run_diamond(query_fasta, db_path, output_path, threads=None, evalue=None, preset=DEFAULT_PRESET):
+    # Threads default to the available cores; `evalue` overrides the preset's
+    args = diamond_args(preset, threads)
+    if evalue is not None:
+        args[args.index("--evalue") + 1] = str(evalue)
     cmd = [
         "diamond", "blastp",
         "--query", query_fasta,
         "--db", db_path,
         "--out", output_path,
         "--outfmt", "6",
-        "--threads", str(threads),
-        "--evalue", str(evalue)
-    ]
+    ] + args
     try:
         subprocess.run(cmd, check=True)
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"DIAMOND command failed: {e}") from e
     return output_path
 
+def diamond_blast_df(query_fasta, db_path, preset=DEFAULT_PRESET):
+    """Run DIAMOND on a FASTA and read its tabular output."""
+    temp_diamond_output = tempfile.NamedTemporaryFile(delete=False, suffix='.tsv')
+    temp_diamond_output.close()
+    try:
+        run_diamond(query_fasta, db_path, temp_diamond_output.name, preset=preset)
+        return pd.read_csv(temp_diamond_output.name, sep="\t", names=BLAST_COLUMNS)
+    finally:
+        os.remove(temp_diamond_output.name)
+
+# Shared by every request in this process, so concurrent alignments against
+# one database run as a single DIAMOND invocation
+ALIGNMENT_BATCHER = AlignmentBatcher(diamond_blast_df)
+
 # -----------------------
 # Helper: calculate mean RPK difference
 # -----------------------
 def calculate_mean_rpk_difference(df, pep_col='pep_id', cond_col='Condition', rpk_col='rpk'):
-    mean_rpk = df.groupby([pep_col, cond_col])[rpk_col].mean().reset_index()
-    pivot_df = mean_rpk.pivot(index=pep_col, columns=cond_col, values=rpk_col).fillna(0)
+    mean_rpk = df.groupby([pep_col, cond_col], observed=True)[rpk_col].mean()
+    return mean_rpk_difference_from_means(mean_rpk, pep_col=pep_col, cond_col=cond_col)
+
+def mean_rpk_difference_from_means(mean_rpk, pep_col='pep_id', cond_col='Condition'):
+    """Case/Control pivot from a (peptide, condition)-indexed Series of mean RPK."""
+    pivot_df = mean_rpk.unstack(cond_col, fill_value=0)
+    # Plain axes so missing conditions can be added and pep ids merge as strings
+    pivot_df.index = pd.Index(np.asarray(pivot_df.index), name=pep_col)
+    pivot_df.columns = pd.Index(np.asarray(pivot_df.columns), name=cond_col)
     for c in ['Case', 'Control']:
         if c not in pivot_df.columns:
             pivot_df[c] = 0
@@ -79,6 +108,7 @@ def calculate_moving_sum(df, value_column='mean_rpk_difference', win_size=32, st
     min_start = int(df_unique['sstart'].min())
     max_end = int(df_unique['send'].max())
     window_starts = np.arange(min_start, max_end - win_size + 2, step_size)
+
     moving_rows = []
 
     for ws in window_starts:
@@ -98,17 +128,40 @@ def calculate_moving_sum(df, value_column='mean_rpk_difference', win_size=32, st
     else:
         return pd.DataFrame(columns=['window_start', 'window_end', 'moving_sum'])
 
+# -----------------------
+# EV polyprotein domain colours (shared by PNG and chart specs)
+# -----------------------
+EV_PROTEIN_COLOURS = {
+    "VP4": "#428984",
+    "VP2": "#6FC0EE",
+    "VP3": "#26DED8E6",
+    "VP1": "#C578E6",
+    "2A": "#F6F4D6",
+    "2B": "#D9E8E5",
+    "2C": "#EBF5D8",
+    "3AB": "#EDD9BA",
+    "3C": "#EBD2D0",
+    "3D": "#FFB19A"
+}
+EV_DEFAULT_COLOUR = "#CCCCCC"
+
 # -----------------------
 # Plot antigen map
 # -----------------------
 def plot_antigen_map(moving_sum_df, ev_df=None, output_path=None):
-    import matplotlib.pyplot as plt
-    import matplotlib.patches as patches
-    import pandas as pd
-    import numpy as np
-    import io
-    from flask import send_file
+    # Save or return image
+    if output_path:
+        save_figure(draw_antigen_map(moving_sum_df, ev_df), output_path)
+        return send_file(output_path, mimetype='image/png', as_attachment=False)
+
+    buf = io.BytesIO(render_antigen_map_png(moving_sum_df, ev_df))
+    return send_file(buf, mimetype="image/png")
+
+def render_antigen_map_png(moving_sum_df, ev_df=None):
+    # Plain bytes, safe to call from a render thread (no Flask context needed)
+    return save_figure(draw_antigen_map(moving_sum_df, ev_df))
 
+def draw_antigen_map(moving_sum_df, ev_df=None):
     # Ensure required columns exist
     required_cols = {'window_start', 'window_end', 'moving_sum'}
     if not required_cols.issubset(moving_sum_df.columns):
@@ -124,34 +177,23 @@ def plot_antigen_map(moving_sum_df, ev_df=None, output_path=None):
     x_full = np.arange(int(x_min), int(x_max) + 1)
     x_mid_int = plot_df['x_mid'].round().astype(int)
 
-    case_series = pd.Series(0, index=x_full)
-    ctrl_series = pd.Series(0, index=x_full)
+    case_series = pd.Series(0.0, index=x_full)
+    ctrl_series = pd.Series(0.0, index=x_full)
     case_series.update(pd.Series(plot_df['Case'].values.astype('float'), index=x_mid_int))
     ctrl_series.update(pd.Series(plot_df['Control'].values.astype('float'), index=x_mid_int))
 
     # Create figure
-    fig, (ax1, ax2) = plt.subplots(nrows=2, figsize=(16, 10), gridspec_kw={'height_ratios': [1, 4]})
+    fig, (ax1, ax2) = new_figure(figsize=(16, 10), nrows=2, gridspec_kw={'height_ratios': [1, 4]})
 
     # Plot EV polyprotein domains
     if ev_df is not None and not ev_df.empty:
-        protein_colours = {
-            "VP4": "#428984",
-            "VP2": "#6FC0EE",
-            "VP3": "#26DED8E6",
-            "VP1": "#C578E6",
-            "2A": "#F6F4D6",
-            "2B": "#D9E8E5",
-            "2C": "#EBF5D8",
-            "3AB": "#EDD9BA",
-            "3C": "#EBD2D0",
-            "3D": "#FFB19A"
-        }
+        protein_colours = EV_PROTEIN_COLOURS
 
         # Draw domain rectangles
         for _, row in ev_df.iterrows():
             ax1.add_patch(patches.Rectangle(
                 (row["start"], 0), row["end"] - row["start"], 0.1,
-                facecolor=protein_colours.get(row["ev_proteins"], "#CCCCCC")
+                facecolor=protein_colours.get(row["ev_proteins"], EV_DEFAULT_COLOUR)
             ))
 
         # Add domain labels only if wide enough
@@ -189,19 +231,8 @@ def plot_antigen_map(moving_sum_df, ev_df=None, output_path=None):
     ax2.set_ylabel("Moving Sum", fontsize=14)
     ax2.legend(loc='upper right')
     ax2.grid(False)
-    plt.subplots_adjust(hspace=0.1)
-
-    # Save or return image
-    if output_path:
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        return send_file(output_path, mimetype='image/png', as_attachment=False)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-    plt.close()
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    fig.subplots_adjust(hspace=0.1)
+    return fig
 
 # -----------------------
 # Parse EV polyprotein domains from UniProt TSV
@@ -278,54 +309,77 @@ def parse_ev_domains_from_tsv(tsv_path, merge_3AB=True):
 # Prepare antigen map DataFrame
 # -----------------------
 def prepare_antigen_map_df(upload_id, df, diamond_db_path,
-                           win_size=32, step_size=4, cache_folder=None, tsv_path=None):
-    cache_folder = cache_folder or tempfile.gettempdir()
-    os.makedirs(cache_folder, exist_ok=True)
+                           win_size=32, step_size=4, cache_folder=None, tsv_path=None,
+                           mean_diff_df=None, ev_df=None, preset=DEFAULT_PRESET, kmer_index=None):
+    # `mean_diff_df` lets callers pass Case/Control means computed elsewhere
+    # (e.g. out-of-core); `df` then only needs pep_id and pep_aa.
+    # `ev_df` takes preparsed domains (e.g. from the reference registry).
+    merged, debug_fasta_path = prepare_antigen_hits(
+        upload_id, df, diamond_db_path, cache_folder=cache_folder, mean_diff_df=mean_diff_df, preset=preset,
+        kmer_index=kmer_index
+    )
 
-    debug_fasta_path = os.path.join(
-        current_app.root_path,
-        "uploads", "cache",
-        f"debug_upload_{upload_id}.fasta"
+    moving_sum_df = calculate_moving_sum(
+        merged, value_column='mean_rpk_difference', win_size=win_size, step_size=step_size
     )
-    temp_fasta_path = generate_temp_fasta_from_peptides(df, pep_id_col='pep_id', pep_seq_col='pep_aa')
-    
-    # Copy temp FASTA to debug location
-    import shutil
-    os.makedirs(os.path.dirname(debug_fasta_path), exist_ok=True)
-    shutil.copy(temp_fasta_path, debug_fasta_path)
-    print(f"DEBUG: FASTA saved to {debug_fasta_path} for inspection")
 
-    temp_diamond_output = tempfile.NamedTemporaryFile(delete=False, suffix='.tsv')
-    temp_diamond_output.close()
+    if ev_df is None:
+        ev_df = load_ev_domains(tsv_path)
 
-    try:
-        run_diamond(temp_fasta_path, diamond_db_path, temp_diamond_output.name)
-        blast_df = pd.read_csv(
-            temp_diamond_output.name,
-            sep="\t",
-            names=["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
-                   "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
-        )
-    finally:
-        os.remove(temp_fasta_path)
-        os.remove(temp_diamond_output.name)
+    return moving_sum_df, ev_df, debug_fasta_path
 
-    df = df.copy()
-    df['rpk'] = df.groupby('sample_id')['abundance'].transform(lambda x: x / x.sum() * 1e5)
+def load_ev_domains(tsv_path=None):
+    if tsv_path is None:
+        # Default reference domains, parsed once at startup by the registry
+        from utils.references import get_reference
+        return get_reference().ev_df
+    return parse_ev_domains_from_tsv(tsv_path)
+
+def align_peptides(peptides_df, diamond_db_path, preset=DEFAULT_PRESET, kmer_index=None,
+                   debug_fasta_path=None):
+    """
+    BLAST-columns hits for unique (pep_id, pep_aa) rows: k-mer fast path, then batched DIAMOND.
+    With `debug_fasta_path`, the peptides sent to DIAMOND are also written there.
+    """
+    blast_frames = []
+    if kmer_index is not None:
+        resolved_df, peptides_df = kmer_index.resolve(peptides_df, max_evalue=ALIGNMENT_PRESETS[preset]["evalue"])
+        if not resolved_df.empty:
+            blast_frames.append(resolved_df)
+    if debug_fasta_path:
+        os.makedirs(os.path.dirname(debug_fasta_path), exist_ok=True)
+        write_fasta(peptides_df, debug_fasta_path)
+    if not peptides_df.empty:
+        blast_frames.append(ALIGNMENT_BATCHER.align(peptides_df, diamond_db_path, preset))
+    return pd.concat(blast_frames, ignore_index=True) if blast_frames else pd.DataFrame(columns=BLAST_COLUMNS)
+
+def prepare_antigen_hits(upload_id, df, diamond_db_path, cache_folder=None, mean_diff_df=None,
+                         preset=DEFAULT_PRESET, kmer_index=None):
+    """
+    DIAMOND hits of the upload's peptides joined with their Case/Control mean RPK difference.
+    With a `kmer_index` (utils/kmer_index.py), exact and near-exact placements are resolved
+    in-process and only the remaining peptides go to DIAMOND, batched with other requests.
+    """
+    cache_folder = cache_folder or tempfile.gettempdir()
+    os.makedirs(cache_folder, exist_ok=True)
 
-    mean_diff_df = calculate_mean_rpk_difference(df)
+    # DEBUG_ALIGNMENT_FASTA=1 keeps the peptides sent to DIAMOND for inspection
+    debug_fasta_path = None
+    if current_app.config.get("DEBUG_ALIGNMENT_FASTA"):
+        debug_fasta_path = os.path.join(current_app.root_path, "uploads", "cache", f"debug_upload_{upload_id}.fasta")
+    peptides_df = df[['pep_id', 'pep_aa']].drop_duplicates(subset=['pep_id'])
+    blast_df = align_peptides(peptides_df, diamond_db_path, preset=preset, kmer_index=kmer_index,
+                              debug_fasta_path=debug_fasta_path)
+
+    if mean_diff_df is None:
+        # RPK may already be computed by the loader (against unfiltered sample totals)
+        if 'rpk' not in df.columns:
+            df = df.copy()
+            df['rpk'] = df.groupby('sample_id', observed=True)['abundance'].transform(lambda x: x / x.sum() * 1e5)
+        mean_diff_df = calculate_mean_rpk_difference(df)
     merged = blast_df.merge(mean_diff_df, left_on='qseqid', right_on='pep_id', how='left')
 
     merged['sstart'] = merged['sstart'].astype(int)
     merged['send'] = merged['send'].astype(int)
-
-    moving_sum_df = calculate_moving_sum(
-        merged, value_column='mean_rpk_difference', win_size=win_size, step_size=step_size
-    )
-
-    if tsv_path is None:
-        tsv_path = os.path.join(current_app.root_path, "data", "coxsackievirusB1_P08291.tsv")
-    ev_df = parse_ev_domains_from_tsv(tsv_path)
-
-    return moving_sum_df, ev_df, debug_fasta_path
+    return merged, debug_fasta_path
     
\ No newline at end of file
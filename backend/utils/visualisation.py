@@ -1,6 +1,5 @@
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import io
@@ -8,20 +7,28 @@ import tempfile
 import os
 from flask import send_file, current_app
 from utils.collections import init_r2_client, download_file_from_r2
-from utils.viruses.enterovirus import prepare_antigen_map_df, plot_antigen_map
+from utils.viruses.enterovirus import render_antigen_map_png
+from utils.references import get_reference
+from utils.alignment import resolve_preset
 from utils.db import Session
 from utils.r2 import R2_ACCESS_KEY, R2_SECRET_KEY, R2_ENDPOINT_URL, fetch_upload_from_r2
+from utils.dataset import (
+    read_long_table, build_row_filters, compute_rpk, species_by_sample,
+    top_species_heatmap, top_species_barplot,
+    SPECIES_COLUMNS, ANTIGEN_MAP_COLUMNS, PEPTIDE_MATRIX_COLUMNS
+)
+from utils.peptide_matrix import PeptideSampleMatrix
+from utils.sample_metadata import read_sample_metadata
+from utils.plotting import new_figure, save_figure, render_many
+from utils.chunked import (
+    fits_in_memory, chunksize_for_ceiling, chunked_aggregates, sum_count_partial, DEFAULT_MEMORY_CEILING_MB
+)
 import boto3
 from models.models import Upload, GraphText
 
 # -----------------------
 # Calculation helpers
 # -----------------------
-def compute_rpk(df, abundance_col='abundance', sample_col='sample_id'):
-    df = df.copy()
-    df['rpk'] = df.groupby(sample_col)[abundance_col].transform(lambda x: x / x.sum() * 1e5)
-    return df
-
 def normalize_coordinates(df):
     df['start'], df['end'] = np.minimum(df['start'], df['end']), np.maximum(df['start'], df['end'])
     return df
@@ -29,82 +36,80 @@ def normalize_coordinates(df):
 # -----------------------
 # Save plot helper
 # -----------------------
-def save_plot_to_file_or_buf(plt_obj, output_path=None):
+def save_plot_to_file_or_buf(fig, output_path=None):
     if output_path:
-        plt_obj.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt_obj.close()
+        save_figure(fig, output_path)
         return send_file(output_path, mimetype='image/png', as_attachment=False)
-
-    buf = io.BytesIO()
-    plt_obj.savefig(buf, format='png', dpi=300, bbox_inches='tight')
-    plt_obj.close()
-    buf.seek(0)
-    return buf.getvalue()
+    return save_figure(fig)
 
 # -----------------------
 # Plot RPK stacked bar
 # -----------------------
 def plot_rpk_stacked_barplot(df, top_n_species=10, output_path=None):
+    fig = draw_rpk_stacked_barplot(df, top_n_species)
+    return save_plot_to_file_or_buf(fig, output_path)
+
+def draw_rpk_stacked_barplot(df, top_n_species=10):
     REQUIRED_COLS = {'sample_id', 'taxon_species'}
     is_raw_df = REQUIRED_COLS.issubset(df.columns)
 
     if is_raw_df:
         if 'rpk' not in df.columns:
             df = compute_rpk(df)
-        df_agg = df.groupby(['sample_id', 'taxon_species'], as_index=False)['rpk'].sum()
-        top_species = df_agg.groupby('taxon_species')['rpk'].sum().nlargest(top_n_species).index
+        df_agg = df.groupby(['sample_id', 'taxon_species'], as_index=False, observed=True)['rpk'].sum()
+        top_species = df_agg.groupby('taxon_species', observed=True)['rpk'].sum().nlargest(top_n_species).index
         plot_df = df_agg[df_agg['taxon_species'].isin(top_species)]
         pivot_df = plot_df.pivot(index='sample_id', columns='taxon_species', values='rpk').fillna(0)
         pivot_df = pivot_df[top_species]
     else:
         pivot_df = df.copy()
 
-    fig, ax = plt.subplots(figsize=(10, 6))
-    pivot_df.plot(kind='bar', stacked=True, ax=ax)
+    fig, ax = new_figure(figsize=(10, 6))
+    x = np.arange(len(pivot_df.index))
+    bottom = np.zeros(len(pivot_df.index))
+    for species in pivot_df.columns:
+        values = pivot_df[species].to_numpy(dtype=float)
+        ax.bar(x, values, bottom=bottom, width=0.5, label=str(species))
+        bottom += values
+    ax.set_xticks(x)
+    ax.set_xticklabels(pivot_df.index, rotation=45, ha='right')
+    ax.legend(title=pivot_df.columns.name)
     ax.set_ylabel("RPK")
     ax.set_xlabel("Sample ID")
     ax.set_title("Stacked Bar Plot of RPK per Species")
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-
-    img_bytes = save_plot_to_file_or_buf(plt, output_path)
-    # If save_plot_to_file_or_buf returned a Response (when output_path set),
-    # propagate it upward (caller may expect a Response).
-    if output_path:
-        return img_bytes
-    # Otherwise it's bytes
-    return img_bytes
+    fig.tight_layout()
+    return fig
 
 # -----------------------
 # Plot RPK heatmap
 # -----------------------
 def plot_rpk_heatmap(df, top_n_species=20, output_path=None):
+    fig = draw_rpk_heatmap(df, top_n_species)
+    return save_plot_to_file_or_buf(fig, output_path)
+
+def draw_rpk_heatmap(df, top_n_species=20):
     REQUIRED_COLS = {'sample_id', 'taxon_species'}
     is_raw_df = REQUIRED_COLS.issubset(df.columns)
 
     if is_raw_df:
         if 'rpk' not in df.columns:
             df = compute_rpk(df)
-        df_agg = df.groupby(['sample_id', 'taxon_species'], as_index=False)['rpk'].sum()
-        top_species = df_agg.groupby('taxon_species')['rpk'].sum().nlargest(top_n_species).index
+        df_agg = df.groupby(['sample_id', 'taxon_species'], as_index=False, observed=True)['rpk'].sum()
+        top_species = df_agg.groupby('taxon_species', observed=True)['rpk'].sum().nlargest(top_n_species).index
         df_agg = df_agg[df_agg['taxon_species'].isin(top_species)]
         pivot_df = df_agg.pivot(index='taxon_species', columns='sample_id', values='rpk').fillna(0)
     else:
         pivot_df = df.copy()
 
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig, ax = new_figure(figsize=(12, 8))
     cax = ax.imshow(pivot_df.values, aspect='auto', cmap='viridis')
     ax.set_xticks(np.arange(len(pivot_df.columns)))
     ax.set_xticklabels(pivot_df.columns, rotation=45, ha='right')
     ax.set_yticks(np.arange(len(pivot_df.index)))
     ax.set_yticklabels(pivot_df.index)
     fig.colorbar(cax, ax=ax, label='RPK')
-    plt.tight_layout()
-
-    img_bytes = save_plot_to_file_or_buf(plt, output_path)
-    if output_path:
-        return img_bytes
-    return img_bytes
+    fig.tight_layout()
+    return fig
 
 # -----------------------
 # Plot BLAST peptide alignment
@@ -123,14 +128,14 @@ def plot_blast_peptide_alignment(query_fasta, db_path, output_path):
     df = pd.read_csv(tmp_out, sep='\t', header=None)
     os.unlink(tmp_out)
 
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig, ax = new_figure(figsize=(12, 6))
     for _, row in df.iterrows():
         ax.plot([row[6], row[7]], [row[0], row[0]], color='blue', linewidth=2)
     ax.set_xlabel("Query amino acid position")
     ax.set_ylabel("Peptide")
     ax.set_title("BLAST Peptide Alignments")
-    plt.tight_layout()
-    return save_plot_to_file_or_buf(plt, output_path)
+    fig.tight_layout()
+    return save_plot_to_file_or_buf(fig, output_path)
 
 # -----------------------
 # Helper: Initialise R2 client
@@ -176,10 +181,117 @@ def load_upload_file(upload_id, app=None) -> str:
     except Exception as e:
         raise FileNotFoundError(f"Upload file {file_name} not found in R2: {e}")
 
+# -----------------------
+# Helper: load only the columns/rows a graph needs
+# -----------------------
+def load_upload_df(upload_id, app=None, columns=None, filters=None, with_rpk=False):
+    upload_path = load_upload_file(upload_id, app)
+    try:
+        return read_long_table(upload_path, columns=columns, filters=filters, with_rpk=with_rpk)
+    finally:
+        _remove_quietly(upload_path)
+
+def get_memory_ceiling_mb(app=None):
+    flask_app = app or current_app
+    return int(flask_app.config.get("MEMORY_CEILING_MB") or DEFAULT_MEMORY_CEILING_MB)
+
+# -----------------------
+# Helper: species x sample mean RPK (in-memory or out-of-core)
+# -----------------------
+def load_species_matrix(upload_id, app=None, filters=None):
+    ceiling = get_memory_ceiling_mb(app)
+    upload_path = load_upload_file(upload_id, app)
+    try:
+        if fits_in_memory(upload_path, SPECIES_COLUMNS, ceiling):
+            df = read_long_table(upload_path, columns=SPECIES_COLUMNS, filters=filters, with_rpk=True)
+            return species_by_sample(df)
+        chunksize = chunksize_for_ceiling(upload_path, SPECIES_COLUMNS, ceiling)
+        return chunked_aggregates(upload_path, filters, chunksize, peptides=False)['species_by_sample']
+    finally:
+        _remove_quietly(upload_path)
+
+# -----------------------
+# Helper: unique peptides + Case/Control means for the antigen map
+# -----------------------
+def load_antigen_map_inputs(upload_id, app=None, filters=None, with_species=False):
+    # `with_species` adds each peptide's taxon_species (for per-species maps)
+    ceiling = get_memory_ceiling_mb(app)
+    upload_path = load_upload_file(upload_id, app)
+    extra = ['taxon_species'] if with_species else []
+    columns = ANTIGEN_MAP_COLUMNS + extra
+    try:
+        if fits_in_memory(upload_path, columns, ceiling):
+            df = read_long_table(upload_path, columns=columns, filters=filters, with_rpk=True)
+            peptides_df = df[['pep_id', 'pep_aa'] + extra].drop_duplicates(subset=['pep_id'])
+            return peptides_df, PeptideSampleMatrix.from_long(df).mean_difference()
+        chunksize = chunksize_for_ceiling(upload_path, columns, ceiling)
+        result = chunked_aggregates(upload_path, filters, chunksize, species=False, peptide_species=with_species)
+        return result['peptides'], result['mean_diff']
+    finally:
+        _remove_quietly(upload_path)
+
+# -----------------------
+# Helper: additive partials for merging uploads (see utils/cohort.py)
+# -----------------------
+COHORT_COLUMNS = list(dict.fromkeys(SPECIES_COLUMNS + ANTIGEN_MAP_COLUMNS))
+
+def load_upload_partials(upload_id, app=None, filters=None):
+    """
+    One read of an upload reduced to (taxon_species, sample_id) and
+    (pep_id, Condition) RPK sums and counts, plus its unique peptides.
+    """
+    ceiling = get_memory_ceiling_mb(app)
+    upload_path = load_upload_file(upload_id, app)
+    try:
+        if fits_in_memory(upload_path, COHORT_COLUMNS, ceiling):
+            df = read_long_table(upload_path, columns=COHORT_COLUMNS, filters=filters, with_rpk=True)
+            return {
+                "species_sums": sum_count_partial(df, ['taxon_species', 'sample_id']),
+                "peptide_sums": sum_count_partial(df, ['pep_id', 'Condition']),
+                "peptides": df[['pep_id', 'pep_aa']].drop_duplicates(subset=['pep_id']),
+            }
+        chunksize = chunksize_for_ceiling(upload_path, COHORT_COLUMNS, ceiling)
+        result = chunked_aggregates(upload_path, filters, chunksize, partials=True)
+        return {
+            "species_sums": result['species_sums'],
+            "peptide_sums": result['peptide_sums'],
+            "peptides": result['peptides'][['pep_id', 'pep_aa']],
+        }
+    finally:
+        _remove_quietly(upload_path)
+
+# -----------------------
+# Helper: sparse peptide x sample matrix
+# -----------------------
+def load_peptide_matrix(upload_id, app=None, filters=None):
+    df = load_upload_df(upload_id, app, columns=PEPTIDE_MATRIX_COLUMNS, filters=filters, with_rpk=True)
+    return PeptideSampleMatrix.from_long(df)
+
+# -----------------------
+# Helper: sample metadata table from a metadata upload
+# -----------------------
+def load_sample_metadata(upload_id, app=None):
+    upload_path = load_upload_file(upload_id, app)
+    try:
+        return read_sample_metadata(upload_path)
+    finally:
+        _remove_quietly(upload_path)
+
+def _remove_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
 # -----------------------
 # Generate PDF
 # -----------------------
-def generate_pdf(upload_id, payload, app=None, return_buffer=False):
+def generate_pdf(upload_id, payload, app=None, return_buffer=False, antigen_map=None):
+    """
+    `antigen_map(filters, win_size, step_size, reference, preset)` returns
+    (moving_sum_df, ev_df) for antigen_map graphs; the routes pass their
+    cached alignment so a PDF never re-runs DIAMOND for a map already built.
+    """
     from fpdf import FPDF
 
     pdf = FPDF()
@@ -189,9 +301,15 @@ def generate_pdf(upload_id, payload, app=None, return_buffer=False):
     if not graphs:
         raise ValueError("No graphs specified for PDF generation")
 
-    upload_path = load_upload_file(upload_id, app)
-    df = pd.read_csv(upload_path, sep=None, engine="python")
-    df = compute_rpk(df)
+    # Graphs that share filters share one read
+    loaded = {}
+
+    def load_once(kind, graph, loader):
+        filters = build_row_filters(graph.get("samples"), graph.get("species"), graph.get("conditions"))
+        key = (kind, tuple(sorted((k, tuple(v)) for k, v in filters.items())))
+        if key not in loaded:
+            loaded[key] = loader(upload_id, app, filters=filters)
+        return loaded[key]
 
     def get_graph_text(graph_type):
         with Session() as session:
@@ -205,20 +323,8 @@ def generate_pdf(upload_id, payload, app=None, return_buffer=False):
         tmp.close()
         return tmp.name
 
-    def get_bytes_from_response(resp):
-        """Convert a response-like object to bytes."""
-        if isinstance(resp, (bytes, bytearray)):
-            return bytes(resp)
-        get_data = getattr(resp, "get_data", None)
-        if callable(get_data):
-            if hasattr(resp, "direct_passthrough"):
-                resp.direct_passthrough = False
-            return get_data()
-        data_attr = getattr(resp, "data", None)
-        if data_attr is not None:
-            return data_attr
-        raise RuntimeError("Could not extract bytes from response object")
-
+    # Prepare data sequentially, then render every chart concurrently
+    render_jobs = []
     for g in graphs:
         gtype = g.get("type", "").lower()
         if not gtype:
@@ -226,50 +332,28 @@ def generate_pdf(upload_id, payload, app=None, return_buffer=False):
 
         if gtype == "heatmap":
             top_n = int(g.get("topN", 20))
-            df_grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-            pivot = df_grouped.pivot(index='taxon_species', columns='sample_id', values='rpk').fillna(0)
-            top_species = pivot.sum(axis=1).nlargest(top_n).index
-            pivot = pivot.loc[top_species]
-            pivot = pivot[sorted(pivot.columns)]
-            resp = plot_rpk_heatmap(pivot, top_n_species=top_n, output_path=None)
-            img_bytes = get_bytes_from_response(resp)
+            pivot = top_species_heatmap(load_once("species", g, load_species_matrix), top_n)
+            render_jobs.append((gtype, (plot_rpk_heatmap, (pivot,), {"top_n_species": top_n})))
 
         elif gtype == "barplot":
             top_n = int(g.get("topN", 10))
-            df_grouped = df.groupby(['taxon_species', 'sample_id'])['rpk'].mean().reset_index()
-            pivot = df_grouped.pivot(index='sample_id', columns='taxon_species', values='rpk').fillna(0)
-            top_species = pivot.sum(axis=0).nlargest(top_n).index
-            pivot = pivot[top_species]
-            pivot = pivot.sort_index(axis=1)
-            resp = plot_rpk_stacked_barplot(pivot, top_n_species=top_n, output_path=None)
-            img_bytes = get_bytes_from_response(resp)
+            pivot = top_species_barplot(load_once("species", g, load_species_matrix), top_n)
+            render_jobs.append((gtype, (plot_rpk_stacked_barplot, (pivot,), {"top_n_species": top_n})))
 
         elif gtype == "antigen_map":
             win_size = int(g.get("win_size", 32))
             step_size = int(g.get("step_size", 4))
-            diamond_db_path = current_app.config.get(
-                "COXSACKIE_DB_PATH",
-                os.path.join(current_app.root_path, "data", "blast_databases", "coxsackievirusB1_P08291_db.dmnd")
-            )
-            cache_folder = current_app.config.get(
-                "CACHE_FOLDER",
-                os.path.join(current_app.root_path, "uploads", "cache")
-            )
-            os.makedirs(cache_folder, exist_ok=True)
-            moving_sum_df, ev_df, _ = prepare_antigen_map_df(
-                upload_id,
-                df,
-                diamond_db_path=diamond_db_path,
-                win_size=win_size,
-                step_size=step_size,
-                cache_folder=cache_folder
-            )
-            resp = plot_antigen_map(moving_sum_df, ev_df=ev_df, output_path=None)
-            img_bytes = get_bytes_from_response(resp)
-
-        else:
-            continue
+            reference = get_reference(g.get("reference"))
+            if antigen_map is None:
+                raise ValueError("No antigen map loader given for antigen_map graphs")
+            filters = build_row_filters(g.get("samples"), g.get("species"), g.get("conditions"))
+            moving_sum_df, ev_df = antigen_map(filters, win_size, step_size, reference,
+                                               resolve_preset(g.get("preset"), reference.id))
+            render_jobs.append((gtype, (render_antigen_map_png, (moving_sum_df, ev_df), {})))
+
+    images = render_many([job for _, job in render_jobs])
 
+    for (gtype, _), img_bytes in zip(render_jobs, images):
         tmp_png = get_png_file(img_bytes)
         text = get_graph_text(gtype)
 
@@ -138,12 +138,34 @@ function GraphSection({ uploadId: uploadIdProp }) {
     }
   };
 
-  const savePNG = () => {
+  const savePNG = async () => {
     if (!pngData) return;
-    const link = document.createElement('a');
-    link.href = pngData;
-    link.download = `${selectedGraph}.png`;
-    link.click();
+    // The on-screen image is a low-DPI preview; export fetches the full-resolution tier
+    try {
+      const token = localStorage.getItem('token');
+      const endpoints = {
+        heatmap: '/species_counts/png/',
+        barplot: '/species_reactivity_stacked_barplot/png/',
+        antigen_map: '/antigen_map/png/',
+      };
+      const params = selectedGraph === 'antigen_map'
+        ? { win_size: 32, step_size: 4, tier: 'full' }
+        : { ...(showInput ? { top_n_species: topN } : {}), tier: 'full' };
+      const response = await axios.get(`${backendBaseURL}${endpoints[selectedGraph]}${uploadId}`, {
+        responseType: 'blob',
+        headers: { Authorization: `Bearer ${token}` },
+        params,
+      });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `${selectedGraph}.png`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (err) {
+      console.error(err);
+      toast.error('Error exporting PNG: ' + (err.response?.data?.error || err.message));
+    }
   };
 
   const handleAddHighlight = () => {